@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# The commands, in the order they run on a tree: each one leaves what the
+# next one needs (the mesher's output is faked before prepare_solve).
+COMMANDS = [['--setup_run'], ['--prepare_solve'],
+            ['--distribute_adjoint_sources'], ['--unpack_mseed'],
+            ['--clean_mseed']]
+
+ITERATION = 'bench'
+COMPONENTS = ['MXE', 'MXN', 'MXZ']
+
+# Solver input files LASIF writes for each event, and the specfem binaries.
+INPUT_FILES = ['CMTSOLUTION', 'Par_file', 'STATIONS']
+BINARIES = ['xmeshfem3D', 'xspecfem3D', 'xcombine_vol_data',
+            'xcreate_header_file']
+
+# Runs oval_office.py as __main__, counting the filesystem calls it makes
+# through os and open (shutil, os.path and friends go through these), and
+# reports them on the way out. Calls made by the programs it runs (tar) are
+# only seen by strace.
+RUNNER = """
+import os, sys, json, atexit, runpy, __builtin__
+counts = {}
+def counted(name, function):
+    def wrapper(*args, **kwargs):
+        counts[name] = counts.get(name, 0) + 1
+        return function(*args, **kwargs)
+    return wrapper
+for name in %r:
+    if hasattr(os, name):
+        setattr(os, name, counted(name, getattr(os, name)))
+__builtin__.open = counted('open', __builtin__.open)
+def report():
+    sys.stderr.write('FS_CALLS: %%s\\n' %% json.dumps(counts))
+atexit.register(report)
+sys.argv = %r
+sys.path.insert(0, %r)
+runpy.run_path(%r, run_name='__main__')
+"""
+
+# Filesystem calls of the os module which are counted.
+FS_CALLS = ['stat', 'lstat', 'listdir', 'mkdir', 'rmdir', 'remove',
+            'unlink', 'rename', 'symlink', 'link', 'readlink', 'chdir',
+            'chmod', 'utime', 'access', 'open']
+
+
+def event_name(index):
+    return 'GCMT_event_BENCH_%05d' % (index)
+
+
+def write_file(path, size=0):
+    with open(path, 'wb') as file:
+        file.write('\0' * size)
+
+
+def make_stub(path, script):
+    with open(path, 'w') as file:
+        file.write('#!/bin/sh\n' + script)
+    os.chmod(path, 0755)
+
+
+def make_tree(root, events, stations, trace_bytes):
+    """
+    Builds a control room, parameter file, LASIF project, specfem root and
+    scratch directory for events events with stations stations each: the
+    iteration xml, LASIF's solver input files and adjoint sources (three
+    components per station, two of them zero), and raw, preprocessed and
+    synthetic archives of one trace per station and component. sbatch and
+    rsync are no-ops, and mk_daint.sh just writes the binaries. Returns
+    (parameter file, control room directory, environment).
+    """
+
+    lasif = os.path.join(root, 'lasif')
+    specfem = os.path.join(root, 'specfem')
+    for dir in ['control_room', 'bin', 'scratch/lasif/DATA',
+                'scratch/lasif/SYNTHETICS', 'lasif/ITERATIONS',
+                'lasif/SUBMISSION/' + ITERATION, 'lasif/OUTPUT',
+                'specfem/src', 'specfem/DATA/topo_bathy']:
+        os.makedirs(os.path.join(root, dir))
+
+    for command in ['sbatch', 'rsync']:
+        make_stub(os.path.join(root, 'bin', command), 'exit 0\n')
+    make_stub(os.path.join(specfem, 'mk_daint.sh'),
+              'mkdir -p bin bin.kernel\n' +
+              ''.join(['touch bin/%s bin.kernel/%s\n' % (binary, binary)
+                       for binary in BINARIES]))
+    write_file(os.path.join(specfem, 'src', 'specfem3D.F90'), 1024)
+    write_file(os.path.join(specfem, 'DATA', 'Par_file'), 1024)
+    for index in range(10):
+        write_file(os.path.join(specfem, 'DATA', 'topo_bathy',
+                                'topo_bathy_%d.dat' % (index)), 1024)
+
+    for file in ['Par_file', 'jobArray_solver_daint.sbatch',
+                 'job_mesher_daint.sbatch']:
+        write_file(os.path.join(lasif, 'SUBMISSION', ITERATION, file), 1024)
+
+    event_list = [event_name(index) for index in range(events)]
+    with open(os.path.join(lasif, 'ITERATIONS',
+                           'ITERATION_%s.xml' % (ITERATION)), 'w') as file:
+        file.write('<iteration>\n<data_preprocessing>\n'
+                   '<highpass_period>120.0</highpass_period>\n'
+                   '<lowpass_period>60.0</lowpass_period>\n'
+                   '</data_preprocessing>\n')
+        for event in event_list:
+            file.write('<event><event_name>%s</event_name></event>\n'
+                       % (event))
+        file.write('</iteration>\n')
+
+    station_names = ['S%04d.XX' % (index) for index in range(stations)]
+    traces = ['%s.%s.mseed' % (station, component)
+              for station in station_names for component in COMPONENTS]
+
+    # Adjoint sources (time, value) of trace_bytes or so: only the vertical
+    # component has windows, the others are all zero.
+    times = [index * 0.1 for index in range(max(1, trace_bytes / 32))]
+    adjoint_sources = dict(
+        (component, ''.join(['%14.6f %15.6e\n' % (t, 1e-9 if component ==
+                                                   'MXZ' else 0.)
+                             for t in times])) for component in COMPONENTS)
+    for event in event_list:
+        inputs = os.path.join(lasif, 'OUTPUT', 'input_files_ITERATION_%s__%s'
+                              % (ITERATION, event))
+        adjoints = os.path.join(lasif, 'OUTPUT', 'adjoint_sources__'
+                                'ITERATION_%s__%s' % (ITERATION, event))
+        os.makedirs(inputs)
+        os.makedirs(adjoints)
+        for file in INPUT_FILES:
+            write_file(os.path.join(inputs, file), 1024)
+        with open(os.path.join(inputs, 'STATIONS'), 'w') as file:
+            for station in station_names:
+                file.write('%s %s 0.0 0.0 0.0 0.0\n'
+                           % tuple(station.split('.')))
+        for station in station_names:
+            for component in COMPONENTS:
+                with open(os.path.join(adjoints, '%s.%s.adj' % (
+                        station, component)), 'w') as file:
+                    file.write(adjoint_sources[component])
+
+        for archive_dir in [
+                os.path.join(lasif, 'DATA', event, 'raw'),
+                os.path.join(lasif, 'DATA', event, 'preprocessed_bench'),
+                os.path.join(lasif, 'SYNTHETICS', event,
+                             'ITERATION_%s' % (ITERATION))]:
+            os.makedirs(archive_dir)
+            for trace in traces:
+                write_file(os.path.join(archive_dir, trace), trace_bytes)
+            subprocess.check_call(['tar', '-cf', 'data.tar'] + traces,
+                                  cwd=archive_dir)
+            for trace in traces:
+                os.remove(os.path.join(archive_dir, trace))
+
+    parameter_file = os.path.join(root, 'parameters.txt')
+    with open(parameter_file, 'w') as file:
+        file.write('compiler_suite cray\n'
+                   'project_name bench\n'
+                   'scratch_path %s\n'
+                   'specfem_root %s\n'
+                   'lasif_path %s\n'
+                   'iteration_name %s\n'
+                   'executor slurm\n'
+                   % (os.path.join(root, 'scratch'), specfem, lasif,
+                      ITERATION))
+
+    environment = dict(os.environ)
+    environment['PATH'] = os.path.join(root, 'bin') + os.pathsep + \
+        environment.get('PATH', '')
+
+    return parameter_file, os.path.join(root, 'control_room'), environment
+
+
+def fake_mesher(root, mesh_files):
+    """
+    Fills the mesh directory the way the mesher would: mesh_files database
+    files, and a few output files.
+    """
+
+    mesh = os.path.join(root, 'scratch', 'bench', ITERATION, 'mesh')
+    for index in range(mesh_files):
+        write_file(os.path.join(mesh, 'DATABASES_MPI',
+                                'proc%06d_reg1_solver_data.bin' % (index)))
+    for file in ['output_mesher.txt', 'values_from_mesher.h']:
+        write_file(os.path.join(mesh, 'OUTPUT_FILES', file), 1024)
+
+
+def run_command(command, parameter_file, control_room, environment,
+                use_strace):
+    """
+    Runs oval_office.py with a command in a fresh interpreter. Returns the
+    wall time, the counted filesystem calls (a dictionary), and the number
+    of syscalls strace saw (or None).
+    """
+
+    oval_office = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'oval_office.py')
+    argv = [oval_office, '-f', parameter_file] + command
+    if command == ['--unpack_mseed']:
+        argv += ['--event_name', event_name(0)]
+    runner = RUNNER % (FS_CALLS, argv, os.path.dirname(oval_office),
+                       oval_office)
+
+    prefix, strace_output = [], None
+    if use_strace:
+        strace_output = os.path.join(control_room, 'strace.txt')
+        prefix = ['strace', '-f', '-c', '-o', strace_output]
+
+    start = time.time()
+    process = subprocess.Popen(prefix + [sys.executable, '-c', runner],
+                               cwd=control_room, env=environment,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, error = process.communicate()
+    elapsed = time.time() - start
+    if process.returncode != 0:
+        raise RuntimeError('%s failed:\n%s' % (' '.join(command), error))
+
+    calls = {}
+    for line in error.splitlines():
+        if line.startswith('FS_CALLS:'):
+            calls = json.loads(line[len('FS_CALLS:'):])
+
+    return elapsed, calls, read_strace(strace_output)
+
+
+def read_strace(path):
+    """
+    Reads the total number of syscalls from an strace -c summary.
+    """
+
+    if path is None or not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if fields and fields[-1] == 'total':
+                return int(fields[2])
+
+    return None
+
+
+def benchmark(events, args):
+    """
+    Runs every command on fresh trees of a size, args.repeat times. Returns
+    a dictionary of command -> (median wall time, filesystem calls,
+    syscalls) of the run with the median time.
+    """
+
+    runs = dict((command[0], []) for command in COMMANDS)
+    for _ in range(args.repeat):
+        root = tempfile.mkdtemp(prefix='oval_office_filesystem.')
+        try:
+            parameter_file, control_room, environment = make_tree(
+                root, events, args.stations, args.trace_bytes)
+            for command in COMMANDS:
+                if command == ['--prepare_solve']:
+                    fake_mesher(root, args.mesh_files)
+                runs[command[0]].append(run_command(
+                    command, parameter_file, control_room, environment,
+                    args.strace))
+        finally:
+            shutil.rmtree(root)
+
+    results = {}
+    for command, times in runs.items():
+        elapsed, calls, syscalls = sorted(times)[len(times) / 2]
+        results[command] = {'time': elapsed, 'calls': calls,
+                            'fs_calls': sum(calls.values()),
+                            'syscalls': syscalls}
+
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measures how the '
+                                     'filesystem commands of oval_office.py '
+                                     'scale with the number of events: each '
+                                     'command runs against generated LASIF '
+                                     'and solver trees (sbatch, rsync and '
+                                     'the compilation stubbed out), and its '
+                                     'wall time and filesystem calls are '
+                                     'recorded.')
+    parser.add_argument('--events', type=int, nargs='+', default=[10, 100],
+                        help='Tree sizes (number of events) to run.')
+    parser.add_argument('--stations', type=int, default=50,
+                        help='Stations per event (three components each).')
+    parser.add_argument('--mesh_files', type=int, default=384,
+                        help='Files the fake mesher writes to '
+                        'DATABASES_MPI.')
+    parser.add_argument('--trace_bytes', type=int, default=4096,
+                        help='Size of each trace and adjoint source.')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per '
+                        'size (the median is reported).')
+    parser.add_argument('--strace', action='store_true', help='Also count '
+                        'every syscall (tar included) with strace -f.')
+    parser.add_argument('--output', type=str, help='Write the results to '
+                        'this json file.')
+    parser.add_argument('--baseline', type=str, help='Json file of an '
+                        'earlier run to compare with.')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+
+    results = {}
+    print '%-8s %-30s %10s %10s %10s %9s' % (
+        'events', 'command', 'time (s)', 'fs calls', 'syscalls', 'vs base')
+    for events in args.events:
+        results[str(events)] = benchmark(events, args)
+        for command in COMMANDS:
+            result = results[str(events)][command[0]]
+            base = baseline.get(str(events), {}).get(command[0])
+            print '%-8d %-30s %10.3f %10d %10s %9s' % (
+                events, command[0], result['time'], result['fs_calls'],
+                result['syscalls'] if result['syscalls'] is not None
+                else '-', '%.2fx' % (result['time'] / base['time'])
+                if base else '-')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
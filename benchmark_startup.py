@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# Commands which only call sbatch/rsync or read the catalogue, and should
+# start in well under a second on a login node.
+LIGHT_COMMANDS = [['--help'], ['--status'], ['--sync_lasif'],
+                  ['--submit_mesher'], ['--build_all_caches']]
+
+# Modules the light commands must not import.
+HEAVY_MODULES = ['numpy', 'scipy', 'obspy', 'matplotlib']
+
+# Runs oval_office.py as __main__, and reports the heavy modules it loaded
+# on the way out (argparse --help exits early, so this uses atexit).
+RUNNER = """
+import sys, atexit, runpy
+def report():
+    sys.stderr.write('HEAVY_MODULES: %%s\\n' %% ' '.join(
+        [name for name in %r if name in sys.modules]))
+atexit.register(report)
+sys.argv = %r
+sys.path.insert(0, %r)
+runpy.run_path(%r, run_name='__main__')
+"""
+
+
+def make_fixture(root):
+    """
+    Builds a throwaway control room, parameter file and LASIF/scratch tree
+    for the light commands to run against, with sbatch and rsync replaced by
+    no-ops. Returns (parameter file, control room directory, environment).
+    """
+
+    for dir in ['control_room/components', 'lasif/EVENTS', 'lasif/DATA',
+                'lasif/SYNTHETICS', 'scratch/lasif/DATA',
+                'scratch/lasif/SYNTHETICS', 'specfem',
+                'scratch/bench/ITERATION_bench/mesh', 'bin']:
+        os.makedirs(os.path.join(root, dir))
+
+    for command in ['sbatch', 'rsync']:
+        path = os.path.join(root, 'bin', command)
+        with open(path, 'w') as file:
+            file.write('#!/bin/sh\nexit 0\n')
+        os.chmod(path, 0755)
+
+    parameter_file = os.path.join(root, 'parameters.txt')
+    with open(parameter_file, 'w') as file:
+        file.write('compiler_suite cray\n'
+                   'project_name bench\n'
+                   'scratch_path %s\n'
+                   'specfem_root %s\n'
+                   'lasif_path %s\n'
+                   'iteration_name ITERATION_bench\n'
+                   % (os.path.join(root, 'scratch'),
+                      os.path.join(root, 'specfem'),
+                      os.path.join(root, 'lasif')))
+
+    # The catalogue goes to the home directory by default.
+    environment = dict(os.environ)
+    environment['HOME'] = root
+    environment['PATH'] = os.path.join(root, 'bin') + os.pathsep + \
+        environment.get('PATH', '')
+
+    return parameter_file, os.path.join(root, 'control_room'), environment
+
+
+def time_command(command, parameter_file, control_room, environment):
+    """
+    Runs oval_office.py with a command in a fresh interpreter. Returns the
+    wall time and the heavy modules it imported.
+    """
+
+    oval_office = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'oval_office.py')
+    argv = [oval_office, '-f', parameter_file] + command
+    runner = RUNNER % (HEAVY_MODULES, argv, os.path.dirname(oval_office),
+                       oval_office)
+
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-c', runner],
+                               cwd=control_room, env=environment,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, error = process.communicate()
+    elapsed = time.time() - start
+
+    heavy = []
+    for line in error.splitlines():
+        if line.startswith('HEAVY_MODULES:'):
+            heavy = line.split()[1:]
+
+    return elapsed, heavy, process.returncode, error
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Times how long the light '
+                                     'commands of oval_office.py take to '
+                                     'start, and checks that they import no '
+                                     'heavy modules.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per '
+                        'command (the median is reported).')
+    parser.add_argument('--budget', type=float, default=0.3, help='Largest '
+                        'acceptable median time (s).')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='oval_office_startup.')
+    failed = False
+    try:
+        parameter_file, control_room, environment = make_fixture(root)
+        print '%-25s %10s  %s' % ('command', 'median (s)', 'heavy imports')
+        for command in LIGHT_COMMANDS:
+            times = []
+            for _ in range(args.repeat):
+                elapsed, heavy, code, error = time_command(
+                    command, parameter_file, control_room, environment)
+                times.append(elapsed)
+            median = sorted(times)[len(times) / 2]
+
+            problems = []
+            if code != 0:
+                problems.append('exit code %d' % (code))
+            if median > args.budget:
+                problems.append('over budget')
+            if heavy:
+                problems.append('imports ' + ', '.join(heavy))
+            failed = failed or bool(problems)
+
+            print '%-25s %10.3f  %s' % (' '.join(command), median,
+                                        '; '.join(problems) or '-')
+            if code != 0:
+                print error
+    finally:
+        shutil.rmtree(root)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
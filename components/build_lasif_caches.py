@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import argparse
+
+from classes import lasif_cache
+
+
+def build(lasif_path, kind, name):
+    """
+    Builds the LASIF caches of one entry: the station caches, or the
+    waveform caches (raw, every processing tag and every iteration's
+    synthetics) of one event.
+    """
+
+    from lasif.components.project import Project
+
+    comm = Project(lasif_path, init_project=False).comm
+    if kind == lasif_cache.STATIONS:
+        comm.stations.force_cache_update()
+        return
+
+    waveforms = comm.waveforms
+    waveforms.get_metadata_raw(name)
+    for tag in waveforms.get_available_processing_tags(name):
+        waveforms.get_metadata_processed(name, tag)
+    for iteration in waveforms.get_available_synthetics(name):
+        waveforms.get_metadata_synthetic(name, iteration)
+
+
+# ---
+parser = argparse.ArgumentParser(description='Builds the LASIF caches of '
+                                 'one entry (the stations, or an event) of '
+                                 'an incremental cache build, lists the '
+                                 'cache files it wrote, and records the '
+                                 'signature it was built from.')
+parser.add_argument('action', choices=['build', 'files', 'record'])
+parser.add_argument('lasif_path', type=str, help='LASIF project (for '
+                    'record: the signature store).')
+parser.add_argument('kind', choices=[lasif_cache.STATIONS, lasif_cache.EVENT])
+parser.add_argument('name', type=str, help='Event name (or stations).')
+parser.add_argument('--since', type=float, help='With files: only list cache '
+                    'files modified after this POSIX time.')
+parser.add_argument('--signature', type=str, help='With record: signature '
+                    'of the inputs the entry was built from.')
+# ---
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    if args.action == 'build':
+        build(args.lasif_path, args.kind, args.name)
+    elif args.action == 'files':
+        for path in lasif_cache.cache_files(
+                args.lasif_path, args.kind, args.name,
+                lasif_cache.list_events(args.lasif_path), args.since):
+            print path
+    else:
+        if args.signature is None:
+            parser.error('record needs --signature.')
+        lasif_cache.SignatureStore(args.lasif_path).record(
+            args.kind, args.name, args.signature)
+        print 'Recorded %s %s' % (args.kind, args.name)
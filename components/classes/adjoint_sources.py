@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import os
+import errno
+import shutil
+import hashlib
+
+# Adjoint sources are named STA.NET.CHA.adj, with one per component for
+# every adjoint station; the solver needs all of them.
+ADJOINT_SUFFIX = '.adj'
+COMPONENTS = 'ENZ'
+
+
+def station_channels(name):
+    """
+    Splits an adjoint source name (i.e. FURT.BW.MXZ.adj) into its station
+    (FURT.BW) and channel (MXZ).
+    """
+
+    station, _, channel = name[:-len(ADJOINT_SUFFIX)].rpartition('.')
+    return station, channel
+
+
+def read_adjoint_source(path):
+    """
+    Reads an adjoint source (two columns: time, value). Returns (the
+    columns, whether every value is zero).
+    """
+
+    with open(path, 'r') as file:
+        columns = file.read().split()
+
+    # A value is zero if it has no digit but 0 (0.0, -0.000000e+00, ...).
+    zero = not [value for value in columns[1::2] if value.strip('+-.0eE')]
+
+    return columns, zero
+
+
+def zero_trace(columns):
+    """
+    An all-zero adjoint source on the time axis of another (as read by
+    read_adjoint_source).
+    """
+
+    return ' 0.0\n'.join(columns[0::2]) + ' 0.0\n'
+
+
+def place(source, destination):
+    """
+    Puts a file at destination as a hardlink to source, or as a copy when
+    they are on different filesystems (or source has too many links).
+    Replaces whatever was at destination. Returns True if it linked.
+    """
+
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return True
+    except OSError as exception:
+        if exception.errno not in [errno.EXDEV, errno.EMLINK, errno.EPERM]:
+            raise
+
+    shutil.copy(source, destination)
+    return False
+
+
+def copy_pair(pair):
+    """
+    Copies pair[0] to pair[1], replacing whatever was there.
+    """
+
+    source, destination = pair
+    if os.path.lexists(destination):
+        os.remove(destination)
+    shutil.copy(source, destination)
+
+
+class ZeroStore(object):
+
+    def __init__(self, path):
+        """
+        Keeps one file of each all-zero adjoint source (one per time axis),
+        which the SEM directories hardlink to instead of holding their own
+        copies. When a file has as many links as the filesystem allows,
+        another copy is started.
+
+        :path: Directory of the store. Must be on the same filesystem as the
+        SEM directories.
+        """
+
+        self.path = path
+        self.keys = {}
+        self.written = set()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def link(self, columns, destination):
+        """
+        Puts the zero trace on the time axis of an adjoint source (its
+        columns, see read_adjoint_source) at destination.
+        """
+
+        times = tuple(columns[0::2])
+        if times not in self.keys:
+            contents = zero_trace(columns)
+            self.keys[times] = (hashlib.sha1(contents).hexdigest(), contents)
+        key, contents = self.keys[times]
+
+        copy = 0
+        while True:
+            source = os.path.join(self.path, '%s.%d%s' % (key, copy,
+                                                          ADJOINT_SUFFIX))
+            if source not in self.written and not os.path.exists(source):
+                with open(source + '.part', 'w') as file:
+                    file.write(contents)
+                os.rename(source + '.part', source)
+            self.written.add(source)
+
+            if os.path.lexists(destination):
+                os.remove(destination)
+            try:
+                os.link(source, destination)
+                return
+            except OSError as exception:
+                if exception.errno == errno.EMLINK:
+                    copy += 1
+                    continue
+                if exception.errno not in [errno.EXDEV, errno.EPERM]:
+                    raise
+                shutil.copy(source, destination)
+                return
+
+
+def distribute(sources, sem_dir, zeros, pool=None):
+    """
+    Populates an SEM directory with adjoint sources. All-zero sources, and
+    the components missing for an adjoint station, become hardlinks to a
+    shared zero trace (see ZeroStore); the others are hardlinked from where
+    they are, or, if that can't be done, copied (on the threads of pool, if
+    given). Returns (adjoint station names, number of real sources, number
+    of zero ones).
+
+    :sources: Paths of the adjoint sources of an event.
+    :sem_dir: SEM directory of the event.
+    :zeros: ZeroStore.
+    :pool: Optional multiprocessing.pool.ThreadPool to copy with.
+    """
+
+    stations = {}
+    for source in sources:
+        station, channel = station_channels(os.path.basename(source))
+        stations.setdefault(station, {})[channel] = source
+
+    real, n_zero = [], 0
+    for station in sorted(stations):
+        channels = stations[station]
+        template = None
+        for channel in sorted(channels):
+            columns, zero = read_adjoint_source(channels[channel])
+            template = template or columns
+            destination = os.path.join(sem_dir, os.path.basename(
+                channels[channel]))
+            if zero:
+                zeros.link(columns, destination)
+                n_zero += 1
+            else:
+                real.append((channels[channel], destination))
+
+        band = sorted(channels)[0][:-1]
+        for component in COMPONENTS:
+            if band + component not in channels:
+                zeros.link(template, os.path.join(
+                    sem_dir, '%s.%s%s%s' % (station, band, component,
+                                            ADJOINT_SUFFIX)))
+                n_zero += 1
+
+    # If the first one can be linked, they all can (bar the odd one with too
+    # many links); otherwise they are copied.
+    copies = real[1:]
+    if real and place(*real[0]):
+        copies = [pair for pair in real[1:] if not place(*pair)]
+    if pool is not None:
+        pool.map(copy_pair, copies)
+    else:
+        map(copy_pair, copies)
+
+    return sorted(set([station.split('.')[0] for station in stations])), \
+        len(real), n_zero
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import math
+import numpy as np
+
+# Walltimes (s) requests are rounded up to. The short ones fit the backfill.
+WALLTIMES = [900, 1800, 3600, 7200, 14400, 21600, 43200, 86400]
+
+
+class ArrayPlanner(object):
+
+    def __init__(self, history, trace_counts, max_cores=8,
+                 default_walltime=None, safety=1.5, margin=300,
+                 pack_walltime=900, packable=True):
+        """
+        Decides how to submit the events of an array stage, from the
+        runtimes recorded for the stage in earlier iterations (see
+        telemetry.py) and the number of traces of each event. Events which
+        are predicted to be short are packed together into one array task,
+        large events get the full node, and walltimes are requested from the
+        predictions rather than the worst case, so short jobs fit into the
+        backfill.
+
+        :history: Task records of this stage (Catalogue.tasks).
+        :trace_counts: Dictionary of event -> number of traces.
+        :max_cores: Most cores a task can be given.
+        :default_walltime: Walltime (s) when there is no history to go on. None
+        leaves it to the #SBATCH line of the script.
+        :safety: Factor applied to predicted runtimes.
+        :margin: Seconds added to every walltime request.
+        :pack_walltime: Predicted runtime (s) below which events are packed
+        together, and the most predicted work a packed task gets.
+        :packable: Whether the stage's script can run several events per task.
+        """
+
+        self.trace_counts = trace_counts
+        self.max_cores = max_cores
+        self.default_walltime = default_walltime
+        self.safety = safety
+        self.margin = margin
+        self.pack_walltime = pack_walltime
+        self.packable = packable
+
+        finished = [task for task in history
+                    if task.get('walltime') and task.get('state') == 'COMPLETED']
+
+        # The longest finished run of each event, and the longest run of each
+        # event that was killed for running out of time. Packed tasks (with
+        # several events) say nothing about single events.
+        self.event_walltime = {}
+        self.event_timeout = {}
+        for task in history:
+            if not task.get('walltime') or not task.get('event') or \
+                    ' ' in task['event']:
+                continue
+            if task.get('state') == 'COMPLETED':
+                table = self.event_walltime
+            elif task.get('state') == 'TIMEOUT':
+                table = self.event_timeout
+            else:
+                continue
+            table[task['event']] = max(table.get(task['event'], 0),
+                                       task['walltime'])
+
+        # Runtime as a linear function of the number of traces.
+        points = [(trace_counts[event], walltime) for event, walltime in
+                  self.event_walltime.items() if event in trace_counts]
+        self.intercept, self.slope = None, None
+        if len(set([traces for traces, _ in points])) > 1:
+            self.slope, self.intercept = np.polyfit(
+                [traces for traces, _ in points],
+                [walltime for _, walltime in points], 1)
+            self.slope = max(self.slope, 0.)
+            self.intercept = max(self.intercept, 0.)
+        elif points:
+            self.slope = np.median([walltime / max(traces, 1)
+                                    for traces, walltime in points])
+            self.intercept = 0.
+
+        # Number of cores the stage actually keeps busy.
+        busy = [task['cpu_time'] / task['walltime'] for task in finished
+                if task.get('cpu_time') is not None]
+        if busy:
+            self.cores = int(min(max_cores, max(1, math.ceil(
+                1.25 * np.median(busy)))))
+        else:
+            self.cores = max_cores
+
+    def predict(self, event):
+        """
+        Predicted runtime (s) of an event, or None if there is nothing to
+        base a prediction on.
+        """
+
+        if event in self.event_timeout:
+            return max(2 * self.event_timeout[event],
+                       self.event_walltime.get(event, 0))
+        if event in self.event_walltime:
+            return self.event_walltime[event]
+        if self.slope is not None and event in self.trace_counts:
+            return self.intercept + self.slope * self.trace_counts[event]
+
+        return None
+
+    def request(self, runtime):
+        """
+        Walltime (s) to request for a predicted runtime. Requests are rounded
+        up onto a short ladder of walltimes, so events with similar runtimes
+        end up in the same submission.
+        """
+
+        if runtime is None:
+            return self.default_walltime
+
+        seconds = runtime * self.safety + self.margin
+        for walltime in WALLTIMES:
+            if seconds <= walltime:
+                return walltime
+
+        return WALLTIMES[-1]
+
+    def plan(self, indexed_events):
+        """
+        Plans the submissions for a list of (array index, event) tuples.
+        Returns a list of submissions, each a dictionary with the walltime
+        ('time', s), cores per task ('cpus'), and the tasks: a list of lists
+        of array indices, one list per array task.
+        """
+
+        predictions = dict((index, self.predict(event))
+                           for index, event in indexed_events)
+        known = [runtime for runtime in predictions.values()
+                 if runtime is not None]
+        large = 2 * np.median(known) if known else None
+
+        tasks = []
+        small = []
+        for index, event in indexed_events:
+            runtime = predictions[index]
+            if self.packable and runtime is not None and \
+                    runtime < self.pack_walltime:
+                small.append((runtime, index))
+            elif runtime is not None and large and runtime > large:
+                tasks.append(([index], runtime, self.max_cores))
+            else:
+                tasks.append(([index], runtime, self.cores))
+
+        # First fit decreasing: longest small events first, each into the
+        # first packed task with room left.
+        packed = []
+        for runtime, index in sorted(small, reverse=True):
+            for task in packed:
+                if task[1] + runtime <= self.pack_walltime:
+                    task[0].append(index)
+                    task[1] += runtime
+                    break
+            else:
+                packed.append([[index], runtime])
+        tasks.extend([(sorted(indices), runtime, self.cores)
+                      for indices, runtime in packed])
+
+        # One submission per (walltime, cores) class.
+        submissions = {}
+        for indices, runtime, cores in tasks:
+            key = (self.request(runtime), cores)
+            submissions.setdefault(key, []).append(indices)
+
+        return [{'time': time, 'cpus': cores, 'tasks': sorted(task_list)}
+                for (time, cores), task_list in sorted(submissions.items())]
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import os
+import time
+import shutil
+import hashlib
+
+# Files and directories of the specfem tree that make up a build, relative to
+# the specfem root. Under setup/ only the templates count, since configure
+# writes the rest.
+SOURCE_DIRS = ['src']
+SOURCE_FILES = ['configure', 'Makefile.in', 'flags.guess', 'mk_daint.sh',
+                'change_simulation_type.pl']
+SETUP_DIR = 'setup'
+
+# Output directory of mk_daint.sh for each simulation mode.
+MODE_BINARIES = {'forward': 'bin.forward', 'adjoint': 'bin.kernel'}
+
+# Header the build writes to OUTPUT_FILES, describing the mesh it was
+# compiled for.
+MESHER_HEADER = 'values_from_mesher.h'
+
+
+def hash_file(digest, path, block_size=2**20):
+    """
+    Feeds the contents of a file into a hashlib digest.
+    """
+
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), ''):
+            digest.update(block)
+
+
+def source_fingerprint(specfem_root):
+    """
+    Returns a sha1 of the names and contents of every source file in a
+    specfem tree (see SOURCE_DIRS and SOURCE_FILES). Object files, binaries
+    and files written by configure don't count.
+
+    :specfem_root: Path to the specfem root directory.
+    """
+
+    paths = [name for name in SOURCE_FILES
+             if os.path.isfile(os.path.join(specfem_root, name))]
+    setup_dir = os.path.join(specfem_root, SETUP_DIR)
+    if os.path.isdir(setup_dir):
+        paths.extend([os.path.join(SETUP_DIR, name) for name in
+                      os.listdir(setup_dir) if name.endswith('.in')])
+    for source_dir in SOURCE_DIRS:
+        for root, dirs, files in os.walk(os.path.join(specfem_root,
+                                                      source_dir)):
+            dirs.sort()
+            paths.extend([os.path.relpath(os.path.join(root, file),
+                                          specfem_root) for file in files])
+
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        digest.update(path + '\0')
+        hash_file(digest, os.path.join(specfem_root, path))
+
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+
+    def __init__(self, cache_dir, keep=5):
+        """
+        Keeps the binaries of finished specfem builds, keyed on everything
+        that goes into them: the compiler suite, the simulation mode, the
+        Par_file (whose values are compiled in) and the source tree. A build
+        whose key is already in the cache can be copied back instead of
+        running mk_daint.sh again.
+
+        :cache_dir: Directory holding one sub-directory per build.
+        :keep: Number of builds to keep. The least recently used ones are
+        removed when a new build is stored.
+        """
+
+        self.cache_dir = cache_dir
+        self.keep = keep
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, specfem_root, compiler_suite, mode):
+        """
+        Returns the cache key of a build of the specfem tree as it is now.
+        The Par_file must already be the one the build is for.
+        """
+
+        digest = hashlib.sha1()
+        digest.update(compiler_suite + '\0' + mode + '\0')
+        hash_file(digest, os.path.join(specfem_root, 'DATA', 'Par_file'))
+        digest.update(source_fingerprint(specfem_root))
+
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def contains(self, key):
+        return os.path.isdir(self.path(key))
+
+    def store(self, key, specfem_root, mode):
+        """
+        Copies a finished build into the cache: bin, the mode's binary
+        directory, the Par_file as mk_daint.sh left it (it sets the
+        simulation type), and the OUTPUT_FILES/values_from_mesher.h it wrote.
+        Does nothing if the build didn't produce an xspecfem3D.
+        """
+
+        binaries = MODE_BINARIES[mode]
+        if not os.path.exists(os.path.join(specfem_root, binaries,
+                                           'xspecfem3D')):
+            return False
+
+        # Copy into a temporary directory first, so an interrupted copy is
+        # never mistaken for a build.
+        entry = self.path(key)
+        partial = entry + '.part'
+        if os.path.isdir(partial):
+            shutil.rmtree(partial)
+        os.makedirs(partial)
+        for dir in ['bin', binaries]:
+            shutil.copytree(os.path.join(specfem_root, dir),
+                            os.path.join(partial, dir), symlinks=True)
+        shutil.copy2(os.path.join(specfem_root, 'DATA', 'Par_file'), partial)
+        header = os.path.join(specfem_root, 'OUTPUT_FILES', MESHER_HEADER)
+        if os.path.exists(header):
+            shutil.copy2(header, partial)
+        if os.path.isdir(entry):
+            shutil.rmtree(entry)
+        os.rename(partial, entry)
+
+        self.prune()
+        return True
+
+    def restore(self, key, specfem_root, mode):
+        """
+        Copies a cached build back into the specfem tree, replacing bin, the
+        mode's binary directory and DATA/Par_file. The tree is first cleaned
+        up the way mk_daint.sh does before a build (OUTPUT_FILES emptied, and
+        all the binary directories removed), so nothing of the previous build
+        is left behind, and the build's values_from_mesher.h is put back.
+        """
+
+        entry = self.path(key)
+        output_files = os.path.join(specfem_root, 'OUTPUT_FILES')
+        if os.path.isdir(output_files):
+            for name in os.listdir(output_files):
+                path = os.path.join(output_files, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        for dir in ['bin'] + MODE_BINARIES.values():
+            target = os.path.join(specfem_root, dir)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+
+        for dir in ['bin', MODE_BINARIES[mode]]:
+            shutil.copytree(os.path.join(entry, dir),
+                            os.path.join(specfem_root, dir), symlinks=True)
+        shutil.copy2(os.path.join(entry, 'Par_file'),
+                     os.path.join(specfem_root, 'DATA', 'Par_file'))
+        if os.path.exists(os.path.join(entry, MESHER_HEADER)):
+            shutil.copy2(os.path.join(entry, MESHER_HEADER), output_files)
+
+        # Mark the build as recently used.
+        os.utime(entry, None)
+
+    def prune(self):
+        """
+        Removes all but the keep most recently used builds.
+        """
+
+        entries = [os.path.join(self.cache_dir, name) for name in
+                   os.listdir(self.cache_dir) if not name.endswith('.part')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for entry in entries[self.keep:]:
+            shutil.rmtree(entry)
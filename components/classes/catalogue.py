@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import errno
+import hashlib
+import sqlite3
+import tempfile
+
+from waveform_archive import is_archive
+
+# Outputs which don't belong to an iteration (i.e. raw data) are recorded
+# under this iteration name.
+ANY_ITERATION = ''
+
+TASK_FIELDS = ['job_id', 'task_id', 'iteration', 'event', 'stage', 'state',
+               'queue_wait', 'walltime', 'cpu_time', 'cpus', 'max_rss']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    iteration TEXT NOT NULL,
+    event TEXT NOT NULL,
+    PRIMARY KEY (iteration, event)
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    iteration TEXT NOT NULL,
+    event TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    path TEXT NOT NULL PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    checksum TEXT,
+    recorded REAL
+);
+CREATE INDEX IF NOT EXISTS outputs_by_event
+    ON outputs (iteration, event, stage);
+CREATE TABLE IF NOT EXISTS tasks (
+    job_id TEXT NOT NULL,
+    task_id INTEGER NOT NULL,
+    iteration TEXT,
+    event TEXT,
+    stage TEXT,
+    state TEXT,
+    queue_wait REAL,
+    walltime REAL,
+    cpu_time REAL,
+    cpus INTEGER,
+    max_rss INTEGER,
+    PRIMARY KEY (job_id, task_id)
+);
+CREATE TABLE IF NOT EXISTS scans (
+    path TEXT NOT NULL PRIMARY KEY,
+    mtime REAL
+);
+"""
+
+# Records written by array tasks wait in a directory next to the database
+# (see Journal) until the next command that opens it takes them in.
+JOURNAL_SUFFIX = '.records'
+
+
+def md5sum(path, block_size=2**20):
+    """
+    Returns the md5 checksum of a file, read in blocks.
+    """
+
+    digest = hashlib.md5()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), ''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class Catalogue(object):
+
+    def __init__(self, path):
+        """
+        A small SQLite database keeping track of which events belong to an
+        iteration, and which outputs (archives, directories) each stage has
+        produced for them. Stages add to it as they finish, so commands can
+        ask it what exists instead of walking the file system.
+
+        :path: Location of the database file.
+        """
+
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=300)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def add_events(self, iteration, events):
+        """
+        Registers the events of an iteration, in order.
+        """
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO events VALUES (?, ?)',
+                [(iteration, event) for event in events])
+
+    def events(self, iteration):
+        """
+        Returns the events registered for an iteration, in the order they
+        were added.
+        """
+
+        rows = self.connection.execute(
+            'SELECT event FROM events WHERE iteration = ? ORDER BY rowid',
+            (iteration,))
+
+        return [row['event'] for row in rows]
+
+    def record(self, iteration, event, stage, path, checksum=False):
+        """
+        Records (or updates) an output (see describe_output).
+
+        :iteration: Iteration name, or ANY_ITERATION.
+        :event: Event name.
+        :stage: Name of the stage which produced the output.
+        :path: Path to the output.
+        :checksum: Whether to compute the md5 checksum of a file.
+        """
+
+        self.insert_outputs([describe_output(iteration, event, stage, path,
+                                             checksum)])
+
+    def insert_outputs(self, rows):
+        """
+        Records (or updates) outputs from rows made by describe_output.
+        """
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [tuple(row) for row in rows])
+
+    def ingest(self, journal_path):
+        """
+        Takes in the records the array tasks have left in a journal (see
+        Journal), oldest first, and removes them. Returns the number of
+        outputs recorded.
+        """
+
+        files = Journal(journal_path).files()
+        rows = []
+        for file in files:
+            try:
+                with open(file, 'r') as input:
+                    rows.extend(json.load(input))
+            except IOError as exception:
+                # Taken in by another command in the meantime.
+                if exception.errno != errno.ENOENT:
+                    raise
+        rows.sort(key=lambda row: row[-1])
+        self.insert_outputs(rows)
+
+        for file in files:
+            try:
+                os.remove(file)
+            except OSError as exception:
+                if exception.errno != errno.ENOENT:
+                    raise
+
+        return len(rows)
+
+    def scanned(self, path):
+        """
+        Returns the modification time a directory had when it was last
+        scanned (see mark_scanned), or None.
+        """
+
+        row = self.connection.execute('SELECT mtime FROM scans WHERE path = ?',
+                                      (os.path.abspath(path),)).fetchone()
+
+        return None if row is None else row['mtime']
+
+    def mark_scanned(self, path, mtime):
+        """
+        Remembers that a directory has been scanned when its modification
+        time was mtime.
+        """
+
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO scans VALUES (?, ?)',
+                                    (os.path.abspath(path), mtime))
+
+    def forget(self, path):
+        """
+        Removes an output, i.e. after an archive has been unpacked.
+        """
+
+        with self.connection:
+            self.connection.execute('DELETE FROM outputs WHERE path = ?',
+                                    (os.path.abspath(path),))
+
+    def outputs(self, iteration=None, event=None, stage=None):
+        """
+        Returns the recorded outputs, optionally limited to an iteration,
+        event and/or stage. Outputs recorded under ANY_ITERATION are returned
+        for every iteration.
+        """
+
+        query = 'SELECT * FROM outputs WHERE 1'
+        values = []
+        if iteration is not None:
+            query += ' AND iteration IN (?, ?)'
+            values.extend([iteration, ANY_ITERATION])
+        if event is not None:
+            query += ' AND event = ?'
+            values.append(event)
+        if stage is not None:
+            query += ' AND stage = ?'
+            values.append(stage)
+
+        return self.connection.execute(query + ' ORDER BY path',
+                                       values).fetchall()
+
+    def record_task(self, task):
+        """
+        Records (or updates) the telemetry of one array task.
+
+        :task: Dictionary with the keys in TASK_FIELDS.
+        """
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO tasks VALUES (%s)' %
+                ', '.join(['?'] * len(TASK_FIELDS)),
+                [task.get(field) for field in TASK_FIELDS])
+
+    def tasks(self, iteration=None, stage=None):
+        """
+        Returns the recorded array task telemetry as a list of dictionaries,
+        optionally limited to an iteration and/or stage.
+        """
+
+        query = 'SELECT * FROM tasks WHERE 1'
+        values = []
+        if iteration is not None:
+            query += ' AND iteration = ?'
+            values.append(iteration)
+        if stage is not None:
+            query += ' AND stage = ?'
+            values.append(stage)
+
+        return [dict(zip(row.keys(), row)) for row in
+                self.connection.execute(query, values)]
+
+    def status(self, iteration):
+        """
+        Summarises what has been done for an iteration. Returns a dictionary
+        of event -> stage -> (number of outputs, total size).
+        """
+
+        summary = dict((event, {}) for event in self.events(iteration))
+        rows = self.connection.execute(
+            'SELECT event, stage, COUNT(*) AS number, SUM(size) AS size '
+            'FROM outputs WHERE iteration IN (?, ?) GROUP BY event, stage',
+            (iteration, ANY_ITERATION))
+        for row in rows:
+            summary.setdefault(row['event'], {})[row['stage']] = \
+                (row['number'], row['size'])
+
+        return summary
+
+
+def describe_output(iteration, event, stage, path, checksum=False):
+    """
+    Makes the catalogue row of an output. For directories, the size is the
+    total size of all files below them, and no checksum is taken.
+
+    :iteration: Iteration name, or ANY_ITERATION.
+    :event: Event name.
+    :stage: Name of the stage which produced the output.
+    :path: Path to the output.
+    :checksum: Whether to compute the md5 checksum of a file.
+    """
+
+    path = os.path.abspath(path)
+    digest = None
+    if os.path.isdir(path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for file in files:
+                size += os.path.getsize(os.path.join(root, file))
+    else:
+        size = os.path.getsize(path)
+        if checksum:
+            digest = md5sum(path)
+
+    return [iteration, event, stage, path, size, os.path.getmtime(path),
+            digest, time.time()]
+
+
+def journal_path(catalogue_path):
+    return catalogue_path + JOURNAL_SUFFIX
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        """
+        Where array tasks record their outputs: each task writes its rows to
+        a small file of its own in a directory, and the catalogue takes them
+        in the next time a command opens it (Catalogue.ingest). This keeps
+        the tasks from writing to the database at the same time, which
+        SQLite's locking can't be trusted with on a parallel file system.
+
+        :path: Directory of the journal (see journal_path).
+        """
+
+        self.path = path
+
+    def write(self, rows):
+        """
+        Writes rows made by describe_output to a new file, under a temporary
+        name until it is complete.
+        """
+
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError as exception:
+                if exception.errno != errno.EEXIST:
+                    raise
+
+        handle, part = tempfile.mkstemp(prefix='%.6f.' % (time.time()),
+                                        suffix='.part', dir=self.path)
+        with os.fdopen(handle, 'w') as file:
+            json.dump(rows, file)
+        os.rename(part, part[:-len('.part')] + '.json')
+
+    def files(self):
+        """
+        Returns the complete files of the journal, oldest first.
+        """
+
+        if not os.path.isdir(self.path):
+            return []
+
+        return [os.path.join(self.path, file)
+                for file in sorted(os.listdir(self.path))
+                if file.endswith('.json')]
+
+
+def match_event(name, events):
+    """
+    Returns the longest event name which appears in name, or None. Taking the
+    longest avoids matching events whose names are prefixes of others.
+    """
+
+    matches = [event for event in events if event in name]
+    if not matches:
+        return None
+
+    return max(matches, key=len)
+
+
+def classify_archive(path):
+    """
+    Works out the (iteration, event, stage) an archive in a LASIF project
+    belongs to from its path (DATA/<event>/raw, DATA/<event>/preprocessed_*
+    or SYNTHETICS/<event>/ITERATION_<name>). Returns None if the path isn't
+    one of these.
+    """
+
+    parts = os.path.abspath(path).split(os.sep)
+    if len(parts) < 4:
+        return None
+
+    root, event, tag = parts[-4], parts[-3], parts[-2]
+    if root == 'SYNTHETICS' and tag.startswith('ITERATION_'):
+        return tag[len('ITERATION_'):], event, 'synthetics'
+    if root == 'DATA' and tag == 'raw':
+        return ANY_ITERATION, event, 'raw'
+    if root == 'DATA' and tag.startswith('preprocessed'):
+        return ANY_ITERATION, event, 'preprocessed'
+
+    return None
+
+
+def scan_archives(catalogue, lasif_path, event=None):
+    """
+    Walks the DATA and SYNTHETICS directories of a LASIF project once, and
+    records every tar archive found (any compression). Used to fill the catalogue the first
+    time, or when it is missing something. Everything found is written in
+    one transaction.
+
+    :event: Only scan this event.
+    """
+
+    rows = []
+    for root in ['DATA', 'SYNTHETICS']:
+        root_path = os.path.join(lasif_path, root)
+        if not os.path.isdir(root_path):
+            continue
+
+        events = [event] if event else os.listdir(root_path)
+        for event_name in events:
+            event_path = os.path.join(root_path, event_name)
+            if not os.path.isdir(event_path):
+                continue
+
+            for tag in os.listdir(event_path):
+                tag_path = os.path.join(event_path, tag)
+                if not os.path.isdir(tag_path):
+                    continue
+
+                for file in os.listdir(tag_path):
+                    archive = os.path.join(tag_path, file)
+                    owner = classify_archive(archive)
+                    if is_archive(file) and owner:
+                        rows.append(describe_output(owner[0], owner[1],
+                                                    owner[2], archive))
+
+    catalogue.insert_outputs(rows)
+
+
+def output_stage(name, iteration):
+    """
+    Works out the stage a LASIF OUTPUT directory of an iteration belongs to
+    from its name: 'adjoint_sources' or 'lasif_output' (solver input files)
+    if the name has ITERATION_<iteration>__ in it, None otherwise.
+    """
+
+    if 'ITERATION_%s__' % (iteration) not in name:
+        return None
+
+    return 'adjoint_sources' if 'adjoint' in name else 'lasif_output'
+
+
+def scan_lasif_output(catalogue, lasif_path, iteration, events):
+    """
+    Walks the LASIF OUTPUT directory once, and records the solver input
+    directories ('lasif_output') and adjoint source directories
+    ('adjoint_sources') of the given events for an iteration. Remembers when
+    it did (see Catalogue.scanned).
+    """
+
+    output_path = os.path.join(lasif_path, 'OUTPUT')
+    mtime = os.path.getmtime(output_path)
+    rows = []
+    for dir in os.listdir(output_path):
+        event = match_event(dir, events)
+        stage = output_stage(dir, iteration)
+        if event is None or stage is None or \
+                not os.path.isdir(os.path.join(output_path, dir)):
+            continue
+
+        rows.append(describe_output(iteration, event, stage,
+                                    os.path.join(output_path, dir)))
+
+    catalogue.insert_outputs(rows)
+    catalogue.mark_scanned(output_path, mtime)
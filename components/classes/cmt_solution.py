@@ -1,28 +1,226 @@
 #!/usr/bin/env python
 
 import os
+import re
 import math
-import obspy
-import numpy as np
+import hashlib
 import datetime
+import numpy as np
 import dateutil.parser
 
+from multiprocessing import Pool
+
+# Half duration (s) of the gaussian source time function the synthetics are
+# convolved with. The solver runs with a (near) zero half duration, so this
+# is what sets the source duration of the processed synthetics.
+PROCESSING_HALF_DURATION = 3.805
+
+# Decay rate of specfem's gaussian relative to 1 / half duration, so that it
+# mimics a triangle of that half duration.
+SOURCE_DECAY_MIMIC_TRIANGLE = 1.6280
+
+# Time (s) between the first sample of the solver's seismograms and the
+# origin time. With a zero half duration, specfem3d_globe uses a half duration
+# of 5 DT, and starts the seismograms 1.5 half durations early (for our DT of
+# 0.1425 s).
+START_TIME_CORRECTION = 1.06874
+
+MOMENT_TENSOR = ['Mrr', 'Mtt', 'Mpp', 'Mrt', 'Mrp', 'Mtp']
+
+# Fields of the source catalogue (see load_sources). Origin times are POSIX
+# timestamps.
+SOURCE_DTYPE = np.dtype(
+    [('event', 'S128'), ('path', 'S512'), ('origin_time', 'f8'),
+     ('time_shift', 'f8'), ('half_duration', 'f8'), ('latitude', 'f8'),
+     ('longitude', 'f8'), ('depth', 'f8')] +
+    [(component, 'f8') for component in MOMENT_TENSOR] +
+    [('scalar_moment', 'f8'), ('magnitude', 'f8')])
+
+ISO_TIME = re.compile(r'^\d{4}-\d{2}-\d{2}T')
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def parse_origin_time(line):
+    """
+    Parses the origin time from the first line of a CMTSOLUTION. LASIF puts
+    an ISO time at the end of the line; otherwise the standard PDE fields
+    (year month day hour minute second) are used.
+    """
+
+    fields = line.split()
+    if ISO_TIME.match(fields[-1]):
+        return dateutil.parser.parse(fields[-1][:23])
+
+    year, month, day, hour, minute = [int(field) for field in fields[1:6]]
+    return datetime.datetime(year, month, day, hour, minute) + \
+        datetime.timedelta(seconds=float(fields[6]))
+
+
 class CMTSolution(object):
 
-    def __init__(self, cmt_solution_file):
+    def __init__(self, cmt_solution_file,
+                 half_duration=PROCESSING_HALF_DURATION):
         """
-        Searches a cmt file for time shift information. Returns a CMT object.
+        Parses a CMTSOLUTION file: origin time, event name, time shift, half
+        duration, hypocentre and moment tensor. Returns a CMT object.
 
         :cmt_solution_file: Location of CMT solution file.
+        :half_duration: Half duration of the source time function used in
+        processing (see PROCESSING_HALF_DURATION). The half duration in the
+        file is kept as cmt_half_duration.
         """
 
-        file = open(cmt_solution_file, 'r')
-        for i, line in enumerate(file):
-            if i == 0:
-                self.start_time = dateutil.parser.parse(line.split()[-1][:23]) - datetime.timedelta(seconds=1.0687400)
-            if 'time shift' in line:
-                self.time_shift = float(line.split()[2])
+        self.path = cmt_solution_file
+        values = {}
+        with open(cmt_solution_file, 'r') as file:
+            self.origin_time = parse_origin_time(file.readline())
+            for line in file:
+                if ':' not in line:
+                    continue
+                key, value = line.split(':', 1)
+                values[key.strip()] = value.strip()
+
+        self.event_name = values.get('event name', '')
+        self.time_shift = float(values.get('time shift', 0.))
+        self.cmt_half_duration = float(values.get('half duration', 0.))
+        self.latitude = float(values['latitude'])
+        self.longitude = float(values['longitude'])
+        self.depth = float(values['depth'])
+        self.moment_tensor = np.array([float(values[component])
+                                       for component in MOMENT_TENSOR])
+
+        self.set_half_duration(half_duration)
+
+    @classmethod
+    def from_record(cls, record, half_duration=PROCESSING_HALF_DURATION):
+        """
+        Builds a CMTSolution from a row of the source catalogue, without
+        reading the file.
+        """
+
+        cmt = cls.__new__(cls)
+        cmt.path = record['path']
+        cmt.origin_time = EPOCH + datetime.timedelta(
+            seconds=float(record['origin_time']))
+        cmt.event_name = record['event']
+        cmt.time_shift = float(record['time_shift'])
+        cmt.cmt_half_duration = float(record['half_duration'])
+        cmt.latitude = float(record['latitude'])
+        cmt.longitude = float(record['longitude'])
+        cmt.depth = float(record['depth'])
+        cmt.moment_tensor = np.array([float(record[component])
+                                      for component in MOMENT_TENSOR])
+        cmt.set_half_duration(half_duration)
+
+        return cmt
+
+    def set_half_duration(self, half_duration):
+        """
+        Sets the half duration of the processing source time function.
+        """
+
+        self.half_duration = half_duration
+        self.source_decay_mimic_triangle = SOURCE_DECAY_MIMIC_TRIANGLE
+        self.alpha = self.source_decay_mimic_triangle / self.half_duration
+
+    @property
+    def start_time(self):
+        return self.origin_time - \
+            datetime.timedelta(seconds=START_TIME_CORRECTION)
+
+    @property
+    def scalar_moment(self):
+        """
+        Scalar moment (same units as the tensor), from the Frobenius norm of
+        the full tensor.
+        """
+
+        mrr, mtt, mpp, mrt, mrp, mtp = self.moment_tensor
+        return math.sqrt((mrr ** 2 + mtt ** 2 + mpp ** 2 +
+                          2 * (mrt ** 2 + mrp ** 2 + mtp ** 2)) / 2.)
+
+    @property
+    def magnitude(self):
+        """
+        Moment magnitude, for a tensor in dyne cm.
+        """
+
+        if self.scalar_moment == 0:
+            return float('nan')
+        return 2. / 3. * (math.log10(self.scalar_moment) - 16.1)
+
+    def record(self):
+        """
+        Returns the source as a tuple of SOURCE_DTYPE fields.
+        """
+
+        origin_time = (self.origin_time.replace(tzinfo=None) - EPOCH)
+        return ((self.event_name, self.path,
+                 origin_time.total_seconds(), self.time_shift,
+                 self.cmt_half_duration, self.latitude, self.longitude,
+                 self.depth) + tuple(self.moment_tensor) +
+                (self.scalar_moment, self.magnitude))
+
+
+def parse_record(item):
+    """
+    Parses one CMTSOLUTION into a catalogue record (for Pool.map).
+
+    :item: Tuple of (event name, CMTSOLUTION path).
+    """
+
+    event, path = item
+    record = CMTSolution(path).record()
+    return (event,) + record[1:]
+
+
+def files_signature(paths):
+    """
+    A sha1 of the paths, sizes and modification times of a list of files,
+    used to tell whether a cached catalogue is still current.
+    """
+
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update('%s\0%d\0%.6f\0' % (path, stat.st_size, stat.st_mtime))
+
+    return digest.hexdigest()
+
+
+def load_sources(cmt_files, cache_path=None, processes=None):
+    """
+    Parses the CMTSOLUTIONs of many events, in parallel, into one structured
+    array (SOURCE_DTYPE), sorted by event name. With cache_path, the array is
+    written to disk, and read back on the next call unless one of the files
+    has changed since.
+
+    :cmt_files: Dictionary of event name -> CMTSOLUTION path.
+    :cache_path: Optional .npz file to cache the catalogue in.
+    :processes: Number of processes to parse with (default: all cores).
+    """
+
+    items = sorted([(event, os.path.abspath(path))
+                    for event, path in cmt_files.items()])
+    signature = files_signature([path for _, path in items])
+
+    if cache_path and os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        if str(cached['signature']) == signature:
+            return cached['sources']
+
+    if len(items) > 1:
+        pool = Pool(processes=processes)
+        records = pool.map(parse_record, items)
+        pool.close()
+        pool.join()
+    else:
+        records = [parse_record(item) for item in items]
+    sources = np.array(records, dtype=SOURCE_DTYPE)
+
+    if cache_path:
+        partial = cache_path + '.part.npz'
+        np.savez(partial, sources=sources, signature=np.array(signature))
+        os.rename(partial, cache_path)
 
-        self.half_duration = 3.805
-        self.source_decay_mimic_triangle = 1.6280
-        self.alpha = self.source_decay_mimic_triangle / self.half_duration      
+    return sources
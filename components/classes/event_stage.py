@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import hashlib
+import tarfile
+import tempfile
+
+import lasif_cache
+from waveform_archive import (ArchiveWriter, iter_members, is_archive,
+                              compression_of)
+
+# Node-local directory the stages are made in, unless one is given (i.e.
+# /dev/shm for a RAM disk).
+DEFAULT_STAGE_ROOT = os.environ.get('STAGE_ROOT', '/tmp')
+
+# Top level entries of the project which are staged rather than linked.
+STAGED_DIRS = lasif_cache.EVENT_DIRS + [lasif_cache.CACHE_DIR]
+
+
+class StageError(Exception):
+    pass
+
+
+def digest(contents):
+    return hashlib.sha1(contents).hexdigest()
+
+
+class EventStage(object):
+
+    def __init__(self, lasif_path, directories, stage_root=None):
+        """
+        A copy of a LASIF project on node-local storage, holding the working
+        set of one event: the archives in some of its waveform directories,
+        extracted. Everything else at the top of the project is a symlink to
+        the original, so LASIF commands run in the stage read the project's
+        configuration and write their outputs (windows, adjoint sources)
+        straight to it, while the waveforms are read from local disk. The
+        station caches are copied in; the waveform caches are rebuilt
+        locally, as they refer to the staged files.
+
+        When done, write_back puts the members which are new or changed back
+        into their archives. Archives with nothing new are left untouched.
+
+        :lasif_path: LASIF project.
+        :directories: Waveform directories (DATA/<event>/<tag> or
+        SYNTHETICS/<event>/ITERATION_<name>, absolute or relative to the
+        project) whose archives are staged.
+        :stage_root: Node-local directory to make the stage in.
+        """
+
+        self.lasif_path = os.path.abspath(lasif_path)
+        self.directories = []
+        for directory in directories:
+            relative = os.path.relpath(os.path.join(self.lasif_path,
+                                                    directory),
+                                       self.lasif_path)
+            if relative.startswith(os.pardir) or \
+                    relative.split(os.sep)[0] not in lasif_cache.EVENT_DIRS:
+                raise StageError('%s is not a waveform directory of %s.' %
+                                 (directory, self.lasif_path))
+            self.directories.append(relative)
+
+        self.root = tempfile.mkdtemp(prefix='stage.',
+                                     dir=stage_root or DEFAULT_STAGE_ROOT)
+        self.path = os.path.join(self.root,
+                                 os.path.basename(self.lasif_path))
+        self.index = {}
+        self.make_project()
+
+    def make_project(self):
+        """
+        Links the top level of the project into the stage, and copies the
+        station caches.
+        """
+
+        os.makedirs(self.path)
+        for name in os.listdir(self.lasif_path):
+            if name not in STAGED_DIRS:
+                os.symlink(os.path.join(self.lasif_path, name),
+                           os.path.join(self.path, name))
+        for name in STAGED_DIRS:
+            os.makedirs(os.path.join(self.path, name))
+
+        for cache_file in lasif_cache.cache_files(
+                self.lasif_path, lasif_cache.STATIONS, lasif_cache.STATIONS,
+                lasif_cache.list_events(self.lasif_path)):
+            target = os.path.join(self.path, cache_file)
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.copy2(os.path.join(self.lasif_path, cache_file), target)
+
+    def extract(self):
+        """
+        Extracts the archives of the staged directories, and remembers the
+        digest of every member. Returns the number of members.
+        """
+
+        members = 0
+        for directory in self.directories:
+            source = os.path.join(self.lasif_path, directory)
+            target = os.path.join(self.path, directory)
+            os.makedirs(target)
+            if not os.path.isdir(source):
+                continue
+
+            for archive in sorted(os.listdir(source)):
+                if not is_archive(archive):
+                    continue
+                archive_path = os.path.join(source, archive)
+                self.index[archive_path] = {}
+                for name, contents in iter_members(archive_path, suffix=''):
+                    with open(os.path.join(target, name), 'wb') as file:
+                        file.write(contents)
+                    self.index[archive_path][name] = digest(contents)
+                    members += 1
+
+        return members
+
+    def changes(self, archive_path):
+        """
+        Compares the staged files of an archive with its members. Returns
+        (names of the staged files, names of the new or changed ones, whether
+        any member was removed).
+        """
+
+        staged_dir = os.path.join(self.path, os.path.relpath(
+            os.path.dirname(archive_path), self.lasif_path))
+        names = sorted([name for name in os.listdir(staged_dir)
+                        if os.path.isfile(os.path.join(staged_dir, name))])
+
+        # A directory with several archives keeps each member in its own.
+        members = self.index[archive_path]
+        others = set()
+        for other, other_members in self.index.items():
+            if other != archive_path and \
+                    os.path.dirname(other) == os.path.dirname(archive_path):
+                others.update(other_members)
+        names = [name for name in names
+                 if name in members or name not in others]
+
+        changed = []
+        for name in names:
+            with open(os.path.join(staged_dir, name), 'rb') as file:
+                if members.get(name) != digest(file.read()):
+                    changed.append(name)
+        removed = bool(set(members) - set(names))
+
+        return names, changed, removed
+
+    def write_back(self):
+        """
+        Puts the new and changed members back into the archives. Archives
+        with no changes are left as they are; new members are appended to
+        uncompressed archives; others are written out again in full (from
+        the staged files, under a temporary name). Returns a dictionary of
+        archive -> number of members written.
+        """
+
+        written = {}
+        for archive_path in sorted(self.index):
+            names, changed, removed = self.changes(archive_path)
+            if not changed and not removed:
+                written[archive_path] = 0
+                continue
+
+            staged_dir = os.path.join(self.path, os.path.relpath(
+                os.path.dirname(archive_path), self.lasif_path))
+            new_only = not removed and not [
+                name for name in changed if name in self.index[archive_path]]
+            if new_only and compression_of(archive_path) == 'none':
+                with tarfile.open(archive_path, 'a') as tar:
+                    for name in changed:
+                        tar.add(os.path.join(staged_dir, name), arcname=name)
+            else:
+                with ArchiveWriter(archive_path) as writer:
+                    for name in names:
+                        path = os.path.join(staged_dir, name)
+                        with open(path, 'rb') as file:
+                            writer.add(name, file.read())
+            written[archive_path] = len(changed)
+
+        return written
+
+    def clean(self):
+        shutil.rmtree(self.root)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.clean()
+
+
+def same_members(archive_path, other_path):
+    """
+    Returns True if two archives hold the same members with the same
+    contents (whatever their order, times or compression).
+    """
+
+    if not os.path.exists(other_path):
+        return False
+
+    members = dict((name, digest(contents))
+                   for name, contents in iter_members(archive_path, suffix=''))
+    other_members = dict((name, digest(contents)) for name, contents in
+                         iter_members(other_path, suffix=''))
+
+    return members == other_members
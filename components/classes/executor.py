@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+import os
+import re
+import errno
+import time
+import subprocess
+
+# Submits the batch scripts of oval_office.py: to slurm with sbatch, or
+# (for runs on a workstation) by running the array tasks on this machine.
+# Kept free of heavy imports, since the light commands use it.
+
+# Directory holding the aprun stand-in of the local executor.
+LOCAL_BIN = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'local_bin')
+
+
+class ExecutorError(Exception):
+    pass
+
+
+class SlurmExecutor(object):
+    """
+    Hands the scripts to sbatch.
+    """
+
+    def submit(self, script, script_args=None, options=None):
+        """
+        Submits a batch script. Returns the job id, which later submissions
+        can depend on (i.e. --dependency=afterok:<job id>), or None if sbatch
+        failed.
+
+        :script: Batch script, relative to the current directory.
+        :script_args: List of arguments to the script.
+        :options: List of sbatch options (i.e. --array=0-9).
+        """
+
+        output = subprocess.Popen(
+            ['sbatch', '--parsable'] + (options or []) + [script] +
+            (script_args or []), stdout=subprocess.PIPE).communicate()[0]
+
+        # --parsable prints <job id>[;<cluster>].
+        job_id = output.strip().split(';')[0]
+        if not job_id:
+            return None
+        print 'Submitted batch job ' + job_id
+
+        return job_id
+
+
+def parse_array(spec):
+    """
+    Expands an sbatch --array specification (i.e. '0-2,5') into a list of
+    indices.
+    """
+
+    indices = []
+    for part in spec.split('%')[0].split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            indices.extend(range(int(first), int(last) + 1))
+        else:
+            indices.append(int(part))
+
+    return indices
+
+
+def sbatch_options(script, options):
+    """
+    The sbatch options of a submission, as a dictionary: the #SBATCH lines of
+    the script, overridden by the options given. Only --name=value options
+    are understood.
+    """
+
+    settings = {}
+    with open(script, 'r') as file:
+        for line in file:
+            match = re.match(r'#SBATCH\s+--([\w-]+)=(.*)', line)
+            if match:
+                settings[match.group(1)] = match.group(2).strip().strip('"')
+
+    for option in options:
+        name, _, value = option.lstrip('-').partition('=')
+        settings[name] = value
+
+    return settings
+
+
+def log_path(pattern, job_id, task_id):
+    """
+    Fills in the %A, %a and %j of an sbatch --output/--error file name.
+    """
+
+    return pattern.replace('%A', str(job_id)).replace(
+        '%a', str(task_id)).replace('%j', str(job_id))
+
+
+class LocalExecutor(object):
+
+    def __init__(self, processes=None):
+        """
+        Runs batch scripts on this machine, the way slurm would on the Cray:
+        every task of an array runs the script with SLURM_ARRAY_TASK_ID (and
+        the other SLURM_* variables the scripts use) set, and with the
+        --export variables and the --output/--error logs of the submission.
+        aprun is replaced by local_bin/aprun, which runs the command directly
+        (or with mpirun, if it asks for more than one rank). The tasks run
+        processes at a time, and submit returns once they have all finished,
+        after printing how long each took.
+
+        :processes: Number of tasks to run at once (default: as many as fit
+        on the cores of this machine, at --cpus-per-task cores each).
+        """
+
+        self.processes = processes
+        self.job_id = int(time.time())
+
+    def task_environment(self, settings, job_id, task_id):
+
+        environment = dict(os.environ)
+        environment['PATH'] = LOCAL_BIN + os.pathsep + \
+            environment.get('PATH', '')
+        environment.update({
+            'SLURM_JOB_ID': str(job_id), 'SLURM_ARRAY_JOB_ID': str(job_id),
+            'SLURM_SUBMIT_DIR': os.getcwd(),
+            'SLURM_NNODES': settings.get('nodes', '1'),
+            'SLURM_CPUS_PER_TASK': settings.get('cpus-per-task', '1')})
+        if task_id is not None:
+            environment['SLURM_ARRAY_TASK_ID'] = str(task_id)
+
+        exports = settings.get('export', 'ALL').split(',')
+        for export in exports:
+            if '=' in export:
+                name, value = export.split('=', 1)
+                environment[name] = value
+
+        return environment
+
+    def run_task(self, task):
+        """
+        Runs one task of a submission. Returns (task id, exit code, seconds).
+
+        :task: Tuple of (script, script arguments, sbatch settings, job id,
+        array task id).
+        """
+
+        script, script_args, settings, job_id, task_id = task
+        logs = []
+        default_output = 'slurm-%j.out' if task_id is None \
+            else 'slurm-%A_%a.out'
+        for option, default in [('output', default_output), ('error', None)]:
+            pattern = settings.get(option, default)
+            if pattern is None:
+                logs.append(subprocess.STDOUT)
+                continue
+            path = log_path(pattern, job_id, task_id)
+            # The other tasks of the array may be making it at the same time.
+            if os.path.dirname(path):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError as exception:
+                    if exception.errno != errno.EEXIST:
+                        raise
+            logs.append(open(path, 'w'))
+
+        start = time.time()
+        try:
+            code = subprocess.Popen(
+                ['bash', script] + script_args, stdout=logs[0],
+                stderr=logs[1],
+                env=self.task_environment(settings, job_id, task_id)).wait()
+        finally:
+            for log in logs:
+                if log is not subprocess.STDOUT:
+                    log.close()
+
+        return task_id, code, time.time() - start
+
+    def submit(self, script, script_args=None, options=None):
+        """
+        Runs a batch script (every task of it, for an array) on this machine.
+        Returns the (local) job id. As the tasks have finished by then, any
+        --dependency of a later submission on it is met, and is ignored.
+
+        :script: Batch script, relative to the current directory.
+        :script_args: List of arguments to the script.
+        :options: List of sbatch options (i.e. --array=0-9).
+        """
+
+        from multiprocessing import cpu_count
+        from multiprocessing.pool import ThreadPool
+
+        if not os.path.exists(script):
+            raise ExecutorError('No batch script %s.' % (script))
+
+        settings = sbatch_options(script, options or [])
+        self.job_id += 1
+        tasks = parse_array(settings['array']) if 'array' in settings \
+            else [None]
+
+        processes = self.processes or max(
+            1, cpu_count() / int(settings.get('cpus-per-task', '1')))
+        start = time.time()
+        pool = ThreadPool(min(processes, len(tasks)))
+        results = pool.map(self.run_task, [
+            (script, script_args or [], settings, self.job_id, task)
+            for task in tasks])
+        pool.close()
+
+        print 'Local job %d (%s): %d tasks in %.1f s' % (
+            self.job_id, script, len(tasks), time.time() - start)
+        for task_id, code, seconds in results:
+            print '    task %4s: %8.1f s%s' % (
+                '-' if task_id is None else task_id, seconds,
+                '' if code == 0 else ', exit code %d' % (code))
+
+        return str(self.job_id)
+
+
+def make_executor(name, processes=None):
+    """
+    Returns the executor called name ('slurm' or 'local').
+    """
+
+    if name == 'slurm':
+        return SlurmExecutor()
+    if name == 'local':
+        return LocalExecutor(processes)
+
+    raise ExecutorError('Unknown executor %s.' % (name))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import os
+import xml.etree.ElementTree as ET
+
+
+class IterationError(Exception):
+    pass
+
+
+class Iteration(object):
+
+    def __init__(self, lasif_path, iteration_name):
+        """
+        Reads a LASIF iteration xml file, and pulls out the information the
+        processing steps need: event names, the bandpass periods, and the time
+        grid (npts, dt) of the simulations. Returns an iteration object.
+
+        :lasif_path: Path to the LASIF project.
+        :iteration_name: Name of the iteration (without the ITERATION_ prefix).
+        """
+
+        self.lasif_path = os.path.abspath(lasif_path)
+        self.name = iteration_name
+        self.xml_path = os.path.join(self.lasif_path, 'ITERATIONS',
+                                     'ITERATION_%s.xml' % (iteration_name))
+
+        if not os.path.exists(self.xml_path):
+            raise IterationError('Iteration xml file %s does not exist.'
+                                 % (self.xml_path))
+
+        root = ET.parse(self.xml_path).getroot()
+
+        self.event_names = []
+        for event in root.findall('event'):
+            for name in event.findall('event_name'):
+                self.event_names.append(name.text)
+
+        self.highpass_period = self._find_float(root, 'highpass_period')
+        self.lowpass_period = self._find_float(root, 'lowpass_period')
+        self.npts = int(self._find_float(root, 'number_of_time_steps'))
+        self.dt = self._find_float(root, 'time_increment')
+
+    def _find_float(self, root, tag):
+        """
+        Returns the first value of a tag anywhere in the xml tree.
+        """
+
+        for element in root.iter(tag):
+            return float(element.text)
+
+        raise IterationError('Could not find %s in %s.' % (tag, self.xml_path))
+
+    @property
+    def highpass(self):
+        """
+        Highpass corner frequency (Hz).
+        """
+
+        return 1.0 / self.highpass_period
+
+    @property
+    def lowpass(self):
+        """
+        Lowpass corner frequency (Hz).
+        """
+
+        return 1.0 / self.lowpass_period
+
+    @property
+    def preprocessing_tag(self):
+        """
+        The name LASIF gives the preprocessed data directory of this iteration
+        (i.e. preprocessed_hp_0.00833_lp_0.01667_npts_153069_dt_0.142500).
+        """
+
+        return 'preprocessed_hp_%.5f_lp_%.5f_npts_%d_dt_%f' % \
+            (self.highpass, self.lowpass, self.npts, self.dt)
+
+    def event_path(self, event_name):
+        """
+        Returns the path of the LASIF event file for an event.
+        """
+
+        return os.path.join(self.lasif_path, 'EVENTS', event_name + '.xml')
+
+    def data_path(self, event_name, tag='raw'):
+        """
+        Returns the path of a LASIF data directory for an event.
+
+        :tag: 'raw', or the preprocessing tag.
+        """
+
+        return os.path.join(self.lasif_path, 'DATA', event_name, tag)
+
+    def synthetics_path(self, event_name):
+        """
+        Returns the path of the LASIF synthetics directory for an event.
+        """
+
+        return os.path.join(self.lasif_path, 'SYNTHETICS', event_name,
+                            'ITERATION_%s' % (self.name))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import os
+import hashlib
+
+# Directories of a LASIF project holding the files each cache is built from:
+# the waveforms of an event, and the station files shared by all of them.
+EVENT_DIRS = ['DATA', 'SYNTHETICS']
+STATION_DIR = 'STATIONS'
+CACHE_DIR = 'CACHE'
+
+# Kinds of entry of a cache build: the station caches, or the waveform
+# caches of one event.
+STATIONS = 'stations'
+EVENT = 'event'
+
+
+def tree_signature(root, directories):
+    """
+    Returns a sha1 of the names, sizes and modification times of every file
+    under some directories of root. Cheap enough to run over a whole project
+    on every build, as only the file metadata is read.
+
+    :root: Directory the paths are relative to.
+    :directories: Directories (relative to root) to include. Missing ones
+    are skipped.
+    """
+
+    digest = hashlib.sha1()
+    for directory in directories:
+        for path, dirs, files in os.walk(os.path.join(root, directory)):
+            dirs.sort()
+            for file in sorted(files):
+                full_path = os.path.join(path, file)
+                stat = os.stat(full_path)
+                digest.update('%s\0%d\0%d\0' % (
+                    os.path.relpath(full_path, root), stat.st_size,
+                    int(stat.st_mtime)))
+
+    return digest.hexdigest()
+
+
+def list_events(lasif_path):
+    """
+    Lists the events of a LASIF project: those with an EVENTS/<event>.xml,
+    and those with waveforms.
+    """
+
+    events = set()
+    event_xml_dir = os.path.join(lasif_path, 'EVENTS')
+    if os.path.isdir(event_xml_dir):
+        events.update([os.path.splitext(file)[0]
+                       for file in os.listdir(event_xml_dir)
+                       if file.endswith('.xml')])
+    for directory in EVENT_DIRS:
+        path = os.path.join(lasif_path, directory)
+        if os.path.isdir(path):
+            events.update([event for event in os.listdir(path)
+                           if os.path.isdir(os.path.join(path, event))])
+
+    return sorted(events)
+
+
+def input_dirs(kind, name):
+    """
+    The directories (relative to the project) a cache entry is built from.
+    """
+
+    if kind == STATIONS:
+        return [STATION_DIR]
+
+    return [os.path.join(directory, name) for directory in EVENT_DIRS]
+
+
+def signatures(lasif_path, events=None):
+    """
+    Returns a dictionary of (kind, name) -> signature of the inputs of every
+    cache entry of a project: the station files, and each event's waveforms.
+    """
+
+    if events is None:
+        events = list_events(lasif_path)
+
+    entries = [(STATIONS, STATIONS)] + [(EVENT, event) for event in events]
+    return dict(((kind, name), tree_signature(lasif_path,
+                                              input_dirs(kind, name)))
+                for kind, name in entries)
+
+
+def cache_files(lasif_path, kind, name, events, since=None):
+    """
+    Lists the files of the LASIF CACHE directory (relative to the project)
+    which belong to a cache entry: those with the event name as a path
+    component for an event, those of no event for the stations. With since,
+    only the files modified after it (a POSIX time) are listed.
+
+    :events: All event names of the project.
+    """
+
+    events = set(events)
+    cache_root = os.path.join(lasif_path, CACHE_DIR)
+    files = []
+    for path, dirs, names in os.walk(cache_root):
+        parts = os.path.relpath(path, cache_root).split(os.sep)
+        if kind == EVENT and name not in parts:
+            continue
+        if kind == STATIONS and events.intersection(parts):
+            continue
+        for file in names:
+            full_path = os.path.join(path, file)
+            if kind == STATIONS and os.path.splitext(file)[0] in events:
+                continue
+            if since is not None and os.path.getmtime(full_path) < since:
+                continue
+            files.append(os.path.relpath(full_path, lasif_path))
+
+    return sorted(files)
+
+
+class SignatureStore(object):
+
+    def __init__(self, path):
+        """
+        Remembers the input signature each cache entry was last built from,
+        as one small file per entry in a directory, so that the array tasks
+        of a build can record their entries at the same time.
+
+        :path: Directory of the store.
+        """
+
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def entry_path(self, kind, name):
+        return os.path.join(self.path, '%s.%s' % (kind, name))
+
+    def get(self, kind, name):
+        path = self.entry_path(kind, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return file.read().strip()
+
+    def record(self, kind, name, signature):
+        path = self.entry_path(kind, name)
+        with open(path + '.part', 'w') as file:
+            file.write(signature + '\n')
+        os.rename(path + '.part', path)
+
+    def changed(self, signatures):
+        """
+        Returns the (kind, name) entries whose signature differs from the
+        one recorded, sorted.
+        """
+
+        return sorted([entry for entry, signature in signatures.items()
+                       if self.get(*entry) != signature])
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+import os
+
+# Fields of an entry are separated by FIELD_SEPARATOR, and the entries (one
+# per event) of an array task by ENTRY_SEPARATOR.
+FIELD_SEPARATOR = '|'
+ENTRY_SEPARATOR = ' '
+
+
+class ManifestError(Exception):
+    pass
+
+
+def write_manifest(path, fields, tasks):
+    """
+    Writes a task manifest for an array submission. Line i (after a header
+    naming the fields) holds the entries of array task i, and every line is
+    padded to the same width, so a task can seek straight to its own line
+    instead of reading the file (see manifest.sh).
+
+    :path: Manifest file to write.
+    :fields: Names of the fields of an entry.
+    :tasks: List of tasks, each a list of entries (tuples of fields).
+    """
+
+    lines = ['#' + FIELD_SEPARATOR.join(fields)]
+    for task in tasks:
+        for entry in task:
+            if len(entry) != len(fields):
+                raise ManifestError('Entry %s does not match the fields %s.'
+                                    % (entry, fields))
+            for field in entry:
+                if FIELD_SEPARATOR in field or ENTRY_SEPARATOR in field or \
+                        '\n' in field:
+                    raise ManifestError('Cannot put %s in a manifest.'
+                                        % (field))
+        lines.append(ENTRY_SEPARATOR.join(
+            [FIELD_SEPARATOR.join(entry) for entry in task]))
+
+    width = max([len(line) for line in lines]) + 1
+    with open(path + '.part', 'w') as file:
+        for line in lines:
+            file.write(line.ljust(width - 1) + '\n')
+    os.rename(path + '.part', path)
+
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+import os
+import errno
+import hashlib
+import tempfile
+import numpy as np
+
+from scipy import sparse
+
+# Interpolation matrices already built by this process, keyed on the grids.
+_weight_cache = {}
+
+
+class LanczosResampler(object):
+
+    def __init__(self, source_dt, target_dt, npts, source_npts,
+                 time_offset=0.0, a=8, cache_dir=None, keep=True):
+        """
+        Lanczos (windowed sinc) interpolation from one regular time grid onto
+        another. The interpolation weights only depend on the two grids, so
+        they are computed once per grid pair, kept as a sparse banded matrix,
+        and cached in memory (and optionally on disk). A whole stack of traces
+        is then resampled with a single sparse matrix product.
+
+        :source_dt: Sampling interval of the input traces.
+        :target_dt: Sampling interval of the output traces.
+        :npts: Number of output samples.
+        :source_npts: Number of input samples.
+        :time_offset: Start time of the output grid, relative to the start
+        of the input grid (s).
+        :a: Number of lobes of the Lanczos window.
+        :cache_dir: Optional directory to keep weight matrices in between runs.
+        :keep: Keep the weights in memory for later resamplers on the same
+        grids. Not worth it for grids which are unlikely to come up again
+        (i.e. those starting at a record's own start time).
+        """
+
+        self.source_dt = float(source_dt)
+        self.target_dt = float(target_dt)
+        self.npts = int(npts)
+        self.source_npts = int(source_npts)
+        self.time_offset = float(time_offset)
+        self.a = int(a)
+        self.cache_dir = cache_dir
+
+        self.key = '%.10e_%.10e_%d_%d_%.10e_%d' % \
+            (self.source_dt, self.target_dt, self.npts, self.source_npts,
+             self.time_offset, self.a)
+
+        if not keep and self.key not in _weight_cache:
+            self.weights = self._load_or_build()
+            return
+        if self.key not in _weight_cache:
+            _weight_cache[self.key] = self._load_or_build()
+        self.weights = _weight_cache[self.key]
+
+    def _cache_file(self):
+
+        name = hashlib.sha1(self.key).hexdigest() + '.npz'
+        return os.path.join(self.cache_dir, name)
+
+    def _load_or_build(self):
+        """
+        Reads the weight matrix from the disk cache if it's there, otherwise
+        builds it (and writes it to the disk cache).
+        """
+
+        if self.cache_dir and os.path.exists(self._cache_file()):
+            stored = np.load(self._cache_file())
+            return sparse.csr_matrix(
+                (stored['data'], stored['indices'], stored['indptr']),
+                shape=(self.npts, self.source_npts))
+
+        weights = self._build()
+        if self.cache_dir:
+            self._store(weights)
+
+        return weights
+
+    def _store(self, weights):
+        """
+        Writes a weight matrix to the disk cache. The cache is shared by
+        array tasks and MPI ranks, which may build the same matrix at the
+        same time: each writes to a name of its own and renames it into
+        place, and whichever rename comes last wins (the matrices are the
+        same).
+        """
+
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+        if os.path.exists(self._cache_file()):
+            return
+
+        handle, partial = tempfile.mkstemp(suffix='.part',
+                                           dir=self.cache_dir)
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                np.savez(file, data=weights.data, indices=weights.indices,
+                         indptr=weights.indptr)
+            os.rename(partial, self._cache_file())
+        except:
+            os.remove(partial)
+            raise
+
+    def _build(self):
+        """
+        Builds the (npts x source_npts) interpolation matrix. When decimating,
+        the kernel is stretched by the decimation factor so that it also acts
+        as an anti-alias filter. Rows are normalised so constants are
+        preserved.
+        """
+
+        stretch = max(1.0, self.target_dt / self.source_dt)
+        half_width = int(np.ceil(self.a * stretch))
+
+        position = (self.time_offset +
+                    np.arange(self.npts) * self.target_dt) / self.source_dt
+        taps = np.arange(-half_width + 1, half_width + 1)
+        columns = np.floor(position).astype(int)[:, np.newaxis] + taps
+        x = (position[:, np.newaxis] - columns) / stretch
+
+        weights = np.sinc(x) * np.sinc(x / self.a)
+        weights[np.abs(x) >= self.a] = 0.
+        weights[(columns < 0) | (columns >= self.source_npts)] = 0.
+
+        total = weights.sum(axis=1)[:, np.newaxis]
+        weights = np.where(total != 0, weights / np.where(total != 0, total, 1),
+                           0.)
+
+        rows = np.repeat(np.arange(self.npts), len(taps))
+        columns = np.clip(columns, 0, self.source_npts - 1)
+
+        matrix = sparse.csr_matrix((weights.ravel(), (rows, columns.ravel())),
+                                   shape=(self.npts, self.source_npts))
+        matrix.eliminate_zeros()
+
+        return matrix
+
+    def resample(self, stack):
+        """
+        Resamples a stack of traces onto the target grid. Returns an
+        (n_traces x npts) array.
+
+        :stack: 2D array, one trace (of source_npts samples) per row. A single
+        1D trace is also fine.
+        """
+
+        stack = np.asarray(stack, dtype=np.float64)
+        if stack.ndim == 1:
+            return self.weights.dot(stack)
+
+        return self.weights.dot(stack.T).T
@@ -4,9 +4,11 @@ import os
 import math
 import obspy
 import numpy as np
-import matplotlib.pyplot as plt
 
 from scipy import signal
+from spectral import gaussian_stf
+from source_time_function import resynthesize
+from waveform_storage import encode_samples
 
 class SyntheticSeismogram(object):
 
@@ -26,28 +28,7 @@ class SyntheticSeismogram(object):
 
         elif file_name.endswith('.ascii'):
             temp = np.loadtxt(file_name)
-            self.t, self.data = temp[:, 0], temp[:, 1]
-            self.dt = self.t[1] - self.t[0]
-            self.orig_len = len(self.t)
-            self.fname = file_name
-            self.hz = (1/self.dt)
-
-            self.tr = obspy.Trace(data=self.data)
-            self.tr.stats.delta = self.dt
-            self.tr.stats.sampling_rate = 1 / self.dt
-            self.tr.stats.station, self.tr.stats.network, self.tr.stats.channel = \
-                os.path.basename(self.fname).split('.')[:3]
-
-            if 'MXN' in self.tr.stats.channel:
-                self.tr.stats.channel = 'X'
-            elif 'MXE' in self.tr.stats.channel:
-                self.tr.stats.channel = 'Y'
-            elif 'MXZ' in self.tr.stats.channel:
-                self.tr.stats.channel = 'Z'
-                
-            # Reverse component to agree with LASIF.
-            if self.tr.stats.channel == 'X':
-                self.data = self.data * (-1)
+            self.set_specfem_trace(file_name, temp[:, 0], temp[:, 1])
             
         else:
             self.tr = obspy.read(file_name)[0]
@@ -58,6 +39,52 @@ class SyntheticSeismogram(object):
             
         self.hz = (1/self.dt)
         
+    @classmethod
+    def from_array(cls, file_name, t, data):
+        """
+        Builds a seismogram from a trace read elsewhere (i.e. from the solver's
+        binary output, see solver_output.py) instead of an ascii file.
+
+        :file_name: Name the ascii seismogram would have had (STA.NET.CHA...).
+        :t: Time axis.
+        :data: Samples.
+        """
+
+        seismogram = cls.__new__(cls)
+        seismogram.set_specfem_trace(file_name, t, data)
+        seismogram.hz = (1/seismogram.dt)
+
+        return seismogram
+
+    def set_specfem_trace(self, file_name, t, data):
+        """
+        Sets up the seismogram from a specfem trace, renaming the channels and
+        flipping the north component to agree with LASIF.
+        """
+
+        self.t, self.data = t, data
+        self.dt = self.t[1] - self.t[0]
+        self.orig_len = len(self.t)
+        self.fname = file_name
+        self.hz = (1/self.dt)
+
+        self.tr = obspy.Trace(data=self.data)
+        self.tr.stats.delta = self.dt
+        self.tr.stats.sampling_rate = 1 / self.dt
+        self.tr.stats.station, self.tr.stats.network, self.tr.stats.channel = \
+            os.path.basename(self.fname).split('.')[:3]
+
+        if 'MXN' in self.tr.stats.channel:
+            self.tr.stats.channel = 'X'
+        elif 'MXE' in self.tr.stats.channel:
+            self.tr.stats.channel = 'Y'
+        elif 'MXZ' in self.tr.stats.channel:
+            self.tr.stats.channel = 'Z'
+
+        # Reverse component to agree with LASIF.
+        if self.tr.stats.channel == 'X':
+            self.data = self.data * (-1)
+
     def read_source_time_function(self, file_name):
         """        
         Reads in the specfem source time function corresponding to a given 
@@ -91,6 +118,24 @@ class SyntheticSeismogram(object):
     def get_start_time(self, time):
 
         self.tr.stats.starttime = time
+
+    def set_time_grid(self, data, dt, start_time):
+        """
+        Replaces the seismogram with a version of itself resampled onto a new
+        time grid.
+
+        :data: Resampled data.
+        :dt: Sampling interval of the new grid.
+        :start_time: Start time of the new grid.
+        """
+
+        self.data = data
+        self.dt = dt
+        self.hz = (1/self.dt)
+
+        self.tr.data = self.data
+        self.tr.stats.delta = self.dt
+        self.tr.stats.starttime = start_time
         
 
     def write_specfem_ascii(self, file_name):
@@ -120,18 +165,34 @@ class SyntheticSeismogram(object):
         :cmt_solution: Cmt_solution object passed.
         """
 
-        n_convolve = int(math.ceil(1.5 * cmt_solution.half_duration / self.dt))
-        g_x = np.zeros(2 * n_convolve + 1)
+        g_x = gaussian_stf(self.dt, cmt_solution.half_duration,
+                           cmt_solution.alpha)
 
-        for i, j in enumerate(range(-n_convolve, n_convolve + 1)):
-            tau = j * self.dt
-            exponent = cmt_solution.alpha * cmt_solution.alpha * tau * tau
-            source = cmt_solution.alpha * math.exp(-exponent) / \
-                math.sqrt(math.pi)
+        self.data = np.convolve(self.data, g_x, 'same')
 
-            g_x[i] = source * self.dt
+    def replace_stf(self, stf, simulation_stf=None):
+        """
+        Convolves with an arbitrary source time function instead of the
+        gaussian of convolve_stf, deconvolving the source time function of
+        the simulation first if it is given (see source_time_function.py).
 
-        self.data = np.convolve(self.data, g_x, 'same')
+        :stf: Source time function kernel.
+        :simulation_stf: Source time function kernel of the simulation.
+        """
+
+        self.data = resynthesize(self.data, stf, simulation_stf)
+
+    def apply_operator(self, operator):
+        """
+        Applies a SyntheticOperator (the STF convolution, conversion to
+        velocity and filtering in one go) instead of convolve_stf,
+        convert_to_velocity and filter.
+
+        :operator: SyntheticOperator built for this seismogram's sampling.
+        """
+
+        self.data = operator.apply(self.data)
+        self.tr.data = self.data
 
     def reset_length(self):
         """
@@ -175,6 +236,8 @@ class SyntheticSeismogram(object):
         Plots the seismogram in the time domain.
         """
         
+        import matplotlib.pyplot as plt
+
         plt.plot(self.ifft)     
         plt.plot(self.data, '-')
         plt.show()
@@ -183,21 +246,31 @@ class SyntheticSeismogram(object):
         
         self.ifft = np.fft.irfft(self.fourier_domain)
         
-    def write_sac(self, file):
+    def write_sac(self, file, precision='float64'):
         """
-        Write a sac file.
+        Write a sac file. Returns the path of the file written, and the scale
+        factor its samples were stored with (see waveform_storage.py).
         
         :file: File name.
+        :precision: Sample format: float64 or float32 (see
+        waveform_storage.STAGE_PRECISIONS).
         """
         
         base_path = os.path.dirname(file)
         file_name = self.tr.stats.network + '.' + self.tr.stats.station + '.' +\
             self.tr.stats.channel + '.mseed'
         write_path = os.path.join(base_path, file_name)
-        self.tr.write(write_path, format='MSEED')
+
+        samples, encoding, scale = encode_samples(self.tr.data, precision)
+        tr = obspy.Trace(data=samples, header=self.tr.stats.copy())
+        tr.write(write_path, format='MSEED', encoding=encoding)
+
+        return write_path, scale
         
     def plot_power_spectrum(self, units='hz'):
         
+        import matplotlib.pyplot as plt
+
         plt.plot(self.frequencies, self.pow_spectrum)
         plt.title('Power spectrum of %s' % (self.fname))
         plt.xlabel('Frequency (Hz)')
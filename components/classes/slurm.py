@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+# Helpers for sbatch arguments. Kept free of heavy imports, since the
+# submission commands of oval_office.py use them.
+
+
+def array_spec(indices):
+    """
+    Formats a list of array indices for sbatch --array, collapsing runs into
+    ranges (i.e. [0, 1, 2, 5, 9, 10] -> '0-2,5,9-10').
+    """
+
+    indices = sorted(set(indices))
+    ranges = []
+    for index in indices:
+        if ranges and index == ranges[-1][1] + 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+
+    return ','.join(['%d' % (first) if first == last else
+                     '%d-%d' % (first, last) for first, last in ranges])
+
+
+def format_walltime(seconds):
+    """
+    Formats seconds as an sbatch --time (HH:MM:SS).
+    """
+
+    seconds = int(seconds)
+    return '%02d:%02d:%02d' % (seconds / 3600, (seconds % 3600) / 60,
+                               seconds % 60)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+import os
+import numpy as np
+
+# SAC binary files: a 632 byte header (70 floats, 40 ints, 192 bytes of
+# strings) followed by float32 samples.
+SAC_HEADER_BYTES = 632
+SAC_DELTA, SAC_B = 0, 5
+SAC_NVHDR, SAC_NPTS = 76, 79
+
+# Extensions of the solver output files which hold a whole event.
+ASDF_EXTENSIONS = ['.h5', '.hdf5', '.asdf']
+ADIOS_EXTENSIONS = ['.bp']
+
+
+class SolverOutputError(Exception):
+    pass
+
+
+class TraceStack(object):
+
+    def __init__(self, ids, data, dt, starts):
+        """
+        A stack of seismograms with the same sampling.
+
+        :ids: Trace names, as in the specfem ascii file names (STA.NET.CHA).
+        :data: Array of shape (number of traces, number of samples).
+        :dt: Sampling interval.
+        :starts: Time of the first sample of each trace.
+        """
+
+        self.ids = ids
+        self.data = data
+        self.dt = dt
+        self.starts = starts
+
+    def times(self, index):
+        """
+        Returns the time axis of one trace.
+        """
+
+        return self.starts[index] + self.dt * np.arange(self.data.shape[1])
+
+
+def trace_id(network, station, channel):
+    """
+    Formats a trace name the way specfem names its ascii seismograms.
+    """
+
+    return '%s.%s.%s' % (station, network, channel)
+
+
+def parse_asdf_name(name):
+    """
+    Returns the specfem style trace name of an ASDF waveform
+    (NET.STA.LOC.CHA__start__end__tag).
+    """
+
+    network, station, _, channel = name.split('__')[0].split('.')
+    return trace_id(network, station, channel)
+
+
+class SolverOutput(object):
+    """
+    Base class of the readers. Subclasses list the traces in the output on
+    construction (self.traces: trace name -> whatever locates it), and
+    implement read_trace.
+    """
+
+    def trace_ids(self):
+        return sorted(self.traces.keys())
+
+    def file_name(self, trace):
+        """
+        Name of the file an ascii seismogram of this trace would have had.
+        Processed seismograms are written next to it.
+        """
+
+        return os.path.join(self.directory, trace + '.sem.ascii')
+
+    def read(self, traces=None, window=None):
+        """
+        Reads a stack of traces. Only the requested traces (and samples) are
+        read from disk.
+
+        :traces: Trace names to read (default: all).
+        :window: Optional (first, last) sample range to read.
+        """
+
+        if traces is None:
+            traces = self.trace_ids()
+
+        data, dt, starts = [], None, []
+        for trace in traces:
+            if trace not in self.traces:
+                raise SolverOutputError('No trace %s in %s.' % (trace,
+                                                                self.path))
+            samples, trace_dt, start = self.read_trace(trace, window)
+            if dt is not None and not np.isclose(trace_dt, dt):
+                raise SolverOutputError('Traces of %s have different '
+                                        'sampling.' % (self.path))
+            data.append(samples)
+            starts.append(start)
+            dt = trace_dt
+
+        return TraceStack(list(traces), np.array(data, dtype=np.float64), dt,
+                          np.array(starts))
+
+
+class SacDirectory(SolverOutput):
+
+    def __init__(self, path):
+        """
+        Reads a directory of specfem binary SAC seismograms
+        (OUTPUT_SEISMOS_SAC_BINARY). The samples are memory-mapped, so only
+        the pages of the traces read are touched.
+
+        :path: OUTPUT_FILES directory.
+        """
+
+        self.path = path
+        self.directory = path
+        self.traces = {}
+        for file in os.listdir(path):
+            if file.endswith('.sac'):
+                station, network, channel = file.split('.')[:3]
+                self.traces[trace_id(network, station, channel)] = \
+                    os.path.join(path, file)
+
+    def file_name(self, trace):
+        return self.traces[trace]
+
+    def read_trace(self, trace, window=None):
+
+        path = self.traces[trace]
+        with open(path, 'rb') as file:
+            header = file.read(SAC_HEADER_BYTES)
+
+        # SAC files are written in the byte order of the machine, the header
+        # version (6) tells which one it is.
+        for endian in ['<', '>']:
+            ints = np.frombuffer(header[280:440], dtype=endian + 'i4')
+            if ints[SAC_NVHDR - 70] == 6:
+                break
+        else:
+            raise SolverOutputError('%s is not a SAC file.' % (path))
+
+        floats = np.frombuffer(header[:280], dtype=endian + 'f4')
+        data = np.memmap(path, dtype=endian + 'f4', mode='r',
+                         offset=SAC_HEADER_BYTES,
+                         shape=(ints[SAC_NPTS - 70],))
+        start = float(floats[SAC_B])
+        if window is not None:
+            data = data[window[0]:window[1]]
+            start += window[0] * float(floats[SAC_DELTA])
+
+        return np.array(data), float(floats[SAC_DELTA]), start
+
+
+class AsdfFile(SolverOutput):
+
+    def __init__(self, path, tag=None):
+        """
+        Reads the waveforms of an ASDF (HDF5) file, as written by specfem
+        with OUTPUT_SEISMOS_ASDF. Traces are read by hyperslab, so selecting
+        stations doesn't load the rest of the file. Needs h5py.
+
+        :path: ASDF file.
+        :tag: Only read waveforms with this tag (default: all).
+        """
+
+        import h5py
+
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.file = h5py.File(path, 'r')
+        self.traces = {}
+        for station in self.file['Waveforms'].values():
+            for name, dataset in station.items():
+                if tag is None or name.endswith('__' + tag):
+                    self.traces[parse_asdf_name(name)] = dataset
+
+    def read_trace(self, trace, window=None):
+
+        dataset = self.traces[trace]
+        dt = 1. / dataset.attrs['sampling_rate']
+        start = dataset.attrs['starttime'] / 1e9
+        if window is None:
+            return dataset[:], dt, start
+
+        return dataset[window[0]:window[1]], dt, start + window[0] * dt
+
+
+class AdiosFile(SolverOutput):
+
+    def __init__(self, path, tag=None):
+        """
+        Reads the waveforms of an ADIOS (.bp) file holding the ASDF layout,
+        as specfem writes with ADIOS enabled (variables
+        Waveforms/NET.STA/NET.STA.LOC.CHA__start__end__tag, with
+        sampling_rate and starttime attributes). Traces are read by offset and
+        count. Needs the ADIOS python bindings.
+
+        :path: ADIOS file.
+        :tag: Only read waveforms with this tag (default: all).
+        """
+
+        import adios
+
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.file = adios.file(path)
+        self.traces = {}
+        for name in self.file.var.keys():
+            parts = name.strip('/').split('/')
+            if len(parts) != 3 or parts[0] != 'Waveforms':
+                continue
+            if tag is None or parts[2].endswith('__' + tag):
+                self.traces[parse_asdf_name(parts[2])] = name
+
+    def attribute(self, name, key):
+        return self.file.attr[name + '/' + key].value
+
+    def read_trace(self, trace, window=None):
+
+        name = self.traces[trace]
+        variable = self.file.var[name]
+        dt = 1. / float(self.attribute(name, 'sampling_rate'))
+        start = float(self.attribute(name, 'starttime')) / 1e9
+        if window is None:
+            return variable.read(), dt, start
+
+        return variable.read(offset=(window[0],),
+                             count=(window[1] - window[0],)), dt, \
+            start + window[0] * dt
+
+
+def is_solver_output(path):
+    """
+    Whether a path is binary solver output: an ASDF or ADIOS file, or a
+    directory of SAC binary seismograms.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ASDF_EXTENSIONS + ADIOS_EXTENSIONS:
+        return os.path.isfile(path)
+
+    return os.path.isdir(path) and \
+        any([file.endswith('.sac') for file in os.listdir(path)])
+
+
+def open_output(path):
+    """
+    Opens the binary solver output of an event with the right reader.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ASDF_EXTENSIONS:
+        return AsdfFile(path)
+    if extension in ADIOS_EXTENSIONS:
+        return AdiosFile(path)
+    if os.path.isdir(path):
+        return SacDirectory(path)
+
+    raise SolverOutputError("Don't know how to read %s." % (path))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+import os
+import numpy as np
+
+from spectral import next_fast_length
+
+# File specfem writes the source time function of the simulation to, in
+# OUTPUT_FILES (time, value).
+SOLVER_STF_FILE = 'plot_source_time_function.txt'
+
+# Water level (dB below the peak of its spectrum) used when deconvolving the
+# simulation's source time function.
+WATER_LEVEL = 60.0
+
+
+def centred_kernel(times, values, dt):
+    """
+    Samples a source time function (moment rate) onto a kernel with 2n + 1
+    samples of spacing dt, with time zero on sample n, scaled to unit sum,
+    like gaussian_stf. Convolving with it ('same') doesn't shift the trace.
+    The kernel only covers the part of the function above 1e-6 of its peak.
+
+    :times: Time axis of the source time function.
+    :values: Values of the source time function.
+    :dt: Sampling interval of the seismograms.
+    """
+
+    support = np.abs(values) > 1e-6 * np.abs(values).max()
+    if not support.any():
+        raise ValueError('The source time function is zero.')
+    n_convolve = int(np.ceil(np.abs(times[support]).max() / dt))
+    tau = np.arange(-n_convolve, n_convolve + 1) * dt
+    kernel = np.interp(tau, times, values, left=0., right=0.)
+
+    return kernel / kernel.sum()
+
+
+def read_stf(path, dt):
+    """
+    Reads an arbitrary source time function (moment rate), from a two column
+    (time, value) file, as a kernel (see centred_kernel).
+    """
+
+    stf = np.loadtxt(path)
+    return centred_kernel(stf[:, 0], stf[:, 1], dt)
+
+
+def read_simulation_stf(output_files, dt):
+    """
+    Reads the source time function the solver used (SOLVER_STF_FILE in
+    OUTPUT_FILES), as the moment rate kernel to deconvolve. With a moment
+    tensor source, specfem writes the moment function (a smoothed step),
+    which is differentiated; a pulse is used as it is. Returns None if there
+    is no file.
+
+    :output_files: OUTPUT_FILES directory of the event.
+    :dt: Sampling interval of the seismograms.
+    """
+
+    path = os.path.join(output_files, SOLVER_STF_FILE)
+    if not os.path.exists(path):
+        return None
+
+    stf = np.loadtxt(path)
+    times, values = stf[:, 0], stf[:, 1]
+    if abs(values[-1]) > 0.5 * np.abs(values).max():
+        values = np.gradient(values, times[1] - times[0])
+
+    return centred_kernel(times, values, dt)
+
+
+def wrap_kernel(kernel, nfft):
+    """
+    Puts the centre of a kernel on sample 0 of an nfft long array, so that
+    multiplying by its spectrum convolves without shifting the trace.
+    """
+
+    n_convolve = (len(kernel) - 1) // 2
+    wrapped = np.zeros(nfft)
+    wrapped[:n_convolve + 1] = kernel[n_convolve:]
+    if n_convolve:
+        wrapped[-n_convolve:] = kernel[:n_convolve]
+
+    return wrapped
+
+
+def source_spectrum(kernel, nfft, simulation=None, water_level=WATER_LEVEL):
+    """
+    Spectrum (rfft of length nfft) which replaces the source of the
+    simulation by a new one: the spectrum of the new kernel, divided by that
+    of the simulation's kernel (if given). The simulation spectrum is clipped
+    to water_level dB below its peak, as it is divided by.
+
+    :kernel: New source time function (see centred_kernel).
+    :nfft: FFT length.
+    :simulation: Source time function of the simulation, or None.
+    :water_level: Water level (dB) of the deconvolution.
+    """
+
+    spectrum = np.fft.rfft(wrap_kernel(kernel, nfft))
+    if simulation is None:
+        return spectrum
+
+    divisor = np.fft.rfft(wrap_kernel(simulation, nfft))
+    amplitude = np.abs(divisor)
+    level = amplitude.max() * 10 ** (-water_level / 20.)
+    divisor = np.where(amplitude < level,
+                       level * np.exp(1j * np.angle(divisor)), divisor)
+
+    return spectrum / divisor
+
+
+def resynthesize(data, kernel, simulation=None, water_level=WATER_LEVEL):
+    """
+    Replaces the source of the traces in data (the last axis) with a new
+    source time function, deconvolving the simulation's if it is given.
+    """
+
+    npts = data.shape[-1]
+    n_convolve = (max(len(kernel), len(simulation) if simulation is not None
+                      else 0) - 1) // 2
+    nfft = next_fast_length(npts + 2 * n_convolve)
+    spectrum = source_spectrum(kernel, nfft, simulation, water_level)
+
+    return np.fft.irfft(np.fft.rfft(data, nfft, axis=-1) * spectrum, nfft,
+                        axis=-1)[..., :npts]
+
+
+def read_half_durations(path):
+    """
+    Reads a table of per-event half durations: an event name and a half
+    duration (s) on each line. Lines starting with # are skipped.
+    """
+
+    half_durations = {}
+    with open(path, 'r') as file:
+        for line in file:
+            if line.split() and not line.startswith('#'):
+                event, half_duration = line.split()[:2]
+                half_durations[event] = float(half_duration)
+
+    return half_durations
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from scipy import signal
+
+
+def next_fast_length(n):
+    """
+    Returns the smallest number >= n which only has 2, 3 and 5 as prime
+    factors. FFTs of these lengths are fast.
+
+    :n: Minimum length.
+    """
+
+    best = 2 ** int(np.ceil(np.log2(max(n, 1))))
+    power_5 = 1
+    while power_5 < best:
+        power_35 = power_5
+        while power_35 < best:
+            length = power_35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            power_35 *= 3
+        power_5 *= 5
+
+    return best
+
+
+def gaussian_stf(dt, half_duration, alpha):
+    """
+    Returns the sampled gaussian source time function that synthetics are
+    convolved with (SyntheticSeismogram.convolve_stf). It has 2n + 1 samples,
+    centred on sample n, and is scaled by dt so that convolving with it
+    approximates the continuous convolution.
+
+    :dt: Sampling interval.
+    :half_duration: Half duration of the source.
+    :alpha: Decay rate of the gaussian.
+    """
+
+    n_convolve = int(np.ceil(1.5 * half_duration / dt))
+    tau = np.arange(-n_convolve, n_convolve + 1) * dt
+
+    return alpha * np.exp(-alpha * alpha * tau * tau) / np.sqrt(np.pi) * dt
+
+
+def cosine_taper(lengths, n_columns, fraction=0.05):
+    """
+    Builds a batch of cosine (Hann) tapers. Row i tapers the first lengths[i]
+    samples, and is zero afterwards, so batches of records with different
+    lengths can share one array.
+
+    :lengths: Array of valid record lengths, one per row.
+    :n_columns: Number of columns of the batch.
+    :fraction: Fraction of each record tapered at either end.
+    """
+
+    lengths = np.asarray(lengths)[:, np.newaxis]
+    samples = np.arange(n_columns)[np.newaxis, :]
+    width = np.maximum((fraction * lengths).astype(int), 1)
+    distance = np.minimum(samples, lengths - 1 - samples)
+
+    taper = 0.5 * (1 - np.cos(np.pi * np.clip(distance, 0, width) / width))
+    taper[samples >= lengths] = 0.
+
+    return taper
+
+
+def detrend(data, lengths):
+    """
+    Removes the least-squares line from each row of a batch in place. Only
+    the first lengths[i] samples of row i are used (and modified).
+
+    :data: 2D array, one record per row.
+    :lengths: Array of valid record lengths, one per row.
+    """
+
+    lengths = np.asarray(lengths)[:, np.newaxis]
+    samples = np.arange(data.shape[1])[np.newaxis, :]
+    mask = samples < lengths
+
+    x_mean = (lengths - 1) / 2.
+    y_mean = np.sum(data * mask, axis=1)[:, np.newaxis] / \
+        np.maximum(lengths, 1)
+    x_centred = (samples - x_mean) * mask
+
+    # A record shorter than two samples has no slope: only its mean goes.
+    spread = np.sum(x_centred ** 2, axis=1)[:, np.newaxis]
+    slope = np.sum(x_centred * (data - y_mean) * mask, axis=1)[:, np.newaxis] \
+        / np.where(spread > 0, spread, 1)
+
+    data -= (y_mean + slope * (samples - x_mean)) * mask
+
+    return data
+
+
+def bandpass_response(frequencies, sampling_rate, min_period, max_period):
+    """
+    Returns the frequency response of the filters applied by
+    SyntheticSeismogram.filter (5 corner lowpass and 2 corner highpass
+    Butterworth filters, both run zerophase), at the given frequencies.
+
+    :frequencies: Frequencies (Hz) to evaluate the response at.
+    :sampling_rate: Sampling rate of the data (Hz).
+    :min_period: Lowpass period (s).
+    :max_period: Highpass period (s).
+    """
+
+    nyquist = 0.5 * sampling_rate
+    z = np.exp(1j * np.pi * np.asarray(frequencies) / nyquist)
+
+    # The response is evaluated from the zeros, poles and gain (as obspy
+    # filters in second order sections): with corners this far below the
+    # Nyquist frequency, the polynomial coefficients lose too much precision.
+    response = np.ones(z.shape, dtype=complex)
+    for corners, period, btype in [(5, min_period, 'lowpass'),
+                                   (2, max_period, 'highpass')]:
+        zeros, poles, gain = signal.butter(corners, (1.0 / period) / nyquist,
+                                           btype=btype, output='zpk')
+        response *= gain
+        for zero in zeros:
+            response *= z - zero
+        for pole in poles:
+            response /= z - pole
+
+    # Zerophase means the filter is run forwards and backwards.
+    return np.abs(response) ** 2
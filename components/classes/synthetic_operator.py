@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from spectral import gaussian_stf, bandpass_response, next_fast_length
+from source_time_function import source_spectrum, WATER_LEVEL
+
+# Operators already built by this process, keyed on sampling, source and band.
+_operator_cache = {}
+
+# apply_blocks cuts the impulse response where what is left of it (the sum of
+# its absolute values) is below this share of the whole.
+TRUNCATION_TOLERANCE = 1e-10
+
+
+class SyntheticOperator(object):
+
+    def __init__(self, npts, dt, cmt_solution, bands, padding_periods=2.0,
+                 stf=None, simulation_stf=None, water_level=WATER_LEVEL):
+        """
+        The processing of a synthetic (convolve_stf, convert_to_velocity and
+        filter) as one transfer function: the spectrum of the source time
+        function, times that of the centred difference np.gradient takes
+        (i sin(w dt) / dt), times the response of the zerophase filters. It
+        is built once per sampling and source, and applied to each trace with
+        one forward and one inverse real FFT. With several period bands, the
+        forward FFT (with the source and the velocity conversion) is shared,
+        and only the filter and the inverse FFT are done for each band.
+
+        The traces are zero padded to a fast FFT length, with room for the
+        source time function and padding_periods of the longest filter
+        period on either side, so the filter tails don't wrap around.
+        Because the FFT sees a zero padded trace rather than a truncated one,
+        the first and last few samples differ slightly from the sequential
+        processing (see compare).
+
+        :npts: Number of samples of the traces.
+        :dt: Sampling interval.
+        :cmt_solution: CMTSolution of the event.
+        :bands: List of (min_period, max_period) (lowpass and highpass
+        periods, in s).
+        :padding_periods: Padding on either side, in units of the longest
+        max_period.
+        :stf: Source time function kernel to use instead of the gaussian of
+        the CMT solution's half duration (see source_time_function.py).
+        :simulation_stf: Source time function of the simulation, to
+        deconvolve first (None: the solver output is an impulse response).
+        :water_level: Water level (dB) of the deconvolution.
+        """
+
+        self.npts = int(npts)
+        self.dt = float(dt)
+
+        if stf is None:
+            stf = gaussian_stf(self.dt, cmt_solution.half_duration,
+                               cmt_solution.alpha)
+        n_convolve = (max(len(stf), len(simulation_stf)
+                          if simulation_stf is not None else 0) - 1) // 2
+        self.bands = [(float(min_period), float(max_period))
+                      for min_period, max_period in bands]
+        max_period = max([band[1] for band in self.bands])
+        padding = int(np.ceil(padding_periods * max_period / self.dt))
+        self.nfft = next_fast_length(self.npts + n_convolve + 2 * padding)
+        self._half_length = None
+        self._block_kernels = {}
+
+        frequencies = np.fft.rfftfreq(self.nfft, self.dt)
+        omega = 2 * np.pi * frequencies
+        self.source = source_spectrum(stf, self.nfft, simulation_stf,
+                                      water_level) * \
+            (1j * np.sin(omega * self.dt) / self.dt)
+        self.filters = [bandpass_response(frequencies, 1. / self.dt,
+                                          min_period, max_period)
+                        for min_period, max_period in self.bands]
+
+    def apply(self, data):
+        """
+        Applies the operator (of the first band) to a trace, or to each row
+        of a stack of traces.
+        """
+
+        return self.apply_bands(data)[0]
+
+    def apply_bands(self, data):
+        """
+        Applies the operator to a trace, or to each row of a stack of traces.
+        Returns the result for each band.
+        """
+
+        spectra = np.fft.rfft(data, self.nfft, axis=-1) * self.source
+        return [np.fft.irfft(spectra * filter, self.nfft,
+                             axis=-1)[..., :self.npts]
+                for filter in self.filters]
+
+    def working_bytes(self):
+        """
+        Rough peak memory (bytes) apply_bands needs for one trace: the padded
+        trace, its spectrum, and a spectrum and a trace for each band.
+        """
+
+        return self.nfft * (24 + 24 * len(self.bands))
+
+    @property
+    def half_length(self):
+        """
+        Half length (samples) of the impulse response apply_blocks uses: the
+        longest decay_length of the bands. Only worked out when needed.
+        """
+
+        if self._half_length is None:
+            self._half_length = max([self.decay_length(self.response(band))
+                                     for band in range(len(self.bands))])
+        return self._half_length
+
+    def response(self, band):
+        """
+        Impulse response of a band (by index), as apply_bands applies it: nfft
+        samples, with zero lag first and the negative lags wrapped to the end.
+        """
+
+        return np.fft.irfft(self.source * self.filters[band], self.nfft)
+
+    def decay_length(self, response):
+        """
+        The lag (samples) beyond which an impulse response holds no more than
+        TRUNCATION_TOLERANCE of its sum of absolute values, either side of
+        zero. Longer lags never reach a trace of npts samples, so it is at
+        most npts - 1.
+        """
+
+        magnitude = np.abs(response)
+        folded = magnitude[:self.nfft // 2 + 1].copy()
+        folded[1:(self.nfft + 1) // 2] += magnitude[:self.nfft // 2:-1]
+
+        # beyond[lag]: the sum over the lags longer than lag.
+        beyond = np.cumsum(folded[::-1])[::-1] - folded
+        length = int(np.argmax(beyond <= TRUNCATION_TOLERANCE *
+                               magnitude.sum()))
+
+        return max(1, min(length, self.npts - 1))
+
+    def block_size(self, budget):
+        """
+        The largest block (samples) apply_blocks can use within a memory
+        budget (bytes), but at least the half length of the impulse response.
+        """
+
+        fft_length = int(budget / (24 + 40 * len(self.bands)))
+        return max(self.half_length,
+                   fft_length - 2 * self.half_length)
+
+    def block_kernels(self, fft_length):
+        """
+        Spectra (of length fft_length) of the impulse response of each band,
+        cut to half_length samples either side of zero.
+        """
+
+        if fft_length not in self._block_kernels:
+            kernels = []
+            for band in range(len(self.bands)):
+                response = self.response(band)
+                wrapped = np.zeros(fft_length)
+                wrapped[:self.half_length + 1] = \
+                    response[:self.half_length + 1]
+                wrapped[-self.half_length:] = response[-self.half_length:]
+                kernels.append(np.fft.rfft(wrapped))
+            self._block_kernels[fft_length] = kernels
+
+        return self._block_kernels[fft_length]
+
+    def apply_blocks(self, data, block_size):
+        """
+        Applies the operator to one trace block by block along time (overlap
+        save), so that only block_size samples (and the half length of the
+        impulse response either side) are transformed at once. The blocks
+        overlap by the length of the impulse response, cut where all but
+        TRUNCATION_TOLERANCE of it has decayed (see decay_length), so the
+        result is within ~1e-8 of apply_bands' (see compare), however long
+        the trace. Returns the result for each band.
+
+        :data: Trace.
+        :block_size: Samples of output per block.
+        """
+
+        half = self.half_length
+        fft_length = next_fast_length(block_size + 2 * half)
+        block_size = fft_length - 2 * half
+        kernels = self.block_kernels(fft_length)
+
+        outputs = [np.zeros(self.npts) for _ in self.bands]
+        segment = np.zeros(fft_length)
+        for start in range(0, self.npts, block_size):
+            first, last = max(start - half, 0), min(start + block_size + half,
+                                                     self.npts)
+            segment[:] = 0.
+            segment[first - (start - half):last - (start - half)] = \
+                data[first:last]
+            spectrum = np.fft.rfft(segment)
+
+            length = min(block_size, self.npts - start)
+            for output, kernel in zip(outputs, kernels):
+                output[start:start + length] = np.fft.irfft(
+                    spectrum * kernel, fft_length)[half:half + length]
+
+        return outputs
+
+
+def get_operator(npts, dt, cmt_solution, bands, stf=None,
+                 simulation_stf=None):
+    """
+    Returns the SyntheticOperator for a sampling, source and list of bands,
+    building it only once per process.
+    """
+
+    key = (int(npts), float(dt), cmt_solution.half_duration,
+           cmt_solution.alpha, tuple([(float(min_period), float(max_period))
+                                      for min_period, max_period in bands]),
+           None if stf is None else stf.tostring(),
+           None if simulation_stf is None else simulation_stf.tostring())
+    if key not in _operator_cache:
+        _operator_cache[key] = SyntheticOperator(
+            npts, dt, cmt_solution, bands, stf=stf,
+            simulation_stf=simulation_stf)
+
+    return _operator_cache[key]
+
+
+def compare(fused, sequential, edge=0):
+    """
+    Misfit between fused and sequentially processed traces: the largest
+    difference relative to the largest amplitude of the sequential trace.
+
+    :fused: Trace processed with a SyntheticOperator.
+    :sequential: The same trace processed by convolve_stf,
+    convert_to_velocity and filter.
+    :edge: Number of samples at either end to leave out.
+    """
+
+    fused = np.asarray(fused)[edge:len(fused) - edge]
+    sequential = np.asarray(sequential)[edge:len(sequential) - edge]
+    scale = np.abs(sequential).max()
+    if scale == 0:
+        return np.abs(fused).max()
+
+    return np.abs(fused - sequential).max() / scale
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+import os
+import re
+import datetime
+import subprocess
+
+import numpy as np
+
+# Log file prefixes -> stage names. oval_office.py submits every stage with
+# --job-name and --output named after the stage itself; the others are the
+# prefixes of the #SBATCH --output lines, for scripts submitted by hand (and
+# logs written before). A resynthesis runs the process synthetics script, so
+# only its job name tells it apart.
+LOG_STAGES = {'solver': 'solver',
+              'preprocess_data': 'preprocess_data',
+              'process_synthetics': 'process_synthetics',
+              'resynthesize': 'resynthesize',
+              'select_windows': 'select_windows',
+              'finalize_sources': 'finalize_sources',
+              'preprocessing': 'preprocess_data',
+              'process': 'process_synthetics',
+              'window': 'select_windows',
+              'finalize': 'finalize_sources'}
+
+# Saved logs and sacct output to try parse_logs, read_sacct and collect on
+# (collect([FIXTURE_DIR + '/logs'], FIXTURE_DIR + '/sacct.txt')).
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fixtures', 'telemetry')
+
+SACCT_FORMAT = ['JobID', 'JobName', 'State', 'Submit', 'Start', 'End',
+                'ElapsedRaw', 'TotalCPU', 'AllocCPUS', 'MaxRSS']
+
+LOG_NAME = re.compile(r'^(?P<prefix>.+)\.(?P<job>\d+)\.(?P<task>\d+)\.o$')
+LOG_EVENT = re.compile(r'^(?:EVENT|PREPROCESSING): (\S+)')
+LOG_ITERATION = re.compile(r'^ITERATION: (\S+)')
+
+
+def parse_duration(text):
+    """
+    Converts a slurm duration ([DD-][HH:]MM:SS[.mmm]) to seconds.
+    """
+
+    if not text:
+        return None
+
+    days = 0
+    if '-' in text:
+        days, text = text.split('-')
+
+    seconds = 0.
+    for field in text.split(':'):
+        seconds = seconds * 60 + float(field)
+
+    return int(days) * 86400 + seconds
+
+
+def parse_memory(text):
+    """
+    Converts a slurm memory figure (i.e. 1234K, 1.5G) to bytes.
+    """
+
+    if not text:
+        return None
+
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+
+    return int(float(text))
+
+
+def parse_time(text):
+    """
+    Converts a slurm timestamp to a datetime (None if it is 'Unknown').
+    """
+
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+
+
+def parse_logs(log_dir):
+    """
+    Reads the array task logs (<prefix>.<job>.<task>.o) in a directory.
+    Returns a dictionary of (job_id, task_id) -> dictionary with the stage,
+    and the event and iteration the task reported. Tasks which ran several
+    (packed) events get their names joined by spaces.
+
+    :log_dir: Directory of log files.
+    """
+
+    tasks = {}
+    if not os.path.isdir(log_dir):
+        return tasks
+
+    for file in os.listdir(log_dir):
+        match = LOG_NAME.match(file)
+        if not match:
+            continue
+
+        task = {'stage': LOG_STAGES.get(match.group('prefix'),
+                                        match.group('prefix')),
+                'event': None, 'iteration': None,
+                'log': os.path.join(log_dir, file)}
+        events = []
+        with open(task['log'], 'r') as log:
+            for line in log:
+                event = LOG_EVENT.match(line)
+                iteration = LOG_ITERATION.match(line)
+                if event and event.group(1) not in events:
+                    events.append(event.group(1))
+                if iteration and task['iteration'] is None:
+                    task['iteration'] = iteration.group(1)
+        task['event'] = ' '.join(events) or None
+
+        tasks[(match.group('job'), int(match.group('task')))] = task
+
+    return tasks
+
+
+def read_sacct(job_ids, sacct_file=None):
+    """
+    Gets accounting information for array jobs from sacct. Returns a
+    dictionary of (job_id, task_id) -> accounting dictionary.
+
+    :job_ids: List of array job ids.
+    :sacct_file: Read saved 'sacct --parsable2' output from this file instead
+    of calling sacct (for testing, or machines without slurm).
+    """
+
+    if sacct_file:
+        with open(sacct_file, 'r') as file:
+            lines = file.read().splitlines()
+    else:
+        if not job_ids:
+            return {}
+        output = subprocess.Popen(
+            ['sacct', '--parsable2', '--format=' + ','.join(SACCT_FORMAT),
+             '-j', ','.join(sorted(set(job_ids)))],
+            stdout=subprocess.PIPE).communicate()[0]
+        lines = output.splitlines()
+
+    if not lines:
+        return {}
+
+    header = lines[0].split('|')
+    accounting = {}
+    for line in lines[1:]:
+        row = dict(zip(header, line.split('|')))
+        match = re.match(r'^(\d+)_(\d+)(?:\.(\w+))?$', row.get('JobID', ''))
+        if not match:
+            continue
+
+        key = (match.group(1), int(match.group(2)))
+        task = accounting.setdefault(key, {'max_rss': None})
+
+        # The allocation line has the times, the steps have the memory use.
+        if match.group(3) is None:
+            submit, start = parse_time(row['Submit']), parse_time(row['Start'])
+            task['job_name'] = row['JobName']
+            task['state'] = row['State']
+            task['queue_wait'] = (start - submit).total_seconds() \
+                if submit and start else None
+            task['walltime'] = float(row['ElapsedRaw'] or 0)
+            task['cpu_time'] = parse_duration(row['TotalCPU'])
+            task['cpus'] = int(row['AllocCPUS'] or 0)
+        memory = parse_memory(row.get('MaxRSS'))
+        if memory is not None:
+            task['max_rss'] = max(task['max_rss'] or 0, memory)
+
+    return accounting
+
+
+def collect(log_dirs, sacct_file=None, default_iteration=None):
+    """
+    Joins the array task logs with their accounting records. Returns a list
+    of per-task dictionaries (job_id, task_id, iteration, event, stage,
+    state, queue_wait, walltime, cpu_time, cpus, max_rss).
+
+    :log_dirs: List of log directories.
+    :sacct_file: Optional saved sacct output (see read_sacct).
+    :default_iteration: Iteration for tasks whose logs don't name one.
+    """
+
+    tasks = {}
+    for log_dir in log_dirs:
+        tasks.update(parse_logs(log_dir))
+
+    accounting = read_sacct([job for job, _ in tasks], sacct_file)
+
+    records = []
+    for (job_id, task_id), task in sorted(tasks.items()):
+        if (job_id, task_id) not in accounting:
+            continue
+        record = {'job_id': job_id, 'task_id': task_id,
+                  'iteration': task['iteration'] or default_iteration,
+                  'event': task['event'], 'stage': task['stage']}
+        record.update(accounting[(job_id, task_id)])
+
+        # The job name is the stage, for anything oval_office.py submitted.
+        job_name = record.pop('job_name', None)
+        if job_name in LOG_STAGES:
+            record['stage'] = LOG_STAGES[job_name]
+        records.append(record)
+
+    return records
+
+
+def cpu_efficiency(record):
+    """
+    Fraction of the allocated cores a task kept busy.
+    """
+
+    if not record['walltime'] or not record['cpus'] or \
+            record['cpu_time'] is None:
+        return None
+
+    return record['cpu_time'] / (record['walltime'] * record['cpus'])
+
+
+def report(records, straggler_factor=2.0):
+    """
+    Summarises task records per stage: queue wait, walltime, how many of the
+    allocated cores were used and peak memory, followed by the stragglers
+    (tasks which ran longer than straggler_factor times the stage median).
+    Returns a list of lines.
+
+    :records: List of task records (see collect).
+    :straggler_factor: Walltime / median walltime above which a task is
+    reported as a straggler.
+    """
+
+    lines = []
+    stages = {}
+    for record in records:
+        if record.get('walltime'):
+            stages.setdefault(record['stage'], []).append(record)
+
+    lines.append('%-20s %6s %12s %12s %12s %14s %10s' % (
+        'stage', 'tasks', 'wait (min)', 'median (min)', 'max (min)',
+        'cores used', 'max rss'))
+    for stage, stage_records in sorted(stages.items()):
+        walltime = np.array([r['walltime'] for r in stage_records])
+        waits = [r['queue_wait'] for r in stage_records
+                 if r.get('queue_wait') is not None]
+        efficiencies = [(cpu_efficiency(r), r['cpus']) for r in stage_records
+                        if cpu_efficiency(r) is not None]
+        memory = [r['max_rss'] for r in stage_records if r.get('max_rss')]
+
+        if efficiencies:
+            used = np.mean([e * cpus for e, cpus in efficiencies])
+            allocated = np.mean([cpus for _, cpus in efficiencies])
+            cores = '%.1f of %d' % (used, allocated)
+        else:
+            cores = '-'
+
+        lines.append('%-20s %6d %12.1f %12.1f %12.1f %14s %10s' % (
+            stage, len(stage_records),
+            np.median(waits) / 60. if waits else 0.,
+            np.median(walltime) / 60., walltime.max() / 60., cores,
+            '%.2f GB' % (max(memory) / 2.**30) if memory else '-'))
+
+    lines.append('')
+    lines.append('Stragglers (walltime > %.1f x stage median):'
+                 % (straggler_factor))
+    for stage, stage_records in sorted(stages.items()):
+        median = np.median([r['walltime'] for r in stage_records])
+        for record in sorted(stage_records, key=lambda r: -r['walltime']):
+            if record['walltime'] <= straggler_factor * median:
+                break
+            lines.append('  %-20s %-60s %8.1f min (%.1f x median)' % (
+                stage, record['event'] or '%s_%d' % (record['job_id'],
+                                                     record['task_id']),
+                record['walltime'] / 60., record['walltime'] / median))
+
+    return lines
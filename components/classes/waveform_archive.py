@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import os
+import time
+import tarfile
+import subprocess
+
+from cStringIO import StringIO
+
+# Archive compressions, and the suffix each gives the archive.
+COMPRESSIONS = {'none': '.tar', 'gzip': '.tar.gz', 'zstd': '.tar.zst'}
+
+
+def archive_name(name, compression='none'):
+    """
+    Returns the file name of an archive (i.e. data -> data.tar.zst).
+    """
+
+    return name + COMPRESSIONS[compression]
+
+
+def compression_of(path):
+    """
+    Returns the compression of an archive from its name.
+    """
+
+    for compression, suffix in COMPRESSIONS.items():
+        if path.endswith(suffix):
+            return compression
+
+    raise ValueError('%s is not an archive.' % (path))
+
+
+def is_archive(path):
+    return path.endswith(tuple(COMPRESSIONS.values()))
+
+
+def find_archive(directory, name='data'):
+    """
+    Returns the path of the archive called name in a directory, whichever
+    compression it has, or None. If there are several (the compression was
+    changed between runs), the newest is the one to read.
+    """
+
+    paths = [os.path.join(directory, archive_name(name, compression))
+             for compression in sorted(COMPRESSIONS)]
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        return None
+
+    return max(paths, key=os.path.getmtime)
+
+
+def extract_command(path):
+    """
+    Returns the tar command extracting an archive into the current directory.
+    """
+
+    compression = compression_of(path)
+    if compression == 'zstd':
+        return ['tar', '--use-compress-program=zstd', '-xvf', path]
+    if compression == 'gzip':
+        return ['tar', '-xzvf', path]
+
+    return ['tar', '-xvf', path]
+
+
+def iter_members(archive_path, suffix='.mseed'):
+    """
+    Streams through a tar archive, and yields the (name, contents) of each
+    member ending in suffix. Nothing is extracted to disk, and the archive is
+    read sequentially from front to back. zstd archives are decompressed by
+    the zstd program on the way in.
+
+    :archive_path: Path to tar archive.
+    :suffix: Only yield members with names ending in this.
+    """
+
+    process = None
+    if compression_of(archive_path) == 'zstd':
+        process = subprocess.Popen(['zstd', '-q', '-d', '-c', archive_path],
+                                   stdout=subprocess.PIPE)
+        tar = tarfile.open(fileobj=process.stdout, mode='r|')
+    else:
+        tar = tarfile.open(archive_path, 'r|*')
+    try:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith(suffix):
+                continue
+            yield os.path.basename(member.name), \
+                tar.extractfile(member).read()
+    finally:
+        tar.close()
+        if process is not None:
+            process.stdout.close()
+            process.wait()
+
+
+class ArchiveWriter(object):
+
+    def __init__(self, archive_path):
+        """
+        Writes in-memory files straight into a tar archive. The archive is
+        written under a temporary name, and only moved into place on close, so
+        a crashed job never leaves a half written archive behind. The
+        compression follows from the name (see COMPRESSIONS); zstd archives
+        are compressed by the zstd program.
+
+        :archive_path: Path to the tar archive to write.
+        """
+
+        self.archive_path = archive_path
+        self.partial_path = archive_path + '.part'
+        self.process = None
+        compression = compression_of(archive_path)
+        if compression == 'zstd':
+            self.process = subprocess.Popen(
+                ['zstd', '-q', '-f', '-o', self.partial_path],
+                stdin=subprocess.PIPE)
+            self.tar = tarfile.open(fileobj=self.process.stdin, mode='w|')
+        elif compression == 'gzip':
+            self.tar = tarfile.open(self.partial_path, 'w:gz')
+        else:
+            self.tar = tarfile.open(self.partial_path, 'w')
+        self.n_members = 0
+
+    def add(self, name, contents):
+        """
+        Adds a member to the archive.
+
+        :name: Member name.
+        :contents: String of bytes to write.
+        """
+
+        info = tarfile.TarInfo(name=name)
+        info.size = len(contents)
+        info.mtime = time.time()
+        info.mode = 0644
+        self.tar.addfile(info, StringIO(contents))
+        self.n_members += 1
+
+    def close(self):
+        """
+        Finishes the archive, and moves it to its final location.
+        """
+
+        self.finish()
+        os.rename(self.partial_path, self.archive_path)
+
+    def finish(self):
+
+        self.tar.close()
+        if self.process is not None:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise IOError('zstd failed writing %s.' % (self.archive_path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.finish()
+            finally:
+                if os.path.exists(self.partial_path):
+                    os.remove(self.partial_path)
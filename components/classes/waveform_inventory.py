@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+
+import os
+import struct
+import tarfile
+import calendar
+import datetime
+import subprocess
+import numpy as np
+
+from multiprocessing import Pool
+
+from catalogue import classify_archive
+from waveform_archive import is_archive, compression_of
+
+# MiniSEED fixed section of data header (48 bytes): sequence number and
+# quality, station, location, channel and network codes, start time (BTIME),
+# number of samples, sample rate factor and multiplier, flags, number of
+# blockettes, time correction, and the offsets of the data and of the first
+# blockette.
+FIXED_HEADER = '6s c x 5s 2s 3s 2s HHBBBxH H hh BBBB i HH'
+FIXED_HEADER_BYTES = 48
+
+# Blockette 1000 holds the record length (as a power of two).
+BLOCKETTE_1000 = 1000
+DEFAULT_RECORD_LENGTH = 4096
+
+# One row per channel of each archive (see build_inventory). Start and end
+# times are POSIX timestamps; end is the time after the last sample.
+INVENTORY_DTYPE = np.dtype(
+    [('event', 'S128'), ('stage', 'S16'), ('iteration', 'S64'),
+     ('archive', 'S512'), ('network', 'S2'), ('station', 'S5'),
+     ('location', 'S2'), ('channel', 'S3'), ('start', 'f8'), ('end', 'f8'),
+     ('sampling_rate', 'f8'), ('npts', 'i8')])
+
+
+class HeaderError(Exception):
+    pass
+
+
+def sampling_rate(factor, multiplier):
+    """
+    The sample rate (Hz) of a MiniSEED record from its rate factor and
+    multiplier (SEED manual, fixed section of data header).
+    """
+
+    if factor == 0 or multiplier == 0:
+        return 0.
+    if factor > 0 and multiplier > 0:
+        return float(factor * multiplier)
+    if factor > 0:
+        return -float(factor) / multiplier
+    if multiplier > 0:
+        return -float(multiplier) / factor
+
+    return 1. / (factor * multiplier)
+
+
+def parse_header(header):
+    """
+    Parses the fixed header of a MiniSEED record (the first 48 bytes), and
+    works out the byte order from the start time. Returns (byte order, id
+    fields, start time, number of samples, sample rate, first blockette).
+    """
+
+    for order in ['>', '<']:
+        fields = struct.unpack(order + FIXED_HEADER, header)
+        year, day = fields[6], fields[7]
+        if 1900 <= year <= 2100 and 1 <= day <= 366:
+            break
+    else:
+        raise HeaderError('Not a MiniSEED record.')
+
+    station, location, channel, network = [field.strip(' \x00')
+                                           for field in fields[2:6]]
+    hour, minute, second, fraction = fields[8:12]
+    start = calendar.timegm((datetime.datetime(year, 1, 1) +
+                             datetime.timedelta(days=day - 1)).timetuple()) \
+        + hour * 3600 + minute * 60 + second + fraction * 1e-4 + \
+        fields[19] * 1e-4 * (not fields[15] & 0x02)
+
+    return order, (network, station, location, channel), start, \
+        fields[12], sampling_rate(fields[13], fields[14]), fields[21]
+
+
+def record_length(order, record, first_blockette):
+    """
+    Follows the blockette chain of a record (record holds at least the
+    blockettes) to blockette 1000, and returns the record length.
+    """
+
+    offset = first_blockette
+    while offset and offset + 8 <= len(record):
+        kind, next_offset = struct.unpack(order + 'HH',
+                                          record[offset:offset + 4])
+        if kind == BLOCKETTE_1000:
+            return 2 ** struct.unpack('B', record[offset + 6])[0]
+        if next_offset <= offset:
+            break
+        offset = next_offset
+
+    return DEFAULT_RECORD_LENGTH
+
+
+def scan_records(stream, size):
+    """
+    Reads the headers of the MiniSEED records in a file-like stream of size
+    bytes, skipping the samples. Returns a dictionary of (network, station,
+    location, channel) -> [start, end, sample rate, number of samples].
+    """
+
+    channels = {}
+    position = 0
+    while position + FIXED_HEADER_BYTES <= size:
+        # The fixed header, and room for the blockettes which follow it.
+        head = stream.read(FIXED_HEADER_BYTES + 16)
+        if len(head) < FIXED_HEADER_BYTES:
+            break
+        order, id, start, npts, rate, first_blockette = parse_header(
+            head[:FIXED_HEADER_BYTES])
+        length = record_length(order, head, first_blockette)
+
+        end = start + (npts / rate if rate else 0.)
+        if id in channels:
+            channel = channels[id]
+            channel[0], channel[1] = min(channel[0], start), \
+                max(channel[1], end)
+            channel[3] += npts
+        else:
+            channels[id] = [start, end, rate, npts]
+
+        skip(stream, length - len(head))
+        position += length
+
+    return channels
+
+
+def skip(stream, length):
+    """
+    Moves a stream forward: seeks if it can, reads otherwise.
+    """
+
+    if length <= 0:
+        return
+    try:
+        stream.seek(length, os.SEEK_CUR)
+    except (AttributeError, IOError, tarfile.StreamError):
+        while length > 0:
+            chunk = stream.read(min(length, 1 << 16))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+
+def open_tar(path):
+    """
+    Opens an archive for scanning. Uncompressed archives are opened for
+    random access, so the samples are seeked over rather than read. Returns
+    (tar, process) (process is the zstd decompressor, or None).
+    """
+
+    compression = compression_of(path)
+    if compression == 'zstd':
+        process = subprocess.Popen(['zstd', '-q', '-d', '-c', path],
+                                   stdout=subprocess.PIPE)
+        return tarfile.open(fileobj=process.stdout, mode='r|'), process
+    if compression == 'gzip':
+        return tarfile.open(path, 'r|gz'), None
+
+    return tarfile.open(path, 'r:'), None
+
+
+def scan_archive(path):
+    """
+    Lists the channels in an archive of MiniSEED files (one row of
+    INVENTORY_DTYPE, as a tuple, per channel), from the record headers
+    alone.
+
+    :path: Archive (DATA/<event>/raw, DATA/<event>/preprocessed_* or
+    SYNTHETICS/<event>/ITERATION_<name>).
+    """
+
+    owner = classify_archive(path)
+    iteration, event, stage = owner if owner else ('', '', '')
+
+    rows = []
+    tar, process = open_tar(path)
+    try:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith('.mseed'):
+                continue
+            stream = tar.extractfile(member)
+            try:
+                channels = scan_records(stream, member.size)
+            except HeaderError:
+                print 'Skipping %s in %s: not MiniSEED.' % (member.name, path)
+                continue
+            for id, (start, end, rate, npts) in channels.items():
+                rows.append((event, stage, iteration, path) + id +
+                            (start, end, rate, npts))
+    finally:
+        tar.close()
+        if process is not None:
+            process.stdout.close()
+            process.wait()
+
+    return rows
+
+
+def find_archives(lasif_path):
+    """
+    Lists the raw, preprocessed and synthetics archives of a LASIF project.
+    """
+
+    archives = []
+    for root in ['DATA', 'SYNTHETICS']:
+        root_path = os.path.join(lasif_path, root)
+        if not os.path.isdir(root_path):
+            continue
+        for event in sorted(os.listdir(root_path)):
+            event_path = os.path.join(root_path, event)
+            if not os.path.isdir(event_path):
+                continue
+            for tag in sorted(os.listdir(event_path)):
+                tag_path = os.path.join(event_path, tag)
+                if not os.path.isdir(tag_path):
+                    continue
+                archives.extend([os.path.join(tag_path, file)
+                                 for file in sorted(os.listdir(tag_path))
+                                 if is_archive(file) and
+                                 classify_archive(os.path.join(tag_path,
+                                                               file))])
+
+    return archives
+
+
+def archive_signature(path):
+    stat = os.stat(path)
+    return '%d:%.6f' % (stat.st_size, stat.st_mtime)
+
+
+def build_inventory(lasif_path, cache_path=None, processes=None):
+    """
+    Builds the inventory of every waveform archive of a LASIF project: one
+    row (INVENTORY_DTYPE) per channel of each archive. The archives are
+    scanned in parallel, reading only the MiniSEED record headers. With
+    cache_path, the inventory is kept in an .npz file, and only archives
+    which are new or have changed since are scanned again.
+
+    :lasif_path: LASIF project.
+    :cache_path: Optional .npz file to cache the inventory in.
+    :processes: Number of processes to scan with (default: all cores).
+    """
+
+    archives = find_archives(lasif_path)
+    signatures = dict((path, archive_signature(path)) for path in archives)
+
+    cached, cached_signatures = np.zeros(0, dtype=INVENTORY_DTYPE), {}
+    if cache_path and os.path.exists(cache_path):
+        cache = np.load(cache_path)
+        cached = cache['inventory']
+        cached_signatures = dict(zip(cache['archives'], cache['signatures']))
+
+    keep = [path for path in archives
+            if cached_signatures.get(path) == signatures[path]]
+    scan = [path for path in archives if path not in set(keep)]
+
+    rows = []
+    if len(scan) > 1:
+        pool = Pool(processes=processes)
+        for archive_rows in pool.imap_unordered(scan_archive, scan):
+            rows.extend(archive_rows)
+        pool.close()
+        pool.join()
+    elif scan:
+        rows = scan_archive(scan[0])
+
+    kept = cached[np.in1d(cached['archive'], keep)] if len(keep) \
+        else cached[:0]
+    inventory = np.concatenate([kept, np.array(rows, dtype=INVENTORY_DTYPE)])
+    inventory.sort(order=['event', 'stage', 'iteration', 'network',
+                          'station', 'location', 'channel'])
+
+    if cache_path:
+        partial = cache_path + '.part.npz'
+        np.savez(partial, inventory=inventory,
+                 archives=np.array(archives, dtype='S512'),
+                 signatures=np.array([signatures[path] for path in archives],
+                                     dtype='S64'))
+        os.rename(partial, cache_path)
+
+    return inventory
+
+
+def availability(inventory, stage, iteration=None):
+    """
+    The event x station x channel availability matrix of a stage.
+
+    :inventory: Inventory (see build_inventory).
+    :stage: raw, preprocessed or synthetics.
+    :iteration: Only count synthetics of this iteration.
+    Returns (events, stations (NET.STA), channels (LOC.CHA), boolean array).
+    """
+
+    rows = inventory[inventory['stage'] == stage]
+    if iteration is not None and stage == 'synthetics':
+        rows = rows[rows['iteration'] == iteration]
+
+    stations = np.char.add(np.char.add(rows['network'], '.'),
+                           rows['station'])
+    channels = np.char.add(np.char.add(rows['location'], '.'),
+                           rows['channel'])
+    events, event_index = np.unique(rows['event'], return_inverse=True)
+    station_names, station_index = np.unique(stations, return_inverse=True)
+    channel_names, channel_index = np.unique(channels, return_inverse=True)
+
+    matrix = np.zeros((len(events), len(station_names), len(channel_names)),
+                      dtype=bool)
+    matrix[event_index, station_index, channel_index] = True
+
+    return events, station_names, channel_names, matrix
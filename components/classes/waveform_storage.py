@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# Sample formats waveforms can be stored in, and their MiniSEED encodings.
+# steim2 stores integers, scaled so the largest sample uses STEIM2_BITS bits.
+PRECISIONS = {'float64': 'FLOAT64', 'float32': 'FLOAT32', 'steim2': 'STEIM2'}
+STEIM2_BITS = 24
+
+# Sample formats the stages may write. LASIF reads the members just as they
+# are stored, so scaled steim2 integers are only for measure_storage.py.
+STAGE_PRECISIONS = ['float32', 'float64']
+
+# Sample format of every stage when the parameter file sets none.
+DEFAULT_PRECISION = 'float32'
+
+
+def encode_samples(data, precision):
+    """
+    Converts samples for storage. Returns (samples, MiniSEED encoding, scale
+    factor); the stored samples times the scale factor give the data back.
+
+    :data: Array of samples.
+    :precision: One of PRECISIONS.
+    """
+
+    if precision not in PRECISIONS:
+        raise ValueError('Unknown precision %s.' % (precision))
+
+    if precision == 'float64':
+        return np.require(data, dtype=np.float64), PRECISIONS[precision], 1.
+    if precision == 'float32':
+        return np.require(data, dtype=np.float32), PRECISIONS[precision], 1.
+
+    peak = np.abs(data).max() if len(data) else 0.
+    scale = peak / (2 ** (STEIM2_BITS - 1) - 1) if peak > 0 else 1.
+    samples = np.round(np.asarray(data) / scale).astype(np.int32)
+
+    return samples, PRECISIONS[precision], float(scale)
+
+
+def decode_samples(samples, scale=1.):
+    """
+    Returns stored samples as float64 data (the inverse of encode_samples).
+    """
+
+    return np.asarray(samples, dtype=np.float64) * scale
@@ -0,0 +1,16 @@
+#!/bin/bash
+
+# Helpers for array scripts submitted with a task manifest (written by
+# oval_office.py, see classes/manifest.py). Source this file, then loop over
+# the entries of the task:
+#
+#   for entry in $(manifest_line $MANIFEST $SLURM_ARRAY_TASK_ID); do
+#     IFS='|' read myEvent otherField <<< "$entry"
+#   done
+
+# Prints the line of array task $2 from manifest $1. All lines have the same
+# width, so dd seeks straight to it rather than reading the whole file.
+manifest_line() {
+  local width=$(head -n 1 $1 | wc -c)
+  dd if=$1 bs=$width skip=$(($2 + 1)) count=1 2> /dev/null
+}
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import obspy
+import numpy as np
+
+from cStringIO import StringIO
+
+from classes.waveform_archive import (iter_members, is_archive, ArchiveWriter,
+                                      COMPRESSIONS, archive_name)
+from classes.waveform_storage import (PRECISIONS, encode_samples,
+                                      decode_samples)
+
+
+def read_traces(path):
+    """
+    Reads the traces of an event, from a directory of MiniSEED files or from
+    an archive. Returns a list of (name, trace).
+    """
+
+    if is_archive(path):
+        members = iter_members(path)
+    else:
+        members = ((file, open(os.path.join(path, file), 'rb').read())
+                   for file in sorted(os.listdir(path))
+                   if file.endswith('.mseed'))
+
+    traces = []
+    for name, contents in members:
+        for tr in obspy.read(StringIO(contents), format='MSEED'):
+            traces.append((name, tr))
+
+    return traces
+
+
+def encode_traces(traces, precision):
+    """
+    Writes each trace to MiniSEED in memory with a precision. Returns the
+    list of (name, bytes), the write time, and the largest error of any trace
+    relative to its peak amplitude, once read back.
+    """
+
+    members, error = [], 0.
+    start = time.time()
+    for name, tr in traces:
+        samples, encoding, scale = encode_samples(tr.data, precision)
+        out = obspy.Trace(data=samples, header=tr.stats.copy())
+        buffer = StringIO()
+        out.write(buffer, format='MSEED', encoding=encoding)
+        members.append((name, buffer.getvalue()))
+
+        read = obspy.read(StringIO(members[-1][1]), format='MSEED')[0]
+        peak = np.abs(tr.data).max()
+        if peak > 0:
+            error = max(error, np.abs(decode_samples(read.data, scale) -
+                                      tr.data).max() / peak)
+    elapsed = time.time() - start
+
+    return members, elapsed, error
+
+
+def archive_members(members, directory, compression):
+    """
+    Writes members into an archive with a compression. Returns the archive
+    size and the write time.
+    """
+
+    path = os.path.join(directory, archive_name('measure', compression))
+    start = time.time()
+    with ArchiveWriter(path) as writer:
+        for name, contents in members:
+            writer.add(name, contents)
+    elapsed = time.time() - start
+    size = os.path.getsize(path)
+    os.remove(path)
+
+    return size, elapsed
+
+
+# ---
+parser = argparse.ArgumentParser(description='Measures the storage options '
+                                 'on the waveforms of one event: for each '
+                                 'sample format and archive compression, the '
+                                 'archive size, the write time, and the '
+                                 'largest error relative to the peak '
+                                 'amplitude of a trace.')
+parser.add_argument('path', type=str, help='Directory of MiniSEED files, or '
+                    'data archive, of an event.')
+parser.add_argument('--precisions', type=str, nargs='+',
+                    default=['float64', 'float32', 'steim2'],
+                    choices=sorted(PRECISIONS.keys()))
+parser.add_argument('--compressions', type=str, nargs='+',
+                    default=['none', 'gzip', 'zstd'],
+                    choices=sorted(COMPRESSIONS.keys()))
+# ---
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    traces = read_traces(args.path)
+    samples = sum([tr.stats.npts for _, tr in traces])
+    print 'Read %d traces (%d samples) from %s' % (len(traces), samples,
+                                                   args.path)
+
+    directory = tempfile.mkdtemp(prefix='measure_storage.')
+    try:
+        print '%-8s %-6s %12s %9s %10s %10s' % (
+            'format', 'tar', 'size (MB)', 'ratio', 'write (s)', 'error')
+        reference = None
+        for precision in args.precisions:
+            members, encode_time, error = encode_traces(traces, precision)
+            for compression in args.compressions:
+                size, archive_time = archive_members(members, directory,
+                                                     compression)
+                if reference is None:
+                    reference = float(size)
+                print '%-8s %-6s %12.2f %9.2f %10.2f %10.2e' % (
+                    precision, compression, size / 1e6, reference / size,
+                    encode_time + archive_time, error)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+import obspy
+import numpy as np
+
+from cStringIO import StringIO
+from multiprocessing import Pool, cpu_count
+
+from classes.iteration import Iteration
+from classes.resampler import LanczosResampler
+from classes.spectral import (next_fast_length, cosine_taper, detrend,
+                              bandpass_response)
+from classes.waveform_archive import (iter_members, ArchiveWriter,
+                                      COMPRESSIONS, archive_name,
+                                      find_archive)
+from classes.waveform_storage import (STAGE_PRECISIONS, DEFAULT_PRECISION,
+                                      encode_samples)
+
+# Water level (dB) used when inverting the instrument response.
+WATER_LEVEL = 60.0
+
+# Per-worker processing settings, and a cache of station inventories.
+settings = {}
+inventories = {}
+
+
+def init_worker(worker_settings):
+    """
+    Hands the processing settings to each worker of the pool.
+    """
+
+    settings.update(worker_settings)
+
+
+def read_batches(archive_path, batch_size):
+    """
+    Streams the raw archive, and yields lists of batch_size (name, contents)
+    tuples.
+
+    :archive_path: Path to the raw data archive.
+    :batch_size: Number of members per batch.
+    """
+
+    batch = []
+    for member in iter_members(archive_path):
+        batch.append(member)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def get_response_spectrum(trace, nfft):
+    """
+    Evaluates the velocity response of the instrument which recorded a trace.
+    StationXML files are read once per worker, and cached.
+
+    :trace: Obspy trace.
+    :nfft: Number of points of the FFT the response is used with.
+    """
+
+    xml_name = 'station.%s_%s.xml' % (trace.stats.network, trace.stats.station)
+    if xml_name not in inventories:
+        inventories[xml_name] = obspy.read_inventory(
+            os.path.join(settings['station_dir'], xml_name), format='STATIONXML')
+
+    response = inventories[xml_name].get_response(trace.id,
+                                                  trace.stats.starttime)
+    spectrum, _ = response.get_evalresp_response(
+        t_samp=trace.stats.delta, nfft=nfft, output='VEL')
+
+    return spectrum
+
+
+def invert_spectra(spectra):
+    """
+    Inverts a batch of instrument response spectra, clipping each to the water
+    level below its maximum amplitude.
+
+    :spectra: 2D array of complex spectra, one per row.
+    """
+
+    amplitude = np.abs(spectra)
+    level = amplitude.max(axis=1)[:, np.newaxis] * 10 ** (-WATER_LEVEL / 20.)
+
+    clip = (amplitude < level) & (amplitude > 0)
+    spectra = np.where(clip, level * spectra / np.where(clip, amplitude, 1),
+                       spectra)
+
+    inverse = np.zeros_like(spectra)
+    nonzero = spectra != 0
+    inverse[nonzero] = 1 / spectra[nonzero]
+
+    return inverse
+
+
+def pre_filter(frequencies, f1, f2, f3, f4):
+    """
+    Cosine taper in the frequency domain, which is flat between f2 and f3 and
+    zero outside of f1 and f4. Keeps the response removal stable.
+    """
+
+    taper = np.zeros(len(frequencies))
+    taper[(frequencies >= f2) & (frequencies <= f3)] = 1.
+
+    rise = (frequencies > f1) & (frequencies < f2)
+    taper[rise] = 0.5 * (1 - np.cos(np.pi * (frequencies[rise] - f1) /
+                                    (f2 - f1)))
+    fall = (frequencies > f3) & (frequencies < f4)
+    taper[fall] = 0.5 * (1 + np.cos(np.pi * (frequencies[fall] - f3) /
+                                    (f4 - f3)))
+
+    return taper
+
+
+def resample_to_grid(data, lengths, start_times, delta):
+    """
+    Interpolates a batch of records (all sampled at delta) onto the
+    simulation time grid of the iteration, with the Lanczos resampler the
+    synthetics go through (resampler.py). Records which start at the same
+    time, and have the same length, are resampled together. Samples outside
+    a record are zero.
+
+    :data: 2D array, one record per row.
+    :lengths: Array of valid record lengths, one per row.
+    :start_times: Start time of each record (UTCDateTime).
+    :delta: Sampling interval of the records.
+    """
+
+    groups = {}
+    for row, start in enumerate(start_times):
+        groups.setdefault((settings['origin_time'] - start, lengths[row]),
+                          []).append(row)
+
+    resampled = np.zeros((data.shape[0], settings['npts']))
+    for (offset, length), rows in groups.items():
+        resampler = LanczosResampler(delta, settings['dt'], settings['npts'],
+                                     length, time_offset=offset, keep=False)
+        resampled[rows] = resampler.resample(data[rows, :length])
+
+    return resampled
+
+
+def process_group(traces):
+    """
+    Processes a batch of traces which share a sampling rate. Detrending,
+    tapering, instrument correction and bandpass filtering are done on the
+    whole batch at once, and the result is interpolated onto the iteration's
+    time grid. Returns a list of (name, MiniSEED bytes).
+
+    :traces: List of (name, trace) tuples.
+    """
+
+    delta = traces[0][1].stats.delta
+    lengths = np.array([tr.stats.npts for _, tr in traces])
+    data = np.zeros((len(traces), lengths.max()))
+    for i, (_, tr) in enumerate(traces):
+        data[i, :lengths[i]] = tr.data
+
+    # Detrend and taper.
+    detrend(data, lengths)
+    data *= cosine_taper(lengths, data.shape[1])
+
+    # Instrument response, pre filter and bandpass in a single pass.
+    nfft = next_fast_length(2 * data.shape[1])
+    frequencies = np.fft.rfftfreq(nfft, delta)
+    spectra = np.fft.rfft(data, nfft, axis=1)
+
+    keep = []
+    responses = []
+    for i, (name, tr) in enumerate(traces):
+        try:
+            responses.append(get_response_spectrum(tr, nfft))
+            keep.append(i)
+        except Exception as exception:
+            print 'No response for %s, skipping (%s).' % (name, exception)
+
+    if not keep:
+        return []
+
+    highpass, lowpass = settings['highpass'], settings['lowpass']
+    operator = invert_spectra(np.array(responses)) * \
+        pre_filter(frequencies, 0.5 * highpass, highpass, lowpass,
+                   2 * lowpass) * \
+        bandpass_response(frequencies, 1. / delta, 1. / lowpass, 1. / highpass)
+
+    data = np.fft.irfft(spectra[keep] * operator, nfft,
+                        axis=1)[:, :data.shape[1]]
+    lengths = lengths[keep]
+
+    # Clean up the edges, and interpolate.
+    detrend(data, lengths)
+    data *= cosine_taper(lengths, data.shape[1])
+    data = resample_to_grid(data, lengths, [traces[i][1].stats.starttime
+                                            for i in keep], delta)
+
+    processed = []
+    for row, i in enumerate(keep):
+        name, tr = traces[i]
+        samples, encoding, _ = encode_samples(data[row],
+                                              settings['precision'])
+        out = obspy.Trace(data=samples)
+        out.stats.network = tr.stats.network
+        out.stats.station = tr.stats.station
+        out.stats.location = tr.stats.location
+        out.stats.channel = tr.stats.channel
+        out.stats.starttime = settings['origin_time']
+        out.stats.delta = settings['dt']
+
+        buffer = StringIO()
+        out.write(buffer, format='MSEED', encoding=encoding)
+        processed.append((name, buffer.getvalue()))
+
+    return processed
+
+
+def process_batch(batch):
+    """
+    Decodes a batch of raw MiniSEED members, groups them by sampling rate,
+    and processes each group. Returns a list of (name, MiniSEED bytes).
+
+    :batch: List of (name, contents) tuples from the raw archive.
+    """
+
+    groups = {}
+    for name, contents in batch:
+        try:
+            st = obspy.read(StringIO(contents), format='MSEED')
+            st.merge()
+        except Exception as exception:
+            print 'Could not read %s, skipping (%s).' % (name, exception)
+            continue
+
+        if len(st) != 1 or np.ma.is_masked(st[0].data):
+            print 'Gaps in %s, skipping.' % (name)
+            continue
+
+        key = round(st[0].stats.sampling_rate, 6)
+        groups.setdefault(key, []).append((name, st[0]))
+
+    processed = []
+    for traces in groups.values():
+        processed.extend(process_group(traces))
+
+    return processed
+
+
+def read_origin_time(event_file):
+    """
+    Reads the origin time from a LASIF QuakeML event file.
+    """
+
+    event = obspy.readEvents(event_file)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    return origin.time
+
+
+# ---
+parser = argparse.ArgumentParser(description='Preprocesses the raw data of '
+                                 'one event, streaming it straight from the '
+                                 'raw archive into the preprocessed archive.')
+parser.add_argument('--lasif_path', type=str, help='Path to LASIF project.',
+                    required=True)
+parser.add_argument('--iteration_name', type=str, help='Iteration name.',
+                    required=True)
+parser.add_argument('--event_name', type=str, help='Event name.',
+                    required=True)
+parser.add_argument('--batch_size', type=int, default=64,
+                    help='Number of traces processed together.')
+parser.add_argument('--processes', type=int, default=cpu_count(),
+                    help='Number of worker processes.')
+parser.add_argument('--precision', type=str, default=DEFAULT_PRECISION,
+                    choices=STAGE_PRECISIONS, help='Sample format of the '
+                    'preprocessed data.')
+parser.add_argument('--compression', type=str, default='none',
+                    choices=sorted(COMPRESSIONS.keys()), help='Compression '
+                    'of the preprocessed archive.')
+# ---
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    iteration = Iteration(args.lasif_path, args.iteration_name)
+
+    raw_archive = find_archive(iteration.data_path(args.event_name))
+    write_dir = iteration.data_path(args.event_name,
+                                    iteration.preprocessing_tag)
+    write_archive = os.path.join(write_dir, archive_name('data',
+                                                         args.compression))
+
+    if raw_archive is None:
+        print 'No raw data archive for ' + args.event_name + '... skipping'
+    elif find_archive(write_dir) is not None:
+        print find_archive(write_dir) + ' already exists... skipping'
+    else:
+        if not os.path.isdir(write_dir):
+            os.makedirs(write_dir)
+
+        worker_settings = {
+            'station_dir': os.path.join(iteration.lasif_path, 'STATIONS',
+                                        'StationXML'),
+            'origin_time': read_origin_time(
+                iteration.event_path(args.event_name)),
+            'highpass': iteration.highpass,
+            'lowpass': iteration.lowpass,
+            'npts': iteration.npts,
+            'dt': iteration.dt,
+            'precision': args.precision}
+
+        print "Running on " + str(args.processes) + " cores."
+        pool = Pool(processes=args.processes, initializer=init_worker,
+                    initargs=(worker_settings,))
+
+        written = 0
+        with ArchiveWriter(write_archive) as writer:
+            for processed in pool.imap(process_batch, read_batches(
+                    raw_archive, args.batch_size)):
+                for name, contents in processed:
+                    writer.add(name, contents)
+                    written += 1
+
+        pool.close()
+        pool.join()
+        print 'Wrote %d preprocessed traces to %s' % (written,
+                                                       write_archive)
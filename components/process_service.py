@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import traceback
+import SocketServer
+
+# Socket the service listens on, unless one is given.
+DEFAULT_SOCKET = os.environ.get(
+    'PROCESS_SERVICE_SOCKET',
+    '/tmp/process_synthetics.%s.sock' % (os.environ.get('USER', 'service')))
+
+# Last line of the reply to a job: DONE <exit code> <seconds>.
+DONE = 'DONE'
+
+
+class JobHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        """
+        Runs one request: a line of JSON holding either the process_synthetics
+        command line of a job (and the directory to run it in), or a stop
+        command. What the job prints is streamed back as it runs, followed by
+        a DONE line.
+        """
+
+        request = json.loads(self.rfile.readline())
+        if request.get('command') == 'stop':
+            self.wfile.write('%s 0 0\n' % (DONE))
+            self.server.stopping = True
+            return
+
+        start = time.time()
+        code = run_job(request['argv'], request.get('cwd', '.'), self.wfile)
+        self.wfile.write('%s %d %.3f\n' % (DONE, code, time.time() - start))
+
+
+def run_job(argv, cwd, output):
+    """
+    Runs a process_synthetics job in this process, on the warm pool. Returns
+    its exit code.
+
+    :argv: Command line of the job (without the program name).
+    :cwd: Directory to run the job in.
+    :output: File to send what the job prints to.
+    """
+
+    import process_synthetics
+
+    stdout, stderr, directory = sys.stdout, sys.stderr, os.getcwd()
+    sys.stdout = sys.stderr = output
+    try:
+        os.chdir(cwd)
+        job_args = process_synthetics.parse_arguments(argv)
+        if job_args.backend != 'pool':
+            print 'The service only runs the pool backend.'
+            return 2
+        process_synthetics.configure(job_args)
+        seismograms = process_synthetics.run_pool()
+        print 'Processed %d seismograms.' % (seismograms)
+        return 0
+    except SystemExit as exit:
+        return exit.code if isinstance(exit.code, int) else 1
+    except Exception:
+        traceback.print_exc(file=output)
+        return 1
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        os.chdir(directory)
+
+
+def serve(socket_path, processes):
+    """
+    Runs the service: imports the processing modules and starts the pool of
+    workers once, then runs the jobs sent to socket_path one after the
+    other, until it is told to stop. The workers keep their caches (sources,
+    operators, resampling weights) from one job to the next.
+    """
+
+    from multiprocessing import Pool, cpu_count
+    import process_synthetics
+
+    process_synthetics.worker_processes = processes or cpu_count() / 2
+    process_synthetics.worker_pool = Pool(
+        processes=process_synthetics.worker_processes)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = SocketServer.UnixStreamServer(socket_path, JobHandler)
+    server.stopping = False
+    print 'Serving on %s.' % (socket_path)
+    try:
+        while not server.stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        process_synthetics.worker_pool.close()
+        process_synthetics.worker_pool.join()
+
+
+def send(socket_path, request):
+    """
+    Sends a request to the service, and prints the reply as it comes in.
+    Returns the exit code of the job.
+    """
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_path)
+    connection.sendall(json.dumps(request) + '\n')
+
+    code = 1
+    for line in connection.makefile('r'):
+        if line.startswith(DONE + ' '):
+            code = int(line.split()[1])
+            break
+        sys.stdout.write(line)
+        sys.stdout.flush()
+    connection.close()
+
+    return code
+
+
+# ---
+parser = argparse.ArgumentParser(description='Long lived service which '
+                                 'runs process_synthetics.py jobs with its '
+                                 'imports, workers and caches kept warm, and '
+                                 'the client which sends it jobs. With '
+                                 'submit, the process_synthetics.py '
+                                 'arguments of the job follow --.')
+parser.add_argument('action', choices=['serve', 'submit', 'stop'],
+                    help='Run the service, submit a job to it, or stop it.')
+parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET,
+                    help='Socket of the service (default: '
+                    '$PROCESS_SERVICE_SOCKET, or %(default)s).')
+parser.add_argument('--processes', type=int, help='Number of workers of '
+                    'the service (default: half the cores).')
+# ---
+
+if __name__ == '__main__':
+
+    # The job's arguments are split off first, so that they can't be taken
+    # for the service's own.
+    argv, job = sys.argv[1:], []
+    if '--' in argv:
+        argv, job = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+    args = parser.parse_args(argv)
+    if args.action == 'serve':
+        serve(args.socket, args.processes)
+    elif args.action == 'stop':
+        sys.exit(send(args.socket, {'command': 'stop'}))
+    else:
+        if not job:
+            parser.error('Give the arguments of the job after --.')
+        sys.exit(send(args.socket, {'argv': job, 'cwd': os.getcwd()}))
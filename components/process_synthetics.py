@@ -1,69 +1,660 @@
 #!/usr/bin/env python
 
 import math
+import copy
 import argparse
 import os
 import obspy
 import numpy as np
-import shutil
 
 from classes.seismogram import SyntheticSeismogram
-from classes.cmt_solution import CMTSolution
+from classes.cmt_solution import CMTSolution, PROCESSING_HALF_DURATION
+from classes.iteration import Iteration
+from classes.resampler import LanczosResampler
+from classes.spectral import gaussian_stf
+from classes import solver_output
+from classes import synthetic_operator
+from classes import source_time_function
+from classes.waveform_storage import STAGE_PRECISIONS, DEFAULT_PRECISION
+from itertools import izip
 from multiprocessing import Pool, cpu_count
 
 
-def run_processing_script(file):
-    
-    print 'Processing: ' + os.path.basename(file)
-    seismogram = SyntheticSeismogram(file)
-    cmtsolution = CMTSolution(args.cmt_file)
+# Parsed CMT solutions, and opened binary solver outputs, by file.
+cmt_solutions = {}
+solver_outputs = {}
+cached_sources = {}
+
+# Source time function kernels, by file and sampling, and the table of
+# per-event half durations (--half_duration).
+source_kernels = {}
+half_durations = {}
+
+# The arguments of the current job, and what follows from them (see
+# configure). A warm worker service (process_service.py) runs many jobs in
+# one process, and keeps its pool of workers (and their number) in
+# worker_pool and worker_processes.
+args = None
+bands = None
+resample = False
+worker_pool = None
+worker_processes = None
+
+
+def get_cmt_solution(cmt_file):
+    """
+    Returns the CMTSolution of a file, parsing it only once per process, or
+    not at all if it is in the --source_catalogue.
+    """
+
+    if cmt_file not in cmt_solutions:
+        if cmt_file in cached_sources:
+            cmt_solutions[cmt_file] = CMTSolution.from_record(
+                cached_sources[cmt_file])
+        else:
+            cmt_solutions[cmt_file] = CMTSolution(cmt_file)
+        half_duration = event_half_duration(cmt_file,
+                                            cmt_solutions[cmt_file])
+        if half_duration is not None:
+            cmt_solutions[cmt_file].set_half_duration(half_duration)
+
+    return cmt_solutions[cmt_file]
+
+
+def event_half_duration(cmt_file, cmtsolution):
+    """
+    The half duration to process an event with, following --half_duration:
+    the one in its CMTSOLUTION ('cmt'), a number, or the event's entry in a
+    table (events are looked up by the name of their solver directory, then
+    by the event name in the CMTSOLUTION). None keeps the default.
+    """
+
+    if args.half_duration is None:
+        return None
+    if args.half_duration == 'cmt':
+        return cmtsolution.cmt_half_duration
+    if not half_durations:
+        try:
+            return float(args.half_duration)
+        except ValueError:
+            half_durations.update(source_time_function.read_half_durations(
+                args.half_duration))
+
+    event = os.path.basename(os.path.dirname(os.path.dirname(cmt_file)))
+    for name in [event, cmtsolution.event_name]:
+        if name in half_durations:
+            return half_durations[name]
+
+    return None
+
+
+def get_source_kernels(file, dt):
+    """
+    Returns the (new, simulation) source time function kernels for a
+    seismogram, following --stf and --deconvolve_stf. Either is None if it
+    isn't asked for: the new one is then the gaussian of the CMT solution,
+    and nothing is deconvolved. The simulation's source time function is
+    read from the OUTPUT_FILES directory the seismogram is in.
+    """
+
+    stf, simulation_stf = None, None
+    if args.stf:
+        if (args.stf, dt) not in source_kernels:
+            source_kernels[(args.stf, dt)] = source_time_function.read_stf(
+                args.stf, dt)
+        stf = source_kernels[(args.stf, dt)]
+
+    if args.deconvolve_stf:
+        output_files = output_directory(file)
+        if (output_files, dt) not in source_kernels:
+            source_kernels[(output_files, dt)] = \
+                source_time_function.read_simulation_stf(output_files, dt)
+            if source_kernels[(output_files, dt)] is None:
+                print 'No %s in %s, not deconvolving.' % (
+                    source_time_function.SOLVER_STF_FILE, output_files)
+        simulation_stf = source_kernels[(output_files, dt)]
+
+    return stf, simulation_stf
+
+
+def convolve_source(seismogram, cmtsolution, stf, simulation_stf):
+    """
+    Convolves a seismogram with its source time function: the gaussian of
+    the CMT solution, unless --stf or --deconvolve_stf ask for something else.
+    """
+
+    if stf is None and simulation_stf is None:
+        seismogram.convolve_stf(cmtsolution)
+        return
+
+    if stf is None:
+        stf = gaussian_stf(seismogram.dt, cmtsolution.half_duration,
+                           cmtsolution.alpha)
+    seismogram.replace_stf(stf, simulation_stf)
+
+
+def output_directory(file):
+    """
+    The OUTPUT_FILES directory of a seismogram file, or of binary solver
+    output (a file in it, or the directory of SAC files itself).
+    """
+
+    return file if os.path.isdir(file) else os.path.dirname(file)
+
+
+def band_file_name(file_name, index):
+    """
+    Where a seismogram of the index'th period band goes. With one band,
+    that is next to the solver's seismogram; with several, each band has a
+    band<index> subdirectory.
+    """
+
+    if len(bands) == 1:
+        return file_name
+
+    return os.path.join(os.path.dirname(file_name), 'band%d' % (index),
+                        os.path.basename(file_name))
+
+
+def make_band_dirs(items):
+    """
+    Makes the band subdirectories of every output directory (see
+    band_file_name) up front, so the workers don't race to make them.
+    """
+
+    if len(bands) == 1:
+        return
+
+    for directory in set([output_directory(file) for file, _, _ in items]):
+        for index in range(len(bands)):
+            band_dir = os.path.join(directory, 'band%d' % (index))
+            if not os.path.isdir(band_dir):
+                os.makedirs(band_dir)
+
+
+def split_bands(seismogram, band_data):
+    """
+    Makes a copy of a seismogram for each band, holding that band's data.
+    """
+
+    seismograms = []
+    for index, data in enumerate(band_data):
+        band = copy.copy(seismogram)
+        band.tr = seismogram.tr.copy()
+        band.data = band.tr.data = data
+        band.fname = band_file_name(seismogram.fname, index)
+        seismograms.append(band)
+
+    return seismograms
+
+
+def read_seismogram(file, trace):
+    """
+    Reads one seismogram, from an ascii file (trace is None) or from the
+    binary solver output of an event. Each process opens a binary output only
+    once, and reads just the requested trace from it.
+    """
+
+    if trace is None:
+        return SyntheticSeismogram(file)
+
+    if file not in solver_outputs:
+        solver_outputs[file] = solver_output.open_output(file)
+    output = solver_outputs[file]
+    stack = output.read([trace])
+
+    return SyntheticSeismogram.from_array(output.file_name(trace),
+                                          stack.times(0), stack.data[0])
+
+
+def report(item):
+    """
+    Says which seismogram of an item (see process_seismogram) is done. This
+    is printed by the process driving the work rather than by the pool
+    workers, so it reaches the task log also when the job runs in the
+    processing service.
+    """
+
+    file, _, trace = item
+    print 'Processing: ' + (trace or os.path.basename(file))
+
+
+def process_seismogram(item):
+    """
+    Reads and processes one seismogram, for every period band. Reading,
+    convolving with the source time function and converting to velocity are
+    done once; only the filtering is done for each band. Returns a list of
+    SyntheticSeismograms (one per band), which remember the CMT solution file
+    they were processed with.
+
+    :item: Tuple of (seismogram file, CMT solution file, trace name). The
+    trace name is None for ascii files.
+    """
+
+    file, cmt_file, trace = item
+    seismogram = read_seismogram(file, trace)
+    cmtsolution = get_cmt_solution(cmt_file)
 #    seismogram.fill_to_start_time(cmtsolution.time_shift)
     seismogram.get_start_time(cmtsolution.start_time)
-    seismogram.convolve_stf(cmtsolution)
+    stf, simulation_stf = get_source_kernels(file, seismogram.dt)
+    seismogram.cmt_file = cmt_file
+
+    # Within a memory budget, traces too long to process whole are processed
+    # by the fused operator, block by block.
+    npts = len(seismogram.data)
+    blocked = args.memory_budget is not None and \
+        npts * 8 * (6 + 2 * len(bands)) > args.process_budget
+    if args.fused or blocked:
+        operator = synthetic_operator.get_operator(
+            npts, seismogram.dt, cmtsolution, bands, stf, simulation_stf)
+        if args.memory_budget is not None and \
+                operator.working_bytes() > args.process_budget:
+            band_data = operator.apply_blocks(
+                seismogram.data, operator.block_size(args.process_budget))
+        else:
+            band_data = operator.apply_bands(seismogram.data)
+        return split_bands(seismogram, band_data)
+
+    convolve_source(seismogram, cmtsolution, stf, simulation_stf)
     seismogram.convert_to_velocity()
 #    seismogram.reset_length()
-    seismogram.filter(args.min_p, args.max_p)
+    seismograms = split_bands(seismogram, [seismogram.data.copy()
+                                           for _ in bands])
+    for band, (min_p, max_p) in zip(seismograms, bands):
+        band.filter(min_p, max_p)
     # seismogram.write_specfem_ascii(file + '.convolved.filtered')
-    seismogram.write_sac(file)
-    
+
+    return seismograms
+
+
+def run_processing_script(job_item):
+    """
+    Processes one work item in a pool worker. Items carry the arguments of
+    their job, so that the workers of a pool which outlives a job (see
+    process_service.py) set themselves up for the next one.
+
+    :job_item: Tuple of (job arguments, work item).
+    """
+
+    job_args, item = job_item
+    if args is None or vars(job_args) != vars(args):
+        configure(job_args)
+    seismograms = process_seismogram(item)
+
+    # Resampling happens on whole stacks, so hand the seismograms back.
+    if resample:
+        return seismograms
+
+    return [seismogram.write_sac(seismogram.fname, args.precision)
+            for seismogram in seismograms]
+
+
+def resample_and_write(seismograms, iteration):
+    """
+    Resamples a stack of processed seismograms onto the time grid of the
+    iteration, and writes them. The interpolation weights are only computed
+    once for each (dt, npts) combination, and shared by the whole stack.
+
+    :seismograms: List of processed SyntheticSeismogram objects.
+    :iteration: Iteration object holding the target grid.
+    Returns the (path, scale factor) of each file written.
+    """
+
+    written = []
+    groups = {}
+    for seismogram in seismograms:
+        groups.setdefault((seismogram.cmt_file, seismogram.dt,
+                           len(seismogram.data)), []).append(seismogram)
+
+    for (cmt_file, dt, npts), group in groups.items():
+        origin_time = obspy.UTCDateTime(get_cmt_solution(cmt_file).origin_time)
+        resampler = LanczosResampler(
+            dt, iteration.dt, iteration.npts, npts,
+            time_offset=origin_time - group[0].tr.stats.starttime,
+            cache_dir=args.weight_cache)
+        stack = resampler.resample(np.array([s.data for s in group]))
+
+        for seismogram, data in zip(group, stack):
+            seismogram.set_time_grid(data, iteration.dt, origin_time)
+            written.append(seismogram.write_sac(seismogram.fname,
+                                                args.precision))
+
+    return written
+
+
+def validate_fused(items):
+    """
+    Processes seismograms both with the fused operator and sequentially, and
+    prints how far apart they are (largest difference relative to the
+    largest amplitude), over the whole trace and away from its ends.
+
+    :items: Work items (see find_work) to compare.
+    """
+
+    worst = 0.
+    for file, cmt_file, trace in items:
+        cmtsolution = get_cmt_solution(cmt_file)
+        seismogram = read_seismogram(file, trace)
+        stf, simulation_stf = get_source_kernels(file, seismogram.dt)
+        operator = synthetic_operator.get_operator(
+            len(seismogram.data), seismogram.dt, cmtsolution, bands, stf,
+            simulation_stf)
+        fused = operator.apply_bands(seismogram.data)
+
+        convolve_source(seismogram, cmtsolution, stf, simulation_stf)
+        seismogram.convert_to_velocity()
+        velocity = seismogram.data
+        for band_fused, (min_p, max_p) in zip(fused, bands):
+            seismogram.data = velocity.copy()
+            seismogram.filter(min_p, max_p)
+
+            edge = int(max_p / seismogram.dt)
+            misfit = synthetic_operator.compare(band_fused, seismogram.data)
+            interior = synthetic_operator.compare(band_fused,
+                                                  seismogram.data, edge)
+            worst = max(worst, misfit)
+            print 'Fused vs. sequential %s (%g-%g s): %.2e (%.2e without ' \
+                'the ends)' % (trace or os.path.basename(file), min_p, max_p,
+                               misfit, interior)
+
+    print 'Largest fused vs. sequential misfit: %.2e' % (worst)
+
+
+def find_work():
+    """
+    Returns the (seismogram file, CMT solution file, trace name) tuples to
+    process, for every -f / -cmt pair. Binary solver output (ASDF, ADIOS or a
+    directory of SAC files) gives one tuple per trace in it.
+    """
+
+    items = []
+    for seismo_file, cmt_file in zip(args.seismo_file, args.cmt_file):
+        if solver_output.is_solver_output(seismo_file):
+            output = solver_output.open_output(seismo_file)
+            items.extend([(seismo_file, cmt_file, trace)
+                          for trace in output.trace_ids()])
+        elif args.whole_directory:
+            items.extend([(os.path.join(seismo_file, file), cmt_file, None)
+                          for file in sorted(os.listdir(seismo_file))
+                          if file.endswith('.ascii')])
+        else:
+            items.append((seismo_file, cmt_file, None))
+
+    return items
+
+
+def write_log():
+    with open("master_log.txt", "a") as myfile:
+      for min_p, max_p in bands:
+        myfile.write("Filtering frequencies are %d and %d" % (1/max_p, 1/min_p))
+
+
+def stack_limit(seismogram, iteration):
+    """
+    The number of seismograms to resample together: --stack_size, or fewer
+    if a stack of seismograms like this one would not fit in the memory
+    budget of a process (the stack, its resampled copy and the written
+    traces).
+    """
+
+    if args.memory_budget is None:
+        return args.stack_size
+
+    trace_bytes = 8 * 3 * (len(seismogram.data) + iteration.npts)
+    return max(1, min(args.stack_size,
+                      int(args.process_budget / trace_bytes)))
+
+
+def run_pool():
+    """
+    Processes all the seismograms with a pool of processes on this node.
+    With --memory_budget, the budget is shared between the workers and this
+    process (which resamples the stacks), and work is handed to the workers
+    a stack at a time, so finished seismograms don't pile up.
+    """
+
+    write_log()
+    target_files = find_work()
+    make_band_dirs(target_files)
+    if args.validate_fused:
+        validate_fused(target_files[:args.validate_fused])
+
+    pool, processes = worker_pool, worker_processes
+    if pool is None:
+        print "Running on " + str(cpu_count()) + " cores."
+        processes = cpu_count()/2
+        pool = Pool(processes=processes)
+    if args.memory_budget is not None:
+        args.process_budget = args.memory_budget * 1e6 / (processes + 1)
+    job_items = [(args, item) for item in target_files]
+
+    if resample:
+        iteration = Iteration(args.lasif_path, args.iteration_name)
+        stack, limit = [], args.stack_size
+        while job_items:
+            # Hand out no more than a stack of work at a time, but at least
+            # one item per worker, so none of them sits idle.
+            chunk = max(processes, limit / len(bands))
+            for (_, item), seismograms in izip(
+                    job_items[:chunk], pool.imap(run_processing_script,
+                                                 job_items[:chunk])):
+                report(item)
+                stack.extend(seismograms)
+                limit = stack_limit(stack[0], iteration)
+                if len(stack) >= limit:
+                    resample_and_write(stack, iteration)
+                    stack = []
+            job_items = job_items[chunk:]
+        if stack:
+            resample_and_write(stack, iteration)
+    else:
+        for (_, item), written in izip(job_items, pool.imap(
+                run_processing_script, job_items)):
+            report(item)
+
+    if pool is not worker_pool:
+        pool.close()
+        pool.join()
+
+    return len(target_files)
+
+
+def run_mpi():
+    """
+    Processes all the seismograms with one MPI rank per core, over as many
+    nodes as the job has. Rank 0 lists the work and hands every rank a strided
+    share of it (neighbouring files have similar lengths, so the shares come
+    out even). Every seismogram is written to its own file by the rank that
+    processed it, so ranks never write to the same file. Per-rank statistics
+    are gathered and printed by rank 0.
+    """
+
+    from mpi4py import MPI
+
+    comm = MPI.COMM_WORLD
+    rank, size = comm.Get_rank(), comm.Get_size()
+    if args.memory_budget is not None:
+        node_ranks = comm.Split_type(MPI.COMM_TYPE_SHARED).Get_size()
+        args.process_budget = args.memory_budget * 1e6 / node_ranks
+
+    items = None
+    if rank == 0:
+        write_log()
+        items = find_work()
+        make_band_dirs(items)
+        print "Running on %d ranks." % (size)
+        if args.validate_fused:
+            validate_fused(items[:args.validate_fused])
+    items = comm.bcast(items, root=0)[rank::size]
+
+    iteration = None
+    if resample:
+        iteration = Iteration(args.lasif_path, args.iteration_name)
+
+    stats = {'rank': rank, 'host': MPI.Get_processor_name(),
+             'seismograms': len(items),
+             'events': len(set([cmt_file for _, cmt_file, _ in items])),
+             'process_time': 0., 'write_time': 0.}
+    start = MPI.Wtime()
+    stack = []
+    for item in items:
+        time = MPI.Wtime()
+        report(item)
+        seismograms = process_seismogram(item)
+        stats['process_time'] += MPI.Wtime() - time
+
+        time = MPI.Wtime()
+        if resample:
+            stack.extend(seismograms)
+            if len(stack) >= stack_limit(stack[0], iteration):
+                resample_and_write(stack, iteration)
+                stack = []
+        else:
+            for seismogram in seismograms:
+                seismogram.write_sac(seismogram.fname, args.precision)
+        stats['write_time'] += MPI.Wtime() - time
+
+    if stack:
+        time = MPI.Wtime()
+        resample_and_write(stack, iteration)
+        stats['write_time'] += MPI.Wtime() - time
+    stats['total_time'] = MPI.Wtime() - start
+
+    stats = comm.gather(stats, root=0)
+    if rank == 0:
+        print '%5s %-20s %12s %7s %12s %12s %12s' % (
+            'rank', 'host', 'seismograms', 'events', 'process (s)',
+            'write (s)', 'total (s)')
+        for rank_stats in stats:
+            print '%5d %-20s %12d %7d %12.1f %12.1f %12.1f' % (
+                rank_stats['rank'], rank_stats['host'],
+                rank_stats['seismograms'], rank_stats['events'],
+                rank_stats['process_time'], rank_stats['write_time'],
+                rank_stats['total_time'])
+        totals = [rank_stats['total_time'] for rank_stats in stats]
+        print 'Processed %d seismograms; slowest rank %.1f s, mean %.1f s.' \
+            % (sum([rank_stats['seismograms'] for rank_stats in stats]),
+               max(totals), np.mean(totals))
+
 # ---
 parser = argparse.ArgumentParser(description='Performs post processing on a '
                                              'directory of .ascii seismograms')
-parser.add_argument('-f', type=str, help='Path to ascii seismogram file, or '
-                    'directory of files.',
-                    dest='seismo_file', required=True)
+parser.add_argument('-f', type=str, help='Path to ascii seismogram file, '
+                    'directory of files, or binary solver output (ASDF/ADIOS '
+                    'file, or directory of SAC files). Several can be given, '
+                    'one for each -cmt.', nargs='+', dest='seismo_file',
+                    required=True)
 parser.add_argument('-cmt', type=str, help='Path to cmt solution',
-                    dest='cmt_file', required=True)
+                    nargs='+', dest='cmt_file', required=True)
 parser.add_argument(
-    '--min_p', type=float, help='Minimum period', required=True)
+    '--min_p', type=float, help='Minimum period. Several can be given, one '
+    'for each --max_p, to process several period bands in one pass (each '
+    'band is written to a band<index> subdirectory).', nargs='+',
+    required=True)
 parser.add_argument(
-    '--max_p', type=float, help='Maximum period', required=True)
+    '--max_p', type=float, help='Maximum period', nargs='+', required=True)
 parser.add_argument('--whole_directory', help='Loop through all seismograms '
                     'in a directory, rather than just a single one.',
                     action='store_true')
-args = parser.parse_args()
+parser.add_argument('--lasif_path', type=str, help='Path to LASIF project. '
+                    'Given with --iteration_name, the seismograms are '
+                    'resampled onto the time grid of the iteration.')
+parser.add_argument('--iteration_name', type=str, help='Iteration name.')
+parser.add_argument('--weight_cache', type=str, help='Directory in which to '
+                    'cache resampling weights between runs.')
+parser.add_argument('--stack_size', type=int, default=256, help='Number of '
+                    'seismograms resampled together.')
+parser.add_argument('--backend', type=str, default='pool',
+                    choices=['pool', 'mpi'], help='Process with a pool of '
+                    'processes on one node, or with MPI ranks on several '
+                    'nodes (run with mpirun/aprun -n <ranks>).')
+parser.add_argument('--fused', action='store_true', help='Convolve with the '
+                    'source time function, convert to velocity and filter '
+                    'in one pass, with a single FFT per trace.')
+parser.add_argument('--validate_fused', type=int, default=0, metavar='N',
+                    help='Before processing, compare the fused and '
+                    'sequential processing on the first N seismograms.')
+parser.add_argument('--source_catalogue', type=str, help='Cached source '
+                    'catalogue (sources.<iteration>.npz, written by '
+                    'oval_office.py) to take the CMT solutions from.')
+parser.add_argument('--half_duration', type=str, help='Half duration (s) '
+                    'of the gaussian source time function: a number, "cmt" '
+                    'for the one in each CMTSOLUTION, or a file of event '
+                    'names and half durations. Default: %s s.'
+                    % (PROCESSING_HALF_DURATION))
+parser.add_argument('--stf', type=str, help='Two column (time, moment rate) '
+                    'file of a source time function to use for every event '
+                    'instead of the gaussian.')
+parser.add_argument('--deconvolve_stf', action='store_true', help='Treat '
+                    'the solver output as the response to the source time '
+                    'function the solver wrote to OUTPUT_FILES, and '
+                    'deconvolve it before convolving with the new one.')
+parser.add_argument('--memory_budget', type=float, help='Memory (MB) the '
+                    'processing may use on a node, shared between its '
+                    'processes. Resampling stacks are sized to it, and '
+                    'traces too long to process whole are processed in '
+                    'overlap-save blocks.')
+parser.add_argument('--precision', type=str, default=DEFAULT_PRECISION,
+                    choices=STAGE_PRECISIONS, help='Sample format of the '
+                    'processed seismograms.')
 # ---
 
-# Fix any paths.
-args.seismo_file = os.path.abspath(args.seismo_file)
-args.cmt_file = os.path.abspath(args.cmt_file)
 
-# Write to log file.
-with open("master_log.txt", "a") as myfile:
-  myfile.write("Filtering frequencies are %d and %d" % (1/args.max_p, 1/args.min_p))
+def parse_arguments(argv=None):
+    """
+    Parses and checks the command line (or argv), and makes the paths in it
+    absolute.
+    """
+
+    job_args = parser.parse_args(argv)
+    if len(job_args.seismo_file) != len(job_args.cmt_file):
+        parser.error('Give one -cmt for each -f.')
+    if len(job_args.min_p) != len(job_args.max_p):
+        parser.error('Give one --max_p for each --min_p.')
+
+    # Fix any paths.
+    job_args.seismo_file = [os.path.abspath(path)
+                            for path in job_args.seismo_file]
+    job_args.cmt_file = [os.path.abspath(path) for path in job_args.cmt_file]
+
+    return job_args
+
+
+def configure(job_args):
+    """
+    Sets up the module for a job. The caches of parsed sources and source
+    time functions are kept, unless the job changes the options they depend
+    on; the operator and resampling weight caches are keyed on everything
+    they depend on, and are always kept.
+
+    :job_args: Parsed arguments of the job (see parse_arguments).
+    """
+
+    global args, bands, resample, cached_sources
+
+    source_options = ['source_catalogue', 'half_duration', 'stf',
+                      'deconvolve_stf']
+    if args is None or [getattr(args, option) for option in source_options] \
+            != [getattr(job_args, option) for option in source_options]:
+        cmt_solutions.clear()
+        source_kernels.clear()
+        half_durations.clear()
+        cached_sources = {}
+        if job_args.source_catalogue and \
+                os.path.exists(job_args.source_catalogue):
+            cached_sources = dict(
+                (source['path'], source) for source in
+                np.load(job_args.source_catalogue)['sources'])
+
+    args = job_args
+    bands = zip(args.min_p, args.max_p)
+    resample = args.lasif_path is not None and args.iteration_name is not None
 
-target_files = []
-if args.whole_directory:
-    for file in os.listdir(args.seismo_file):
-        if file.endswith('.ascii'):
-            target_files.append(os.path.join(args.seismo_file, file))
-else:
-    target_files.append(args.seismo_file)
 
-print "Running on " + str(cpu_count()) + " cores."
 if __name__ == '__main__':
-    
-    pool = Pool(processes=cpu_count()/2)
-    pool.map(run_processing_script, target_files)
 
-shutil.copy(target_files[0], os.path)
+    configure(parse_arguments())
+    if args.backend == 'mpi':
+        run_mpi()
+    else:
+        run_pool()
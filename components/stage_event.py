@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+from classes.event_stage import EventStage, DEFAULT_STAGE_ROOT, same_members
+
+
+def run(args):
+    """
+    Stages the archives of an event on node-local storage, runs a command in
+    the staged project, and writes back the members it added or changed (only
+    if it succeeded). Returns the exit code of the command.
+    """
+
+    start = time.time()
+    with EventStage(args.lasif_path, args.stage, args.stage_root) as stage:
+        members = stage.extract()
+        print 'Staged %d members in %s (%.1f s)' % (members, stage.path,
+                                                    time.time() - start)
+
+        code = subprocess.Popen(args.command, cwd=stage.path).wait()
+        if code != 0:
+            print 'Command failed (exit code %d): nothing written back.' % (
+                code)
+            return code
+
+        for archive, written in sorted(stage.write_back().items()):
+            print '%s: %s' % (archive, '%d members written' % (written)
+                              if written else 'unchanged')
+
+    print 'Done in %.1f s' % (time.time() - start)
+    return 0
+
+
+# ---
+parser = argparse.ArgumentParser(description='Runs a LASIF command for one '
+                                 'event on node-local storage: the archives '
+                                 'of the event\'s waveform directories are '
+                                 'extracted to a staged copy of the project, '
+                                 'the command runs there, and only new or '
+                                 'changed members go back into the archives. '
+                                 'With --unchanged, tells whether two '
+                                 'archives hold the same members instead.')
+parser.add_argument('--lasif_path', type=str, help='LASIF project.')
+parser.add_argument('--stage', type=str, nargs='+', default=[],
+                    help='Waveform directories of the event to stage.')
+parser.add_argument('--stage_root', type=str, default=DEFAULT_STAGE_ROOT,
+                    help='Node-local directory to stage in (default: '
+                    '$STAGE_ROOT, or %(default)s).')
+parser.add_argument('--unchanged', type=str, nargs=2,
+                    metavar=('ARCHIVE', 'OTHER'), help='Exit with 0 if the '
+                    'archives hold the same members, 1 otherwise.')
+parser.add_argument('command', nargs=argparse.REMAINDER, help='Command to '
+                    'run in the staged project (after --).')
+# ---
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    if args.unchanged:
+        sys.exit(0 if same_members(*args.unchanged) else 1)
+
+    args.command = args.command[1:] if args.command[:1] == ['--'] \
+        else args.command
+    if not args.lasif_path or not args.stage or not args.command:
+        parser.error('Give --lasif_path, --stage and a command.')
+    if not os.path.isdir(args.lasif_path):
+        parser.error('No LASIF project %s.' % (args.lasif_path))
+    sys.exit(run(args))
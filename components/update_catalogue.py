@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+
+from classes.catalogue import Journal, describe_output, journal_path
+
+# ---
+parser = argparse.ArgumentParser(description='Records the outputs of a '
+                                 'finished stage for the iteration catalogue. '
+                                 'They are written to the catalogue\'s '
+                                 'journal, and taken in the next time '
+                                 'oval_office.py opens it.')
+parser.add_argument('--catalogue', type=str, help='Path to catalogue '
+                    'database.', default=os.environ.get('CATALOGUE'))
+parser.add_argument('--iteration', type=str, help='Iteration name (leave '
+                    'empty for outputs shared by all iterations).', default='')
+parser.add_argument('--event', type=str, help='Event name.', required=True)
+parser.add_argument('--stage', type=str, help='Stage name.', required=True)
+parser.add_argument('--checksum', action='store_true', help='Store md5 '
+                    'checksums of files.')
+parser.add_argument('paths', type=str, nargs='+', help='Output paths.')
+args = parser.parse_args()
+# ---
+
+if args.catalogue is None:
+    parser.error('No catalogue given, and $CATALOGUE is not set.')
+
+rows = []
+for path in args.paths:
+    if not os.path.exists(path):
+        print 'Not recording missing output: ' + path
+        continue
+    rows.append(describe_output(args.iteration, args.event, args.stage, path,
+                                checksum=args.checksum))
+
+if rows:
+    Journal(journal_path(args.catalogue)).write(rows)
@@ -12,54 +12,67 @@
 
 export MV2_ENABLE_AFFINITY=0
 export KMP_AFFINITY=compact
-export OMP_NUM_THREADS=8
+cores=${SLURM_CPUS_PER_TASK:-8}
+export OMP_NUM_THREADS=$cores
 
-if [ "$3" == '' ]; then
+if [ "$3" == '' ] || [ -z "$MANIFEST" ]; then
   echo "Usage: ./preprocess_data_parallel [lasif_scratch_dir] [lasif_base_dir] [iteration_name]"
+  echo "Submit through oval_office.py, which writes the task manifest (\$MANIFEST)."
   exit
 fi
 
 lasif_scratch_dir=$1
 lasif_base_dir=$2
 iteration_name=$3
-eventsDir=$lasif_scratch_dir/EVENTS
-dataDir=$lasif_scratch_dir/DATA
 shopt -s nullglob
 
-# Get event names.
-array=($eventsDir/*)
-
-# Parse name from path.
-myEvent=${array[$SLURM_ARRAY_TASK_ID]}
-myEvent=${myEvent%.xml}
-myEvent=${myEvent##*/}
-
-echo "PREPROCESSING: $myEvent\n\n"
+# Sample format and compression of the preprocessed data (storage_precision
+# and archive_compression in the parameter file, exported by oval_office.py).
+storage=""
+if [ -n "$STORAGE_PRECISION" ]; then
+  storage="$storage --precision $STORAGE_PRECISION"
+fi
+if [ -n "$ARCHIVE_COMPRESSION" ]; then
+  storage="$storage --compression $ARCHIVE_COMPRESSION"
+fi
 
-# # Move to the raw data directory, extract the data, and kick out the rawData.tar.
-cd $dataDir/$myEvent/raw
-tar -xvf data.tar
-rm data.tar
+# The events of this array task (one, or several packed together), and their
+# paths, are on its line of the task manifest written by oval_office.py.
+source $SLURM_SUBMIT_DIR/../components/manifest.sh
 
-# Run the preprocessing.
-aprun -n 1 -N 1 -d 8 lasif preprocess_data $iteration_name $myEvent --read_only_caches
+for entry in $(manifest_line $MANIFEST $SLURM_ARRAY_TASK_ID); do
+(
+  IFS='|' read myEvent dataDir <<< "$entry"
 
-# # Re-tar the raw files.
-tar -cvf data.tar
-rm -f *.mseed
+  echo "PREPROCESSING: $myEvent"
+  echo "ITERATION: $iteration_name"
 
-# Change back to event data directory.
-cd ../
+  # Stream the raw data through the preprocessing engine. The raw archive is
+  # read in place, and the results go straight into the preprocessed archive.
+  cd ../components/
+  aprun -n 1 -N 1 -d $cores ./preprocess_data.py --lasif_path $lasif_scratch_dir \
+    --iteration_name $iteration_name --event_name $myEvent --processes $cores $storage
 
-# Get most recently created directory (will be preprocessed one)
-for f in ./preprocessed*; do
-  if [ -d "$f" ]; then
-    cd $f
-    if [ ! -e ./data.tar ]; then
-      tar -cvf ./data.tar *.mseed
-      rm -f *.mseed
-      cd ../
-      rsync -av $f $lasif_base_dir/DATA/$myEvent/
+  # Sync the preprocessed directory back. Archives holding the same members
+  # as the ones already there are left alone.
+  for f in $dataDir/preprocessed*; do
+    if [ -d "$f" ]; then
+      unchanged=""
+      for archive in $f/data.tar*; do
+        if ./stage_event.py --unchanged $archive \
+            $lasif_base_dir/DATA/$myEvent/${f##*/}/${archive##*/}; then
+          echo "Unchanged: ${archive##*/}"
+          unchanged="$unchanged --exclude=${archive##*/}"
+        fi
+      done
+      rsync -av $unchanged $f $lasif_base_dir/DATA/$myEvent/
+      if [ -n "$CATALOGUE" ]; then
+        for archive in $f/data.tar*; do
+          ./update_catalogue.py --event $myEvent --stage preprocessed --checksum \
+            $archive $lasif_base_dir/DATA/$myEvent/${f##*/}/${archive##*/}
+        done
+      fi
     fi
-  fi
+  done
+)
 done
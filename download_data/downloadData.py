@@ -5,18 +5,20 @@ import sys
 import time
 import ftplib
 import urllib
-import shutil
 import tarfile
 import argparse
-import subprocess
 import dataModule as dm
 
-from obspy import read
-from fnmatch import fnmatch
+from obspy import read, Stream
+from cStringIO import StringIO
 
 from itertools import repeat
 from multiprocessing import Pool
 
+# Channels kept when converting .SEED volumes: BH and LH, Z, N and E components.
+CHANNEL_BANDS      = ['B', 'L']
+CHANNEL_COMPONENTS = 'ZNE'
+
 def reportHook (a, b, c):
   '''
   Optional progress bar. Default off (looks ugly for parallel downloads).
@@ -34,22 +36,51 @@ def requestData ((file, baseUrl, saveDir)):
   print "Retrieving: " + file
   urllib.urlretrieve (fullPath, savePath)
   
+def convertSeed (seedFile, tarPath):
+  '''
+  Reads the data records of a full .SEED volume directly (the volume, abbreviation and station
+  headers are skipped by the MiniSEED reader), keeping only the BH[Z,N,E] and LH[Z,N,E] channels,
+  which are selected while parsing. Each channel is written as MiniSEED, in memory, straight into
+  a tar at tarPath. Returns the number of channels written.
+  '''
+
+  st = Stream ()
+  for band in CHANNEL_BANDS:
+    st += read (seedFile, format='MSEED', sourcename='*.*.*.%sH?' % band)
+
+  # Join contiguous records of a channel. Segments separated by gaps are kept as they are.
+  st = Stream ([tr for tr in st if tr.stats.channel[-1] in CHANNEL_COMPONENTS])
+  st.merge (method=-1)
+
+  # Write the channels to a partial tar, and move it into place once it's complete.
+  channels = sorted (set ([tr.id for tr in st]))
+  tar = tarfile.open (tarPath + '.part', 'w')
+  for channel in channels:
+    buffer = StringIO ()
+    st.select (id=channel).write (buffer, format='MSEED')
+    info = tarfile.TarInfo (name=channel + '.mseed')
+    info.size = buffer.tell ()
+    info.mtime = time.time ()
+    info.mode = 0644
+    buffer.seek (0)
+    tar.addfile (info, buffer)
+  tar.close ()
+  os.rename (tarPath + '.part', tarPath)
+
+  return len (channels)
+  
 def unpackData (args):
   '''
-  This function looks through a given directory, and extracts all .SEED files which correspond to
+  This function looks through a given directory, and converts all .SEED files which correspond to
   an event. The seed files should have been downloaded within this same script, as their names will
-  be references to event names in the LASIF project. The .SAC files are extracted from the master
-  .SEED by rdseed (binary must be provided), into a temporary local directory. Then, obspy is used
-  to read in the .SAC files, and to convert them to .mseed files. These .mseed files are then 
-  tarred up, and moved to the appropriate data directory. Oh also, we're kicking files out of the
-  .SEED that don't begin with BH[Z,N,E] or LH[Z,N,E] mainly because no one seems to know what they
-  actually are.
+  be references to event names in the LASIF project. The .SEED volume is read directly by obspy
+  (no rdseed, and no intermediate .sac files), and each channel is written as a .mseed member of
+  raw/rawData.tar in the appropriate data directory. Oh also, we're kicking channels out of the
+  .SEED that aren't BH[Z,N,E] or LH[Z,N,E] mainly because no one seems to know what they actually
+  are. They're skipped while the volume is parsed.
   
   args.data_dir becomes the LASIF DATA directory.
   args.save_dir becomes the directory where the .SEED files are stored.
-  args.rdseed_binary is the path to the rdseed installation. Turns out the filenames given to 
-  rdseed have an absolute maximum length (hence the copying to the local directory -- absolute
-  paths are too long). WTF man.
   '''
   
   for dataDir in os.listdir (args.data_dir):
@@ -57,20 +88,11 @@ def unpackData (args):
 
       if dataDir in saveDir:
 
-        print dm.colours.HEADER + "\nExtracting .sac files for: " + dm.colours.OKBLUE + saveDir + \
-          dm.colours.ENDC
+        print dm.colours.HEADER + "\nConverting .SEED to miniSeed for: " + dm.colours.OKBLUE + \
+          saveDir + dm.colours.ENDC
         seedFile    = os.path.join (os.path.abspath (args.save_dir), saveDir) 
-        destination = os.path.join (os.path.abspath (args.data_dir), dataDir)
         rawDir      = os.path.join (os.path.abspath (args.data_dir), dataDir, 'raw')
        
-        # Make the extraction directory.
-        if not (os.path.exists ('./sacFiles')):
-          os.makedirs ('./sacFiles')
-
-        # Ensure extraction directory is clean.
-        for file in os.listdir ('./sacFiles'):
-          os.remove (os.path.join ('./sacFiles', file))
-        
         # Make the raw directory.
         if not (os.path.exists (rawDir)):
           os.makedirs (rawDir)
@@ -80,55 +102,23 @@ def unpackData (args):
             dm.colours.ENDC
           continue
 
-        # Extract the .sac files to a local scratch directory.
-        shutil.copyfile (seedFile, './extract.seed')
-        proc = subprocess.Popen ([args.rdseed_binary, '-d', '-f', './extract.seed', '-q', 
-          './sacFiles'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = proc.communicate ()
-        retcode = proc.wait ()
-        os.remove ('./extract.seed')
-
-        # Convert all sac files to miniseed.
-        print dm.colours.HEADER + "Converting to miniSeed." + dm.colours.ENDC 
-        for filename in os.listdir ('./sacFiles'):
-          if fnmatch (filename, '*BH[Z,N,E]*') or fnmatch (filename, '*LH[Z,N,E]*'):
-        
-            st = read (os.path.join ('./sacFiles', filename))
-            fname = st[0].stats.network + '.' + st[0].stats.station + '.' + \
-              st[0].stats.location + '.' + st[0].stats.channel + '.mseed'
-            st.write (os.path.join ('./sacFiles', fname), format='MSEED')
-        
-        # Tar the sac files.
-        print dm.colours.HEADER + 'Tarring seismograms.' + dm.colours.ENDC
-        tar = tarfile.open ('./rawData.tar', 'w')
-        for filename in os.listdir ('./sacFiles'):
-          if filename.endswith ('.mseed'):
-            tar.add (os.path.join ('./sacFiles', filename), arcname=filename)
-        tar.close ()
-
-        # Mv the tar-ed file to the DATA directory.
-        if os.path.exists (os.path.join (rawDir, 'rawData.tar')):
-          os.remove (os.path.join (rawDir, 'rawData.tar'))
-        shutil.move ('./rawData.tar', rawDir)
-        
-        # Report of status of rdseed.
-        if retcode == 0:
-          print dm.colours.OKGREEN + "Completed succesfully." + dm.colours.ENDC
-        else:
-          print dm.colours.WARNING + "Something fishy happened with " + seedFile + \
-            dm.colours.ENDC 
-
-  # Remove the temporary extraction directory.
-  shutil.rmtree ('./sacFiles')
+        # Convert straight into the tar.
+        try:
+          nChannels = convertSeed (seedFile, os.path.join (rawDir, 'rawData.tar'))
+        except Exception as exception:
+          if os.path.exists (os.path.join (rawDir, 'rawData.tar.part')):
+            os.remove (os.path.join (rawDir, 'rawData.tar.part'))
+          print dm.colours.WARNING + "Something fishy happened with " + seedFile + ': ' + \
+            str (exception) + dm.colours.ENDC
+          continue
+
+        print dm.colours.OKGREEN + "Completed succesfully (%d channels)." % (nChannels) + \
+          dm.colours.ENDC
           
 #----- Command line arguments.
 ##############################
 parser = argparse.ArgumentParser (description='Downloads relevant data files from IRIS.')
 
-parser.add_argument (
-    "--rdseed_binary", type=str, help="Path to rdseed binary", metavar="rdseed binary",
-    required=True)
-
 parser.add_argument (
   "--data_dir", type=str, help="Lasif DATA directory.", metavar="Lasif data dir.")
 
@@ -7,42 +7,35 @@
 #SBATCH --ntasks-per-node=1
 #SBATCH --cpus-per-task=1
 #SBATCH --time=03:00:00
-#SBATCH --output=./logs/window.%A.%a.o
-#SBATCH --error=./logs/window.%A.%a.e
+#SBATCH --output=./logs/finalize.%A.%a.o
+#SBATCH --error=./logs/finalize.%A.%a.e
 
 export MV2_ENABLE_AFFINITY=0
 export KMP_AFFINITY=compact
-export OMP_NUM_THREADS=1
+export OMP_NUM_THREADS=${SLURM_CPUS_PER_TASK:-1}
 
-if [ "$1" == "" ]; then
-  echo "Usage: ./select_windows_parallel.sh [lasif_dir] [iteration_name]"
+if [ "$2" == "" ] || [ -z "$MANIFEST" ]; then
+  echo "Usage: ./finalize_sources_parallel.sh [lasif_dir] [iteration_name]"
+  echo "Submit through oval_office.py, which writes the task manifest (\$MANIFEST)."
   exit
 fi
 
 lasifDir=$1
 iterationName=$2
 
-cd $lasifDir
-shopt -s nullglob
-array=($lasifDir/EVENTS/*)
+# The events of this array task (one, or several packed together), and their
+# paths, are on its line of the task manifest written by oval_office.py.
+source $SLURM_SUBMIT_DIR/../components/manifest.sh
+stageEvent=$SLURM_SUBMIT_DIR/../components/stage_event.py
 
-myEvent=${array[$SLURM_ARRAY_TASK_ID]}
-myEvent=${myEvent%.xml}
-myEvent=${myEvent##*/}
+for entry in $(manifest_line $MANIFEST $SLURM_ARRAY_TASK_ID); do
+  IFS='|' read myEvent dataDir syntheticDir <<< "$entry"
 
-cd ./DATA/$myEvent/preprocessed_hp_0.00833_lp_0.01667_npts_153069_dt_0.142500/
-tar -xvf preprocessedData.tar
-rm -f preprocessedData.tar
+  echo "EVENT: $myEvent"
+  echo "ITERATION: $iterationName"
 
-cd ../../../SYNTHETICS/$myEvent/ITERATION_$iterationName
-tar -xvf synthetics.tar
-rm -f synthetics.tar
-
-aprun -B lasif finalize_adjoint_sources $iterationName $myEvent
-
-tar -cvf synthetics.tar *.mseed
-rm -f *.mseed
-
-cd ../../../DATA/$myEvent/preprocessed_hp_0.00833_lp_0.01667_npts_153069_dt_0.142500/
-tar -cvf preprocessedData.tar *.mseed
-rm -f *.mseed
+  # The data and synthetics are extracted to node-local storage
+  # ($STAGE_ROOT), and only changed members go back into their archives.
+  aprun -B $stageEvent --lasif_path $lasifDir --stage $dataDir $syntheticDir \
+    -- lasif finalize_adjoint_sources $iterationName $myEvent
+done
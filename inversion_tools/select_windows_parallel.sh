@@ -12,22 +12,37 @@
 
 export MV2_ENABLE_AFFINITY=0
 export KMP_AFFINITY=compact
-export OMP_NUM_THREADS=8
+export OMP_NUM_THREADS=${SLURM_CPUS_PER_TASK:-8}
 
-if [ "$1" == "" ]; then
+if [ "$1" == "" ] || [ -z "$MANIFEST" ]; then
   echo "Usage: ./select_windows_parallel.sh [lasif_dir] [iteration_name]"
+  echo "Submit through oval_office.py, which writes the task manifest (\$MANIFEST)."
   exit
 fi
 
 lasifDir=$1
 iterationName=$2
 
-cd $lasifDir
-shopt -s nullglob
-array=($lasifDir/EVENTS/*)
+# The events of this array task (one, or several packed together), and their
+# paths, are on its line of the task manifest written by oval_office.py.
+source $SLURM_SUBMIT_DIR/../components/manifest.sh
+stageEvent=$SLURM_SUBMIT_DIR/../components/stage_event.py
 
-myEvent=${array[$SLURM_ARRAY_TASK_ID]}
-myEvent=${myEvent%.xml}
-myEvent=${myEvent##*/}
+for entry in $(manifest_line $MANIFEST $SLURM_ARRAY_TASK_ID); do
+  IFS='|' read myEvent windowsDir dataDir syntheticDir <<< "$entry"
 
-aprun -B lasif select_windows $iterationName $myEvent --read_only_caches
+  echo "EVENT: $myEvent"
+  echo "ITERATION: $iterationName"
+
+  # The data and synthetics are extracted to node-local storage
+  # ($STAGE_ROOT); the windows are written to the project. The stage has its
+  # own copy of the caches, so they need not be read only.
+  aprun -B $stageEvent --lasif_path $lasifDir --stage $dataDir $syntheticDir \
+    -- lasif select_windows $iterationName $myEvent
+
+  # Record the windows in the catalogue.
+  if [ -n "$CATALOGUE" ]; then
+    $SLURM_SUBMIT_DIR/../components/update_catalogue.py --iteration $iterationName \
+      --event $myEvent --stage windows $windowsDir
+  fi
+done
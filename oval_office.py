@@ -7,11 +7,18 @@ import shutil
 import subprocess
 import argparse
 import datetime
-import numpy as np
 
+# Only light modules are imported here. Modules which pull in numpy, scipy or
+# obspy are imported inside the commands that need them, so commands which
+# just call sbatch or rsync start quickly (see benchmark_startup.py).
 import xml.etree.ElementTree as ET
-import components.classes.seismogram as seismogram
-import components.classes.cmt_solution as cmt_solution
+import components.classes.iteration as iteration
+import components.classes.catalogue as catalogue_db
+import components.classes.manifest as manifest
+import components.classes.build_cache as build_cache
+import components.classes.slurm as slurm
+import components.classes.waveform_archive as waveform_archive
+import components.classes.executor as executors
 
 class ParameterError(Exception):
     pass
@@ -74,19 +81,31 @@ def read_parameter_file(filename):
     parameters['scratch_path'] = os.path.abspath(parameters['scratch_path'])
     parameters['specfem_root'] = os.path.abspath(parameters['specfem_root'])
     parameters['lasif_path'] = os.path.abspath(parameters['lasif_path'])
+    for path in ['catalogue_path', 'build_cache_path']:
+        if path in parameters:
+            parameters[path] = os.path.abspath(parameters[path])
+
+    # Catch this before any job is submitted: the stages only write floats
+    # (steim2 is for measure_storage.py, see waveform_storage.py). Unset, it
+    # is left to the stages' own DEFAULT_PRECISION.
+    if 'storage_precision' in parameters and \
+            parameters['storage_precision'] not in ['float32', 'float64']:
+        raise ParameterError('storage_precision must be float32 or float64.')
 
     return parameters
 
 
-def get_iteration_xml_path():
+def get_iteration_xml_path(iteration_name=None):
     """
     A little function to grab the iteration xml path from the lasif directory.
+
+    :iteration_name: Iteration (default: the current one).
     """
     
     # Find iteration xml file.
     iteration_xml_path = os.path.join(p['lasif_path'],
                                       'ITERATIONS/ITERATION_%s.xml'
-                                      % (p['iteration_name']))
+                                      % (iteration_name or p['iteration_name']))
 
     if not os.path.exists(iteration_xml_path):
         raise PathError('Your iteration xml file does not exist in the '
@@ -203,6 +222,71 @@ def mkdir_p(path):
             raise
 
 
+def find_lasif_outputs(stage, event_list):
+    """
+    Looks up the LASIF OUTPUT directories of a stage ('lasif_output' or
+    'adjoint_sources') of the current iteration for each event in the
+    catalogue. The OUTPUT directory is walked again if the catalogue is
+    missing one of the events, or if OUTPUT has changed since it was last
+    walked (LASIF has written new directories). Returns a dictionary of
+    event -> list of directories.
+
+    :stage: Catalogue stage name.
+    :event_list: List of event names.
+    """
+
+    def lookup():
+        found = {}
+        for row in catalogue.outputs(p['iteration_name'], stage=stage):
+            if not os.path.isdir(row['path']) or catalogue_db.output_stage(
+                    os.path.basename(row['path']),
+                    p['iteration_name']) != stage:
+                catalogue.forget(row['path'])
+                continue
+            found.setdefault(row['event'], []).append(row['path'])
+        return found
+
+    output_path = os.path.join(p['lasif_path'], 'OUTPUT')
+    found = lookup()
+    if [event for event in event_list if event not in found] or \
+            catalogue.scanned(output_path) != os.path.getmtime(output_path):
+        catalogue_db.scan_lasif_output(catalogue, p['lasif_path'],
+                                       p['iteration_name'], event_list)
+        found = lookup()
+
+    return found
+
+
+def compile_specfem(mode):
+    """
+    Compiles specfem in the current directory (the specfem root) with
+    mk_daint.sh, unless the build cache already has a build for this compiler
+    suite, mode, Par_file and source tree, in which case that build is copied
+    back. Builds are cached in build_cache_path (default: build_cache in the
+    scratch directory). --rebuild compiles regardless.
+
+    :mode: Simulation mode passed to mk_daint.sh (forward or adjoint).
+    """
+
+    cache = build_cache.BuildCache(p.get('build_cache_path', os.path.join(
+        p['scratch_path'], 'build_cache')))
+    key = cache.key('.', p['compiler_suite'], mode)
+    if cache.contains(key) and not args.rebuild:
+        print_ylw('Reusing cached build %s...' % (key[:12]))
+        cache.restore(key, '.', mode)
+        return
+
+    print_ylw('Compiling...')
+    with open('compilation_log.txt', 'w') as output:
+        proc = subprocess.Popen(['./mk_daint.sh', p['compiler_suite'],
+                                mode], stdout=output, stderr=output)
+        proc.communicate()
+        proc.wait()
+
+    if not cache.store(key, '.', mode):
+        print_ylw('Compilation failed, see compilation_log.txt.')
+
+
 def setup_run():
     """
     Function does a whole bunch of things to set up a specfem run on daint.
@@ -224,24 +308,22 @@ def setup_run():
 
     # Copy over input files.
     print_ylw('Copying initial files...')
-    lasif_output = os.path.join(p['lasif_path'], 'OUTPUT')
-    for dir in os.listdir(lasif_output):
-        for event in event_list:
-            if p['iteration_name'] in dir and event in dir:
+    catalogue.add_events(p['iteration_name'], event_list)
+    input_dirs = find_lasif_outputs('lasif_output', event_list)
+    for event in event_list:
+        for event_output_dir in input_dirs.get(event, []):
+            for file in os.listdir(event_output_dir):
+
+                source = os.path.join(event_output_dir, file)
+                dest = os.path.join(solver_base_path, event, 'DATA')
+                safe_copy(source, dest)
 
-                event_output_dir = os.path.join(lasif_output, dir)
-                for file in os.listdir(event_output_dir):
+                if event == event_list[0]:
 
                     source = os.path.join(event_output_dir, file)
-                    dest = os.path.join(solver_base_path, event, 'DATA')
+                    dest = os.path.join(solver_base_path, 'mesh', 'DATA')
                     safe_copy(source, dest)
 
-                    if event == event_list[0]:
-
-                        source = os.path.join(event_output_dir, file)
-                        dest = os.path.join(solver_base_path, 'mesh', 'DATA')
-                        safe_copy(source, dest)
-
     # Copy one instance of forward files to specfem base directory.
     if not os.path.isdir(os.path.join(p['lasif_path'], 'SUBMISSION', 
                                        p['iteration_name'])):
@@ -254,13 +336,8 @@ def setup_run():
     safe_copy(source, dest)
 
     # # Change to specfem root directory and compile.
-    print_ylw('Compiling...')
     os.chdir(p['specfem_root'])
-    with open('compilation_log.txt', 'w') as output:
-        proc = subprocess.Popen(['./mk_daint.sh', p['compiler_suite'],
-                                'adjoint'], stdout=output, stderr=output)
-        proc.communicate()
-        proc.wait()
+    compile_specfem('adjoint')
 
     # Copy binaries to all directories.
     print_ylw('Copying compiled binaries...')
@@ -345,7 +422,232 @@ def submit_mesher():
 
     mesh_dir = os.path.join(solver_base_path, 'mesh')
     os.chdir(mesh_dir)
-    subprocess.Popen(['sbatch', 'job_mesher_daint.sbatch']).wait()
+    executor.submit('job_mesher_daint.sbatch')
+
+
+def array_events(stage):
+    """
+    Returns the event names in the order of the stage's array indices. The
+    solver script (written by LASIF) globs the iteration directory, so its
+    indices follow the sorted directory listing, 'mesh' included. Every other
+    stage reads its events from a task manifest, and is indexed by the order
+    of the events in the iteration definition.
+
+    :stage: Stage name.
+    """
+
+    if stage == 'solver':
+        return sorted(os.listdir(solver_base_path))
+
+    return find_event_names(get_iteration_xml_path())
+
+
+def count_traces(event_list):
+    """
+    Number of traces (three per station) of each event, from the STATIONS
+    files in the solver directories.
+    """
+
+    counts = {}
+    for event in event_list:
+        stations = os.path.join(solver_base_path, event, 'DATA', 'STATIONS')
+        if os.path.exists(stations):
+            with open(stations, 'r') as file:
+                counts[event] = 3 * len([line for line in file if line.split()])
+
+    return counts
+
+
+def incomplete_events(stage, indexed_events):
+    """
+    Checks the expected output of a stage for each event, and returns the
+    (array index, event) tuples of the events which don't have it.
+
+    solver: seismograms in OUTPUT_FILES (one per trace in STATIONS).
+    process_synthetics: SYNTHETICS/<event>/ITERATION_<name>/data.tar (any
+    compression).
+    resynthesize: the same, in ITERATION_<name>_<resynthesis_tag>.
+    preprocess_data: the preprocessed data.tar (any compression).
+    select_windows: window files for the iteration.
+    finalize_sources: adjoint sources in the LASIF OUTPUT directory.
+
+    :stage: Stage name.
+    :indexed_events: List of (array index, event) tuples.
+    """
+
+    lasif_dirname = os.path.basename(p['lasif_path'])
+    lasif_scratch_dir = os.path.join(p['scratch_path'], lasif_dirname)
+
+    def non_empty(path):
+        return os.path.exists(path) and os.path.getsize(path) > 0
+
+    def archived(directory):
+        archive = waveform_archive.find_archive(directory)
+        return archive is not None and non_empty(archive)
+
+    if stage == 'solver':
+        databases_mpi = os.path.join(solver_base_path, 'mesh', 'DATABASES_MPI')
+        if not os.path.isdir(databases_mpi) or not os.listdir(databases_mpi):
+            raise MesherNotRunError("There are no mesh files in the mesh "
+                                    "directory. Run the mesher first.")
+        traces = count_traces([event for _, event in indexed_events])
+
+        def complete(event):
+            output_files = os.path.join(solver_base_path, event,
+                                        'OUTPUT_FILES')
+            if not os.path.isdir(output_files):
+                return False
+            seismograms = len([file for file in os.listdir(output_files)
+                               if file.endswith('.ascii')])
+            return seismograms > 0 and seismograms >= traces.get(event, 0)
+
+    elif stage == 'process_synthetics':
+        def complete(event):
+            return archived(synthetics_dir(event))
+
+    elif stage == 'resynthesize':
+        def complete(event):
+            return archived(synthetics_dir(
+                event, p.get('resynthesis_tag', 'resynthesis')))
+
+    elif stage == 'preprocess_data':
+        tag = iteration.Iteration(p['lasif_path'],
+                                  p['iteration_name']).preprocessing_tag
+
+        def complete(event):
+            return archived(os.path.join(p['lasif_path'], 'DATA', event,
+                                         tag))
+
+    elif stage == 'select_windows':
+        def complete(event):
+            windows = os.path.join(
+                lasif_scratch_dir, 'ADJOINT_SOURCES_AND_WINDOWS', 'WINDOWS',
+                'ITERATION_%s' % (p['iteration_name']), event)
+            return os.path.isdir(windows) and bool(os.listdir(windows))
+
+    elif stage == 'finalize_sources':
+        output_dir = os.path.join(lasif_scratch_dir, 'OUTPUT')
+        events = [event for _, event in indexed_events]
+        finished = set()
+        for dir in os.listdir(output_dir):
+            event = catalogue_db.match_event(dir, events)
+            if event and catalogue_db.output_stage(
+                    dir, p['iteration_name']) == 'adjoint_sources' and [
+                    file for file in os.listdir(os.path.join(output_dir, dir))
+                    if file.endswith('.adj')]:
+                finished.add(event)
+
+        def complete(event):
+            return event in finished
+
+    else:
+        raise ParameterError('Cannot resume stage ' + stage)
+
+    return [(index, event) for index, event in indexed_events
+            if not complete(event)]
+
+
+def submit_array(stage, script, script_args, first_job, last_job,
+                 fields=None, entry=None):
+    """
+    Submits an array script from the current directory, for the events with
+    array indices first_job to last_job (see array_events). Unless the stage
+    is the solver, a task manifest is written to logs/ first: line i holds the
+    event(s) of array task i, and the paths the script needs for them
+    (manifest.py). The script is told where it is through $MANIFEST, and each
+    task seeks straight to its own line, instead of globbing the event
+    directories.
+
+    With --auto_array, the events are planned from the recorded runtimes of
+    earlier iterations instead: each class of similar events gets its own
+    submission (and manifest) with a fitted walltime and core count, and
+    short events are packed together into one array task. A stage with no
+    recorded runtimes (see collect_telemetry) is submitted as without it.
+
+    With --resume, only the events in the range whose outputs are missing
+    are submitted.
+
+    :stage: Stage name (as recorded by the telemetry).
+    :script: Array script to submit.
+    :script_args: List of arguments to the script.
+    :first_job: First array index (optional with --auto_array/--resume).
+    :last_job: Last array index (optional with --auto_array/--resume).
+    :fields: Names of the fields of a manifest entry. None submits the
+    indices themselves, without a manifest.
+    :entry: Function returning the manifest entry (a tuple of strings) of an
+    event.
+    """
+
+    events = array_events(stage)
+    first = int(first_job) if first_job is not None else 0
+    last = int(last_job) if last_job is not None else len(events) - 1
+    indexed_events = [(index, event) for index, event in enumerate(events)
+                      if first <= index <= last and event != 'mesh']
+
+    if args.resume:
+        indexed_events = incomplete_events(stage, indexed_events)
+        if not indexed_events:
+            print_blu('All events of %s are complete.' % (stage))
+            return
+        print_ylw('Resubmitting %d incomplete events: %s' % (
+            len(indexed_events), ', '.join([event for _, event in
+                                            indexed_events])))
+    elif not indexed_events:
+        print_ylw('No events to submit for %s.' % (stage))
+        return
+
+    if args.auto_array:
+        import components.classes.array_planner as array_planner
+        import components.classes.telemetry as telemetry
+        history = catalogue.tasks(stage=telemetry.LOG_STAGES.get(stage,
+                                                                 stage))
+        if not [task for task in history if task['event']]:
+            print_ylw('Warning: no runtimes recorded for %s (see '
+                      '--collect_telemetry), so every event gets the '
+                      'default walltime and cores.' % (stage))
+        planner = array_planner.ArrayPlanner(
+            history, count_traces([event for _, event in indexed_events]),
+            packable=fields is not None)
+        submissions = planner.plan(indexed_events)
+    else:
+        submissions = [{'time': None, 'cpus': None,
+                        'tasks': [[index] for index, _ in indexed_events]}]
+
+    event_names = dict(indexed_events)
+    mkdir_p('logs')
+    stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    for number, submission in enumerate(submissions):
+        # Named after the stage, so the telemetry can tell the stages apart
+        # (the solver and resynthesis scripts don't name their logs by stage).
+        options = ['--job-name=%s' % (stage),
+                   '--output=./logs/%s.%%A.%%a.o' % (stage),
+                   '--error=./logs/%s.%%A.%%a.e' % (stage)]
+        walltime = 'default'
+        if submission['time'] is not None:
+            walltime = slurm.format_walltime(submission['time'])
+            options.append('--time=%s' % (walltime))
+
+        if fields is not None:
+            manifest_path = os.path.abspath(os.path.join(
+                'logs', '%s.manifest.%s.%d' % (stage, stamp, number)))
+            manifest.write_manifest(
+                manifest_path, fields,
+                [[entry(event_names[index]) for index in task]
+                 for task in submission['tasks']])
+            options += ['--array=0-%d' % (len(submission['tasks']) - 1),
+                        '--export=ALL,MANIFEST=%s' % (manifest_path)]
+            if submission['cpus'] is not None:
+                options.append('--cpus-per-task=%d' % (submission['cpus']))
+        else:
+            options.append('--array=%s' % slurm.array_spec(
+                [task[0] for task in submission['tasks']]))
+
+        print_ylw('Submitting %d tasks (%d events) with %s cores and %s '
+                  'walltime' % (len(submission['tasks']),
+                                sum([len(task) for task in
+                                     submission['tasks']]),
+                                submission['cpus'] or 'default', walltime))
+        executor.submit(script, script_args, options)
 
 
 def submit_solver(first_job, last_job):
@@ -363,9 +665,8 @@ def submit_solver(first_job, last_job):
                    + '\n')
 
     os.chdir(solver_root_path)
-    subprocess.Popen(['sbatch', '--array=%s-%s' % (first_job, last_job),
-                     'jobArray_solver_daint.sbatch',
-                      p['iteration_name']]).wait()
+    submit_array('solver', 'jobArray_solver_daint.sbatch',
+                 [p['iteration_name']], first_job, last_job)
 
 def sync_LASIF_to_scratch():
     """
@@ -405,37 +706,51 @@ def process_data(first_job, last_job):
 
     lasif_dirname = os.path.basename(p['lasif_path'])
     lasif_scratch_dir = os.path.join(p['scratch_path'], lasif_dirname)
-    subprocess.Popen(['sbatch', '--array=%s-%s' % (first_job, last_job),
-                      'preprocess_data_parallel.sh', lasif_scratch_dir,
-                      p['lasif_path'], p['iteration_name']]).wait()
+
+    def entry(event):
+        return event, os.path.join(lasif_scratch_dir, 'DATA', event)
+
+    submit_array('preprocess_data', 'preprocess_data_parallel.sh',
+                 [lasif_scratch_dir, p['lasif_path'], p['iteration_name']],
+                 first_job, last_job, ['event', 'data_dir'], entry)
                       
 def distribute_adjoint_sources():
-    
-    lasif_output_dir = os.path.join(p['lasif_path'], 'OUTPUT')
+    """
+    Puts the adjoint sources of each event from the LASIF OUTPUT directory
+    into the event's SEM directory, and writes the matching STATIONS_ADJOINT.
+    Components which are all zero, or missing, are hardlinks to one shared
+    zero trace (kept in adjoint_zeros next to the iteration directories); the
+    others are hardlinked, or copied copy_threads at a time (default 8) when
+    OUTPUT is on another filesystem.
+    """
+
+    import components.classes.adjoint_sources as adjoint_sources
+    from multiprocessing.pool import ThreadPool
+
+    event_list = catalogue.events(p['iteration_name'])
+    if not event_list:
+        event_list = [dir for dir in os.listdir(solver_base_path)
+                      if dir != 'mesh']
+    adjoint_dirs = find_lasif_outputs('adjoint_sources', event_list)
+    zeros = adjoint_sources.ZeroStore(os.path.join(
+        solver_root_path, 'adjoint_zeros', p['iteration_name']))
+    pool = ThreadPool(int(p.get('copy_threads', 8)))
+
     os.chdir(os.path.join(solver_base_path))
-    for dir in os.listdir('./'):
+    for dir in event_list:
         print "Distributing... to " + dir
-        adjoint_names = []
         mkdir_p(os.path.join(dir, 'SEM'))
         
         adj_src_write_path = os.path.join(dir, 'SEM')
 
-        for output_dir in os.listdir(lasif_output_dir):
-            if dir in output_dir:
-                for adjoint in os.listdir(os.path.join(lasif_output_dir, 
-                                                       output_dir)):
-                    adj_src = os.path.join(lasif_output_dir, output_dir, 
-                                           adjoint)
-                                           
-                    if not adjoint.endswith('.adj'):
-                        continue
-                    
-                    safe_copy(adj_src, adj_src_write_path)                
-                                               
-                    stat_name = os.path.basename(adj_src).split('.')[0]
-                    if os.path.basename(stat_name) not in adjoint_names:
-                        adjoint_names.append(stat_name)
-                
+        sources = [os.path.join(output_dir, adjoint)
+                   for output_dir in adjoint_dirs.get(dir, [])
+                   for adjoint in sorted(os.listdir(output_dir))
+                   if adjoint.endswith(adjoint_sources.ADJOINT_SUFFIX)]
+        adjoint_names, n_real, n_zero = adjoint_sources.distribute(
+            sources, adj_src_write_path, zeros, pool)
+        print "%d adjoint sources, %d zero components" % (n_real, n_zero)
+
         print "writing station file"
         stations_file = os.path.join(dir, 'DATA', 'STATIONS')    
         adjoint_stat_file = os.path.join(dir, 'DATA', 'STATIONS_ADJOINT')
@@ -445,6 +760,13 @@ def distribute_adjoint_sources():
                 for adjoint_station_name in adjoint_names:
                     if adjoint_station_name in line:
                         write_stations.write(line)
+        write_stations.close()
+
+        catalogue.record(p['iteration_name'], dir, 'sem',
+                         adj_src_write_path)
+
+    pool.close()
+    pool.join()
 
 
 def destroy_all_but_raw():
@@ -510,33 +832,26 @@ def unpack_mseed():
         raise ParameterError("Need to specify event name with this option.")
         
     print "Unpacking data for " + args.event_name
-    
-    os.chdir(os.path.join(p['lasif_path'], 'DATA'))
-    for dir in os.listdir('./'):
-        if args.event_name in dir:
-            os.chdir(dir)
-            for dir2 in os.listdir('./'):
-                if os.path.isdir(dir2):
-                    os.chdir(dir2)
-                    if 'data.tar' in os.listdir('./'):
-                        subprocess.Popen(['tar', '-xvf', 'data.tar']).wait()
-                        os.remove('data.tar')
-                    os.chdir('../')
 
-            os.chdir('../')
-            
-    os.chdir(os.path.join(p['lasif_path'], 'SYNTHETICS'))
-    for dir in os.listdir('./'):
-        if args.event_name in dir:
-            os.chdir(dir)
-            for dir2 in os.listdir('./'):
-                if os.path.isdir(dir2):
-                    os.chdir(dir2)
-                    subprocess.Popen(['tar', '-xvf', 'data.tar']).wait()
-                    os.remove('data.tar')
-                    os.chdir('../')
+    def archives():
+        return [row['path'] for row in catalogue.outputs(
+            event=args.event_name) if row['stage'] in
+            ['raw', 'preprocessed', 'synthetics'] and
+            waveform_archive.is_archive(row['path']) and
+            os.path.basename(row['path']).startswith('data.')]
 
-            os.chdir('../')
+    if not archives():
+        catalogue_db.scan_archives(catalogue, p['lasif_path'],
+                                   args.event_name)
+
+    for archive in archives():
+        if not os.path.exists(archive):
+            catalogue.forget(archive)
+            continue
+        os.chdir(os.path.dirname(archive))
+        subprocess.Popen(waveform_archive.extract_command(archive)).wait()
+        os.remove(archive)
+        catalogue.forget(archive)
                       
 def clean_mseed():
     """
@@ -562,6 +877,12 @@ def clean_mseed():
                         for mseed in os.listdir('./'):
                             if 'mseed' in mseed:
                                 os.remove(mseed)
+
+                        archive = os.path.abspath(tar_file_name)
+                        owner = catalogue_db.classify_archive(archive)
+                        if owner:
+                            catalogue.record(owner[0], owner[1], owner[2],
+                                             archive)
                     
                     os.chdir('../')
         
@@ -584,6 +905,208 @@ def clean_mseed():
     
     os.chdir(current_dir)
     
+def update_catalogue():
+    """
+    Walks the LASIF project and the solver directories once, and records
+    everything it finds in the catalogue. Only needed to fill the catalogue
+    the first time, or after things have been moved around by hand.
+    """
+
+    event_list = find_event_names(get_iteration_xml_path())
+    catalogue.add_events(p['iteration_name'], event_list)
+
+    print_ylw('Scanning LASIF archives...')
+    catalogue_db.scan_archives(catalogue, p['lasif_path'])
+
+    print_ylw('Scanning LASIF OUTPUT...')
+    catalogue_db.scan_lasif_output(catalogue, p['lasif_path'],
+                                   p['iteration_name'], event_list)
+
+    print_ylw('Scanning solver directories...')
+    databases_mpi = os.path.join(solver_base_path, 'mesh', 'DATABASES_MPI')
+    if os.path.isdir(databases_mpi) and os.listdir(databases_mpi):
+        catalogue.record(p['iteration_name'], 'mesh', 'mesh', databases_mpi)
+
+    for event in event_list:
+        output_files = os.path.join(solver_base_path, event, 'OUTPUT_FILES')
+        if not os.path.isdir(output_files):
+            continue
+        if [file for file in os.listdir(output_files)
+                if file.endswith('.ascii')]:
+            catalogue.record(p['iteration_name'], event, 'solver',
+                             output_files)
+
+    print_blu('Done.')
+
+
+def print_status():
+    """
+    Prints which stages have produced output for each event of the current
+    iteration, straight from the catalogue.
+    """
+
+    stages = ['raw', 'lasif_output', 'solver', 'synthetics', 'preprocessed',
+              'windows', 'adjoint_sources', 'sem']
+    summary = catalogue.status(p['iteration_name'])
+    event_list = catalogue.events(p['iteration_name'])
+    event_list += sorted([event for event in summary
+                          if event not in event_list])
+
+    print_ylw('Status of iteration %s' % (p['iteration_name']))
+    print '%-70s' % ('event') + ' '.join(['%-15s' % (stage)
+                                          for stage in stages])
+    totals = dict((stage, 0) for stage in stages)
+    for event in event_list:
+        line = '%-70s' % (event)
+        for stage in stages:
+            if stage in summary[event]:
+                totals[stage] += 1
+                line += '%-16s' % ('%d (%.1f MB)' % (
+                    summary[event][stage][0],
+                    (summary[event][stage][1] or 0) / 1.0e6))
+            else:
+                line += '%-16s' % ('-')
+        print line
+
+    print_blu('%-70s' % ('events done') + ' '.join(
+        ['%-15s' % ('%d/%d' % (totals[stage], len(event_list)))
+         for stage in stages]))
+
+
+def load_source_catalogue():
+    """
+    Returns the source parameters of every event of the current iteration as
+    a structured array (see cmt_solution.load_sources), parsed from the
+    CMTSOLUTIONs in the solver directories. The array is cached next to the
+    iteration directory, and only rebuilt when a CMTSOLUTION changes.
+    """
+
+    import components.classes.cmt_solution as cmt_solution
+
+    cmt_files = {}
+    for event in find_event_names(get_iteration_xml_path()):
+        path = os.path.join(solver_base_path, event, 'DATA', 'CMTSOLUTION')
+        if os.path.exists(path):
+            cmt_files[event] = path
+
+    return cmt_solution.load_sources(cmt_files, source_catalogue_path())
+
+
+def source_catalogue_path():
+    return os.path.join(solver_root_path,
+                        'sources.%s.npz' % (p['iteration_name']))
+
+
+def print_sources():
+    """
+    Prints the source parameters of the events of the current iteration.
+    """
+
+    sources = load_source_catalogue()
+    print_ylw('Sources of iteration %s' % (p['iteration_name']))
+    print '%-70s %-26s %9s %9s %8s %5s %8s' % (
+        'event', 'origin time', 'latitude', 'longitude', 'depth', 'Mw',
+        'hdur')
+    for source in sources:
+        print '%-70s %-26s %9.3f %9.3f %8.1f %5.2f %8.2f' % (
+            source['event'], datetime.datetime.utcfromtimestamp(
+                source['origin_time']).isoformat(), source['latitude'],
+            source['longitude'], source['depth'], source['magnitude'],
+            source['half_duration'])
+    print_blu('%d sources, cached in %s' % (len(sources),
+                                            source_catalogue_path()))
+
+
+def inventory_path():
+    return os.path.join(solver_root_path, 'inventory.npz')
+
+
+def print_inventory():
+    """
+    Prints the waveform inventory of the LASIF project: for each event, the
+    stations and channels in its raw, preprocessed and synthetics (current
+    iteration) archives, read from the MiniSEED headers. The inventory is
+    cached, and only archives which changed are scanned again.
+    """
+
+    import components.classes.waveform_inventory as waveform_inventory
+
+    print_ylw('Scanning waveform archives...')
+    inventory = waveform_inventory.build_inventory(
+        p['lasif_path'], inventory_path(),
+        int(p['local_processes']) if 'local_processes' in p else None)
+    if args.event_name:
+        inventory = inventory[inventory['event'] == args.event_name]
+
+    stages = ['raw', 'preprocessed', 'synthetics']
+    matrices = {}
+    for stage in stages:
+        events, stations, channels, matrix = waveform_inventory.availability(
+            inventory, stage, p['iteration_name'])
+        matrices[stage] = dict(zip(events, matrix))
+
+    event_list = sorted(set().union(*[matrices[stage] for stage in stages]))
+    print_ylw('Waveform inventory (stations/channels)')
+    print '%-70s' % ('event') + ' '.join(['%-15s' % (stage)
+                                          for stage in stages])
+    for event in event_list:
+        line = '%-70s' % (event)
+        for stage in stages:
+            if event in matrices[stage]:
+                available = matrices[stage][event]
+                line += '%-16s' % ('%d/%d' % (available.any(axis=1).sum(),
+                                              available.sum()))
+            else:
+                line += '%-16s' % ('-')
+        print line
+
+    print_blu('%d channels in %d archives, cached in %s' % (
+        len(inventory), len(set(inventory['archive'])), inventory_path()))
+
+
+def collect_telemetry():
+    """
+    Reads the array task logs of every stage, joins them with their sacct
+    records, and stores the per-task queue wait, walltime, cpu time and
+    memory use in the catalogue.
+    """
+
+    import components.classes.telemetry as telemetry
+
+    control_room = os.path.dirname(os.path.abspath(__file__))
+    log_dirs = [os.path.join(control_room, stage_dir, 'logs') for stage_dir in
+                ['data_processing', 'synthetic_processing', 'inversion_tools']]
+    log_dirs.append(os.path.join(solver_root_path, 'logs'))
+
+    print_ylw('Collecting telemetry...')
+    records = telemetry.collect(log_dirs, sacct_file=args.sacct_file,
+                                default_iteration=p['iteration_name'])
+
+    # The solver doesn't print its event, but its array index is the event's
+    # position in the iteration directory.
+    solver_events = array_events('solver')
+    for record in records:
+        if record['stage'] == 'solver' and record['event'] is None and \
+                record['task_id'] < len(solver_events):
+            record['event'] = solver_events[record['task_id']]
+        catalogue.record_task(record)
+
+    print_blu('Recorded %d array tasks.' % (len(records)))
+
+
+def telemetry_report():
+    """
+    Prints a per-stage summary of the recorded array tasks of the current
+    iteration, and lists the stragglers.
+    """
+
+    import components.classes.telemetry as telemetry
+
+    print_ylw('Array task telemetry for iteration %s' % (p['iteration_name']))
+    for line in telemetry.report(catalogue.tasks(p['iteration_name'])):
+        print line
+
+
 def select_windows(first_job, last_job):
     """
     Selects windows in parallel.
@@ -598,10 +1121,23 @@ def select_windows(first_job, last_job):
     lasif_scratch_dir = os.path.join(p['scratch_path'], lasif_dirname)
         
     sync_LASIF_to_scratch()
-        
-    subprocess.Popen(['sbatch', '--array=%s-%s' % (first_job, last_job),
-                      'select_windows_parallel.sh', lasif_scratch_dir, 
-                      p['iteration_name']]).wait()
+    preprocessing_tag = iteration.Iteration(
+        p['lasif_path'], p['iteration_name']).preprocessing_tag
+
+    def entry(event):
+        return (event,
+                os.path.join(lasif_scratch_dir, 'ADJOINT_SOURCES_AND_WINDOWS',
+                             'WINDOWS', 'ITERATION_%s' % (p['iteration_name']),
+                             event),
+                os.path.join(lasif_scratch_dir, 'DATA', event,
+                             preprocessing_tag),
+                os.path.join(lasif_scratch_dir, 'SYNTHETICS', event,
+                             'ITERATION_%s' % (p['iteration_name'])))
+
+    submit_array('select_windows', 'select_windows_parallel.sh',
+                 [lasif_scratch_dir, p['iteration_name']], first_job,
+                 last_job, ['event', 'windows_dir', 'data_dir',
+                            'synthetic_dir'], entry)
                       
     os.chdir('../')
     with open('master_log.txt', 'a') as file:
@@ -611,32 +1147,122 @@ def select_windows(first_job, last_job):
 
     subprocess.Popen(['rsync', '-av', lasif_scratch_dir, lasif_path]).wait()
     
+def finalize_sources(first_job, last_job):
+    """
+    Finalizes adjoint sources in parallel. The preprocessed data directory of
+    each event is worked out from the iteration definition.
+
+    :first_job: The job array index of the first job to submit (i.e. 0)
+    :last_job: The job array index of the last job to submit (i.e. n_events-1)
+    """
+
+    try:
+        os.chdir('./inversion_tools')
+    except OSError:
+        raise WrongDirectoryError("You're not in the control room directory.")
+
+    lasif_dirname = os.path.basename(p['lasif_path'])
+    lasif_scratch_dir = os.path.join(p['scratch_path'], lasif_dirname)
+    preprocessing_tag = iteration.Iteration(
+        p['lasif_path'], p['iteration_name']).preprocessing_tag
+
+    def entry(event):
+        return (event,
+                os.path.join(lasif_scratch_dir, 'DATA', event,
+                             preprocessing_tag),
+                os.path.join(lasif_scratch_dir, 'SYNTHETICS', event,
+                             'ITERATION_%s' % (p['iteration_name'])))
+
+    submit_array('finalize_sources', 'finalize_sources_parallel.sh',
+                 [lasif_scratch_dir, p['iteration_name']], first_job,
+                 last_job, ['event', 'data_dir', 'synthetic_dir'], entry)
+
+    os.chdir('../')
+    with open('master_log.txt', 'a') as file:
+        file.write('Finalized sources for array jobs %s to %s on '
+                   % (first_job, last_job) + str(datetime.datetime.now())
+                   + '\n')
+
 def build_all_caches():
     """
-    Submits a job to build all the LASIF caches. Useful because this can take a
-    long time.
+    Submits a job array which rebuilds the LASIF caches of what changed since
+    the last build: the station caches if any station file changed, and the
+    waveform caches of each event whose data or synthetics changed. Changes
+    are found by comparing the signatures (file names, sizes and times) of
+    the inputs with those recorded when each entry was last built; --rebuild
+    builds everything. Each array task syncs only its own inputs to scratch,
+    and only the cache files it wrote back.
     """
-    
+
+    import components.classes.lasif_cache as lasif_cache
+
     # Determine if we can run the script.
     try:
         os.chdir('./components')
     except OSError:
         raise WrongDirectoryError("You're not in the control room directory.")
-        
-    # # Sync lasif to the scratch directory.
-    # sync_LASIF_to_scratch()
-    
+
     # Get lasif scratch directory name.
     lasif_dirname = os.path.basename(p['lasif_path'])
     lasif_scratch_dir = os.path.join(p['scratch_path'], lasif_dirname)
-    
-    # Submit job.
-    subprocess.Popen(['sbatch', 'build_lasif_caches.sbatch', 
-                      p['lasif_path'], lasif_scratch_dir]).wait()
-                      
-    # # Backwards mirror.
-    # sync_scratch_to_LASIF()
-                          
+
+    print_ylw('Checking the LASIF caches...')
+    store = lasif_cache.SignatureStore(os.path.join(solver_root_path,
+                                                    'lasif_caches'))
+    signatures = lasif_cache.signatures(p['lasif_path'])
+    changed = sorted(signatures) if args.rebuild \
+        else store.changed(signatures)
+    if not changed:
+        print_blu('The LASIF caches are up to date.')
+        return
+
+    # Everything but the waveforms and station files, which the tasks sync
+    # themselves, goes to scratch once.
+    mkdir_p(lasif_scratch_dir)
+    subprocess.Popen(['rsync', '-a'] + [
+        '--exclude=/%s' % (directory) for directory in
+        lasif_cache.EVENT_DIRS + [lasif_cache.STATION_DIR, 'OUTPUT']] +
+        [p['lasif_path'] + '/', lasif_scratch_dir + '/']).wait()
+
+    # The station caches are built first: the event array waits for them to
+    # succeed, and then runs all its tasks at once.
+    mkdir_p('logs')
+    stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    fields = ['kind', 'name', 'signature']
+    job_id = None
+    for number, kind in enumerate([lasif_cache.STATIONS, lasif_cache.EVENT]):
+        entries = [(kind, name, signatures[(kind, name)])
+                   for entry_kind, name in changed if entry_kind == kind]
+        if not entries:
+            continue
+
+        manifest_path = os.path.abspath(os.path.join(
+            'logs', 'cache.manifest.%s.%d' % (stamp, number)))
+        manifest.write_manifest(manifest_path, fields,
+                                [[entry] for entry in entries])
+        print_ylw('Rebuilding %d %s caches' % (len(entries), kind))
+        options = ['--array=0-%d' % (len(entries) - 1),
+                   '--export=ALL,MANIFEST=%s' % (manifest_path)]
+        if job_id:
+            options.append('--dependency=afterok:%s' % (job_id))
+        job_id = executor.submit('build_lasif_caches.sbatch',
+                                 [p['lasif_path'], lasif_scratch_dir,
+                                  store.path], options)
+
+
+def synthetics_dir(event, tag=None, iteration_name=None):
+    """
+    LASIF synthetics directory of an event for the current iteration (or
+    another one), or for a resynthesis of it (ITERATION_<name>_<tag>).
+    """
+
+    name = 'ITERATION_%s' % (iteration_name or p['iteration_name'])
+    if tag:
+        name += '_' + tag
+
+    return os.path.join(p['lasif_path'], 'SYNTHETICS', event, name)
+
+
 def process_synthetics(first_job, last_job):
     """
     Runs the parallel process_synthetics functionality in synthetic_processing.
@@ -645,108 +1271,268 @@ def process_synthetics(first_job, last_job):
     :last_job: The job array index of the last job to submit (i.e. n_events-1)
     """
 
+    submit_synthetics('process_synthetics', first_job, last_job)
+
+
+def resynthesize(first_job, last_job):
+    """
+    Reprocesses the stored solver output of the iteration with a different
+    source time function, without running the solver again. The source time
+    function the solver used is deconvolved, and replaced by a gaussian of the
+    resynthesis_half_duration parameter (a number, 'cmt' for the CMTSOLUTION
+    half durations, or a file of per-event half durations), or by the
+    arbitrary source time function in the resynthesis_stf file. The
+    synthetics go to ITERATION_<name>_<resynthesis_tag> (default
+    'resynthesis'), next to those of the iteration.
+
+    :first_job: The job array index of the first job to submit (i.e. 0)
+    :last_job: The job array index of the last job to submit (i.e. n_events-1)
+    """
+
+    options = ['--deconvolve_stf']
+    for parameter, option in [('resynthesis_half_duration',
+                               '--half_duration'),
+                              ('resynthesis_stf', '--stf')]:
+        if parameter in p:
+            value = p[parameter]
+            if os.path.exists(value):
+                value = os.path.abspath(value)
+            options += [option, value]
+
+    submit_synthetics('resynthesize', first_job, last_job,
+                      p.get('resynthesis_tag', 'resynthesis'), options)
+
+
+def band_iterations():
+    """
+    The iterations whose synthetics are processed together: the current one,
+    and those in the optional extra_band_iterations parameter (a comma
+    separated list of LASIF iterations for other period bands, which share
+    the solver output of this one).
+    """
+
+    extra = p.get('extra_band_iterations', '')
+    return [p['iteration_name']] + [name for name in extra.split(',') if name]
+
+
+def submit_synthetics(stage, first_job, last_job, tag=None, options=None):
+    """
+    Submits the synthetics processing array. The period bands of all the
+    band_iterations are processed in the same pass, and each is written to
+    the synthetics directory of its own iteration.
+
+    :stage: Stage name.
+    :tag: Tag of the LASIF synthetics directories (see synthetics_dir).
+    :options: Extra options for process_synthetics.py.
+    """
+
     try:
         os.chdir('./synthetic_processing')
     except OSError:
         raise WrongDirectoryError("You're not in the control room directory.")
 
-    highpass_period, lowpass_period = find_bandpass_parameters(
-                                        get_iteration_xml_path())
+    iterations = band_iterations()
+    periods = [find_bandpass_parameters(get_iteration_xml_path(name))
+               for name in iterations]
+    highpass_periods = ','.join([str(highpass) for highpass, _ in periods])
+    lowpass_periods = ','.join([str(lowpass) for _, lowpass in periods])
+
+    # Parse all sources once, so the tasks can read them from the cache.
+    load_source_catalogue()
                                                 
-    subprocess.Popen(['sbatch', '--array=%s-%s' % (first_job, last_job),
-                      'process_synthetics_parallel.sh', solver_base_path,
-                      p['lasif_path'], str(lowpass_period), 
-                      str(highpass_period)]).wait()
+    def entry(event):
+        event_dir = os.path.join(solver_base_path, event)
+        return (event, os.path.join(event_dir, 'OUTPUT_FILES'),
+                os.path.join(event_dir, 'DATA', 'CMTSOLUTION'),
+                ','.join([synthetics_dir(event, tag, name)
+                          for name in iterations]))
+
+    submit_array(stage, 'process_synthetics_parallel.sh',
+                 [solver_base_path, p['lasif_path'], lowpass_periods,
+                  highpass_periods] + (options or []), first_job, last_job,
+                 ['event', 'seismo_dir', 'cmt_file', 'synthetic_dir'], entry)
                                         
     os.chdir('../')
     with open('master_log.txt', 'a') as file:
-        file.write("Ran convolution with stf for array jobs %s to %s on "
-                   % (first_job, last_job) + str(datetime.datetime.now())
-                   + '\n')
+        file.write("Ran %s for array jobs %s to %s on "
+                   % (stage, first_job, last_job) +
+                   str(datetime.datetime.now()) + '\n')
+
+
+class LazyCatalogue(object):
+
+    def __init__(self, path):
+        """
+        Stands in for the Catalogue, and only opens the database the first
+        time it is used, so commands which don't need it don't wait for it.
+        On opening, it takes in what the array tasks have recorded since.
+
+        :path: Location of the database file.
+        """
+
+        self.path = path
+        self.catalogue = None
+
+    def __getattr__(self, name):
+        if self.catalogue is None:
+            self.catalogue = catalogue_db.Catalogue(self.path)
+            self.catalogue.ingest(catalogue_db.journal_path(self.path))
+        return getattr(self.catalogue, name)
+
+
+# The commands: (name, function, help, error if -fj/-lj are missing). Array
+# commands (those with an error message) are called with the first and last
+# job, the others without arguments.
+COMMANDS = [
+    ('setup_run', setup_run, 'Setup the directory tree on scratch for one '
+     'iteration. Requires a param file.', None),
+    ('prepare_solve', prepare_solve, 'Symbolically links the mesh files to '
+     'all forward directories.', None),
+    ('submit_mesher', submit_mesher, 'Runs the mesher in the "mesh" '
+     'directory.', None),
+    ('submit_solver', submit_solver, 'Submit the job array script for the '
+     'current iteration.',
+     'Submitting the solver required -fj and -lj arguments.'),
+    ('process_synthetics', process_synthetics, 'Process synthetic '
+     'siesmograms.', 'Processing synthetics requires -fj and -lj arguments.'),
+    ('resynthesize', resynthesize, 'Reprocess the solver output of the '
+     'iteration with a new source time function (resynthesis_* parameters)',
+     'Resynthesis requires -fj and -lj arguments.'),
+    ('sync_lasif', sync_LASIF_to_scratch, 'Sync lasif directory from '
+     '/project to /scratch', None),
+    ('process_data', process_data, 'Process rawData.tar files on scratch.',
+     'Processing data requires -fj and -lj arguments.'),
+    ('clean_mseed', clean_mseed, 'Delete all .mseed files on project and '
+     'scratch', None),
+    ('destroy_all_but_raw', destroy_all_but_raw, 'Delete all .mseed files on '
+     'project and scratch', None),
+    ('unpack_mseed', unpack_mseed, 'Unpack tarred seismograms for a given '
+     'event', None),
+    ('distribute_adjoint_sources', distribute_adjoint_sources, None, None),
+    ('select_windows', select_windows, 'Unpack tarred seismograms for a '
+     'given event', 'Selecting windows requires -fj and -lj arguments.'),
+    ('finalize_sources', finalize_sources, 'Finalize adjoint sources for the '
+     'current iteration', 'Finalizing sources requires -fj and -lj '
+     'arguments.'),
+    ('build_all_caches', build_all_caches, 'Rebuild the LASIF caches of the '
+     'events and stations which changed since the last build, as a job array',
+     None),
+    ('update_catalogue', update_catalogue, 'Scan the LASIF and solver '
+     'directories, and record everything found in the catalogue', None),
+    ('status', print_status, 'Show what has been done for the current '
+     'iteration', None),
+    ('sources', print_sources, 'Show the source parameters of the events of '
+     'the current iteration (and cache them for processing)', None),
+    ('inventory', print_inventory, 'Read the MiniSEED headers of every '
+     'waveform archive, and show which stations and channels each event '
+     'has (cached)', None),
+    ('collect_telemetry', collect_telemetry, 'Read the array task logs and '
+     'sacct records into the catalogue', None),
+    ('telemetry_report', telemetry_report, 'Show runtimes, core usage and '
+     'stragglers of the array tasks of the current iteration', None),
+]
+
+
+def build_parser():
+    """
+    Builds the command line parser: a flag for every command in COMMANDS,
+    and the options they share.
+    """
 
+    parser = argparse.ArgumentParser(description='Assists in the setup of'
+                                     'specfem3d_globe on Piz Daint')
+    parser.add_argument('-f', type=str, help='Simulation driver parameter '
+                        'file.', required=True, metavar='parameter_file_name',
+                        dest='filename')
+    for name, _, help, _ in COMMANDS:
+        parser.add_argument('--' + name, action='store_true', help=help)
+
+    parser.add_argument('--sacct_file', type=str, help='Saved sacct '
+                        '--parsable2 output to use with --collect_telemetry '
+                        'instead of calling sacct')
+    parser.add_argument('--event_name', type=str, help='Event name for use '
+                        'with --unpack_mseed and --inventory')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Compile specfem in --setup_run even if the '
+                        'build cache has a matching build, and rebuild every '
+                        'LASIF cache in --build_all_caches')
+    parser.add_argument('--auto_array', action='store_true',
+                        help='Plan array submissions (batches, walltime, '
+                        'cores) from the runtimes of earlier iterations. -fj '
+                        'and -lj become optional')
+    parser.add_argument('--resume', action='store_true',
+                        help='Only resubmit the array tasks of events whose '
+                        'outputs are missing. -fj and -lj become optional')
+    parser.add_argument('--executor', type=str, choices=['slurm', 'local'],
+                        help='Submit the batch scripts to slurm, or run them '
+                        'on this machine (default: the executor parameter, '
+                        'or slurm)')
+    parser.add_argument('-fj', type=str, help='First index in job array to '
+                        'submit', metavar='first_job', dest='first_job')
+    parser.add_argument('-lj', type=str, help='Last index in job array to '
+                        'submit', metavar='last_job', dest='last_job')
+
+    return parser
+
+
+def main():
+    """
+    Parses the command line, reads the parameter file and runs the command.
+    """
 
-parser = argparse.ArgumentParser(description='Assists in the setup of'
-                                 'specfem3d_globe on Piz Daint')
-parser.add_argument('-f', type=str, help='Simulation driver parameter file.',
-                    required=True, metavar='parameter_file_name',
-                    dest='filename')
-parser.add_argument('--setup_run', action='store_true',
-                    help='Setup the directory tree on scratch for one '
-                    'iteration. Requires a param file.')
-parser.add_argument('--prepare_solve', action='store_true',
-                    help='Symbolically links the mesh files to all forward '
-                    'directories.')
-parser.add_argument('--submit_mesher', action='store_true',
-                    help='Runs the mesher in the "mesh" directory.')
-parser.add_argument('--submit_solver', action='store_true',
-                    help='Submit the job array script for the current '
-                    'iteration.')
-parser.add_argument('--process_synthetics', action='store_true',
-                    help='Process synthetic siesmograms.')
-parser.add_argument('--sync_lasif', action='store_true',
-                    help='Sync lasif directory from /project to /scratch')
-parser.add_argument('--process_data', action='store_true',
-                    help='Process rawData.tar files on scratch.')
-parser.add_argument('--clean_mseed', action='store_true',
-                    help='Delete all .mseed files on project and scratch')
-parser.add_argument('--destroy_all_but_raw', action='store_true',
-                    help='Delete all .mseed files on project and scratch')
-parser.add_argument('--unpack_mseed', action='store_true',
-                    help='Unpack tarred seismograms for a given event')
-parser.add_argument('--select_windows', action='store_true',
-                    help='Unpack tarred seismograms for a given event')                    
-parser.add_argument('--build_all_caches', action='store_true',
-                    help='Build all cache files for LASIF in serial')                                        
-parser.add_argument('--event_name', type=str, help='Event name for use with '
-                    '--unpack_mseed')                               
-parser.add_argument('--distribute_adjoint_sources', 
-                    action='store_true')
-parser.add_argument('-fj', type=str, help='First index in job array to submit',
-                    metavar='first_job', dest='first_job')
-parser.add_argument('-lj', type=str, help='Last index in job array to submit',
-                    metavar='last_job', dest='last_job')
-
-args = parser.parse_args()
-if args.submit_solver and args.first_job is None and args.last_job is None:
-    parser.error('Submitting the solver required -fj and -lj arguments.')
-if args.process_synthetics and args.first_job is None and args.last_job is None:
-    parser.error('Processing synthetics requires -fj and -lj arguments.')
-if args.process_data and args.first_job is None and args.last_job is None:
-    parser.error('Processing data requires -fj and -lj arguments.')
-if args.select_windows and args.first_job is None and args.last_job is None:
-    parser.error('Selecting windows requires -fj and -lj arguments.')
-
-p = read_parameter_file(args.filename)
-
-# Construct full run path.
-solver_base_path = os.path.join(p['scratch_path'], p['project_name'],
-                                p['iteration_name'])
-solver_root_path = os.path.join(p['scratch_path'], p['project_name'])
-mkdir_p(solver_base_path)
-
-if args.setup_run:
-    setup_run()
-elif args.prepare_solve:
-    prepare_solve()
-elif args.submit_mesher:
-    submit_mesher()
-elif args.submit_solver:
-    submit_solver(args.first_job, args.last_job)
-elif args.process_synthetics:
-    process_synthetics(args.first_job, args.last_job)
-elif args.process_data:
-    process_data(args.first_job, args.last_job)
-elif args.sync_lasif:
-    sync_LASIF()
-elif args.clean_mseed:
-    clean_mseed()
-elif args.destroy_all_but_raw:
-    destroy_all_but_raw()
-elif args.unpack_mseed:
-    unpack_mseed()
-elif args.distribute_adjoint_sources:
-    distribute_adjoint_sources()
-elif args.select_windows:
-    select_windows(args.first_job, args.last_job)
-elif args.build_all_caches:
-    build_all_caches()
+    global args, p, solver_base_path, solver_root_path, catalogue, executor
+
+    parser = build_parser()
+    args = parser.parse_args()
+    for name, _, _, range_error in COMMANDS:
+        if getattr(args, name) and range_error and \
+                not (args.auto_array or args.resume) \
+                and args.first_job is None and args.last_job is None:
+            parser.error(range_error)
+
+    p = read_parameter_file(args.filename)
+
+    # Construct full run path.
+    solver_base_path = os.path.join(p['scratch_path'], p['project_name'],
+                                    p['iteration_name'])
+    solver_root_path = os.path.join(p['scratch_path'], p['project_name'])
+    mkdir_p(solver_base_path)
+
+    # The catalogue is opened when a command first uses it. Array tasks find
+    # it through $CATALOGUE, and only ever write to its journal. SQLite needs
+    # working file locks, which Lustre scratch doesn't reliably give, so it
+    # lives in the home directory unless catalogue_path puts it elsewhere
+    # (somewhere the compute nodes can write its journal too).
+    catalogue = LazyCatalogue(p.get('catalogue_path', os.path.join(
+        os.path.expanduser('~'), '.oval_office', p['project_name'],
+        'catalogue.sqlite')))
+    mkdir_p(os.path.dirname(catalogue.path))
+    os.environ['CATALOGUE'] = catalogue.path
+
+    # Batch scripts go to slurm, or with the local executor run right here
+    # (local_processes tasks at a time).
+    executor = executors.make_executor(
+        args.executor or p.get('executor', 'slurm'),
+        int(p['local_processes']) if 'local_processes' in p else None)
+
+    # Sample format and archive compression of the waveforms the array tasks
+    # write (see waveform_storage.py and waveform_archive.py), the memory
+    # budget (MB) of the synthetics processing, and the node-local directory
+    # the LASIF stages extract archives to (see event_stage.py). Without
+    # them, each stage keeps its own default.
+    for parameter in ['storage_precision', 'archive_compression',
+                      'memory_budget', 'stage_root']:
+        if parameter in p:
+            os.environ[parameter.upper()] = p[parameter]
+
+    for name, function, _, range_error in COMMANDS:
+        if getattr(args, name):
+            if range_error:
+                function(args.first_job, args.last_job)
+            else:
+                function()
+            break
+
+
+if __name__ == '__main__':
+    main()
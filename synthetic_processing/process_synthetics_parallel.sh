@@ -12,42 +12,111 @@
 
 export MV2_ENABLE_AFFINITY=0
 export KMP_AFFINITY=compact
-export OMP_NUM_THREADS=8
+cores=${SLURM_CPUS_PER_TASK:-8}
+export OMP_NUM_THREADS=$cores
 
-if [ "$4" = '' ]; then
-  echo 'Usage: ./processSyntheticsParallel [master_forward_dir] [lasif_base_dir] [min_period] [max_period]'
+if [ "$4" = '' ] || [ -z "$MANIFEST" ]; then
+  echo 'Usage: ./processSyntheticsParallel [master_forward_dir] [lasif_base_dir] [min_period(s)] [max_period(s)] [process_synthetics.py options]'
+  echo 'Several period bands are given as comma separated periods.'
+  echo 'Submit through oval_office.py, which writes the task manifest ($MANIFEST).'
   exit
 fi
 
 iterationDir=$1
 lasifBaseDir=$2
-minPeriod=$3
-maxPeriod=$4
+minPeriods=${3//,/ }
+maxPeriods=${4//,/ }
+shift 4
+# Anything else goes to process_synthetics.py (i.e. the source time function
+# options of a resynthesis).
+extraOptions="$@"
 
-shopt -s nullglob
+# Get name of lasif synthetic dir
+iterationName=$(basename $iterationDir)
 
-# Get event names.
-array=($iterationDir/*)
+# Resampling weights and the source catalogue are kept next to the iteration
+# directories.
+weightCache=$(readlink -m $iterationDir/../resampling_weights)
+sourceCatalogue=$(readlink -m $iterationDir/../sources.$iterationName.npz)
 
-echo $myEventRaw
+# Sample format of the processed seismograms (process_synthetics.py's own
+# default unless set), and compression of the archive they go into
+# (storage_precision and archive_compression in the parameter file, exported
+# by oval_office.py).
+storage=""
+if [ -n "$STORAGE_PRECISION" ]; then
+  storage="--precision $STORAGE_PRECISION"
+fi
+case ${ARCHIVE_COMPRESSION:-none} in
+  gzip) archive=data.tar.gz; tarFlags="-czvf" ;;
+  zstd) archive=data.tar.zst; tarFlags="--use-compress-program=zstd -cvf" ;;
+  *) archive=data.tar; tarFlags="-cvf" ;;
+esac
 
-# Parse name from path.
-myEvent=${array[$SLURM_ARRAY_TASK_ID]}
-seismo_dir=$(readlink -m $myEvent/OUTPUT_FILES/)
+# On one node the seismograms are processed by a pool of processes, on more
+# (sbatch --nodes) by one MPI rank per core.
+if [ "${SLURM_NNODES:-1}" -gt 1 ]; then
+  launch="aprun -n $((SLURM_NNODES * cores)) -N $cores ./process_synthetics.py"
+  backend=mpi
+else
+  launch="aprun -n 1 -N 1 -d $cores ./process_synthetics.py"
+  backend=pool
+fi
 
-# Parse CMT file location.
-cmtFile=$myEvent/DATA/CMTSOLUTION
+# If a warm processing service runs on this node (process_service.py serve),
+# hand the events to it instead of starting python from cold for each. It
+# takes the process_synthetics.py arguments after --.
+if [ "$backend" = pool ] && [ -S "$PROCESS_SERVICE_SOCKET" ]; then
+  launch="./process_service.py submit --socket $PROCESS_SERVICE_SOCKET --"
+fi
 
-# Get name of lasif synthetic dir
-iterationName=$(basename $iterationDir)
-myEventRaw=${myEvent##*/}
-lasifSyntheticDir=$(readlink -m $lasifBaseDir/SYNTHETICS/$myEventRaw/ITERATION_$iterationName)
+# The events of this array task (one, or several packed together), and their
+# paths, are on its line of the task manifest written by oval_office.py.
+source $SLURM_SUBMIT_DIR/../components/manifest.sh
+
+for entry in $(manifest_line $MANIFEST $SLURM_ARRAY_TASK_ID); do
+(
+  # With several period bands, there is a synthetics directory for each
+  # (comma separated), and the seismograms of band i are in band<i>.
+  IFS='|' read myEvent seismo_dir cmtFile lasifSyntheticDirs <<< "$entry"
+  IFS=',' read -a lasifSyntheticDirs <<< "$lasifSyntheticDirs"
+
+  echo "EVENT: $myEvent"
+  echo "ITERATION: $iterationName"
+
+  # Read the binary (ASDF) output of the solver if it wrote one, rather than
+  # the ascii files.
+  seismoInput=$seismo_dir
+  if [ -f $seismo_dir/synthetic.h5 ]; then
+    seismoInput=$seismo_dir/synthetic.h5
+  fi
+
+  cd ../components/
+  $launch -f $seismoInput --min_p $minPeriods --max_p $maxPeriods -cmt $cmtFile --whole_directory \
+    --lasif_path $lasifBaseDir --iteration_name $iterationName --weight_cache $weightCache --backend $backend \
+    --source_catalogue $sourceCatalogue $storage \
+    ${MEMORY_BUDGET:+--memory_budget $MEMORY_BUDGET} $extraOptions
+
+  shopt -s nullglob
+  for band in ${!lasifSyntheticDirs[@]}; do
+    lasifSyntheticDir=${lasifSyntheticDirs[$band]}
+    bandDir=$seismo_dir
+    if [ ${#lasifSyntheticDirs[@]} -gt 1 ]; then
+      bandDir=$seismo_dir/band$band
+    fi
 
-cd ../components/
-aprun -n 1 -N 1 -d 8 ./process_synthetics.py -f $seismo_dir --min_p $minPeriod --max_p $maxPeriod -cmt $cmtFile --whole_directory
+    # Change to directory and tar files.
+    cd $bandDir
+    tar $tarFlags ./$archive *.mseed
+    mkdir -p $lasifSyntheticDir
+    mv $bandDir/$archive $lasifSyntheticDir
 
-# Change to directory and tar files.
-cd $seismo_dir
-tar -cvf ./data.tar *.mseed
-mkdir -p $lasifSyntheticDir
-mv $seismo_dir/data.tar $lasifSyntheticDir
+    # Record the archive in the catalogue.
+    if [ -n "$CATALOGUE" ]; then
+      lasifIteration=$(basename $lasifSyntheticDir)
+      $SLURM_SUBMIT_DIR/../components/update_catalogue.py --iteration ${lasifIteration#ITERATION_} \
+        --event $myEvent --stage synthetics --checksum $lasifSyntheticDir/$archive
+    fi
+  done
+)
+done